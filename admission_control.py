@@ -0,0 +1,114 @@
+import concurrent.futures
+import os
+import threading
+
+from latency_budget import LatencyBudget
+from metrics import counter
+from thread_governor import REQUEST_WORKERS, get_request_executor
+
+# Requests waiting for a worker before new ones are shed
+MAX_QUEUED_REQUESTS = int(
+    os.environ.get("CTS_MAX_QUEUED_REQUESTS", 2 * REQUEST_WORKERS)
+)
+
+# Seconds a request may take, queueing included, before its degraded answer is used
+REQUEST_DEADLINE = float(os.environ.get("CTS_REQUEST_DEADLINE", 15))
+
+# Seconds the degraded answer may take. It runs on the page thread while the
+# workers are busy, so unpaired scoring and distances are skipped once it is spent
+FALLBACK_BUDGET = float(os.environ.get("CTS_FALLBACK_BUDGET", 0.25))
+
+ADMISSIONS = counter(
+    "cts_admissions_total",
+    "Recommendation requests by admission outcome",
+    ["outcome"],
+)
+
+_in_flight = 0
+_stats = {"admitted": 0, "shed": 0, "timed_out": 0}
+_lock = threading.Lock()
+
+
+def _release(future):
+    global _in_flight
+    with _lock:
+        _in_flight -= 1
+
+
+def admit_request(fn, *args, **kwargs):
+    """
+    Run a recommender behind admission control.
+
+    A request is admitted while fewer than REQUEST_WORKERS + MAX_QUEUED_REQUESTS
+    are in flight. A request with a limited budget gets REQUEST_DEADLINE seconds,
+    then its budget is cancelled so it stops at its next stage instead of running
+    on next to its fallback. Requests without one, e.g. Debug Mode warming up
+    its explanation pool, are waited for. Shed and late requests are
+    answered by the recommender with explain=False instead: a precomputed or
+    scored answer without LIME, flagged as degraded. That answer gets a budget of
+    its own, FALLBACK_BUDGET seconds, the late request may still be using the
+    original one.
+
+    Args:
+        fn (callable): generate_recommendation or process_area_selections
+        *args: Positional arguments of fn
+        **kwargs: Keyword arguments of fn
+
+    Returns:
+        RecommendationResult: The full result, or the degraded one
+    """
+    global _in_flight
+    with _lock:
+        admitted = _in_flight < REQUEST_WORKERS + MAX_QUEUED_REQUESTS
+        if admitted:
+            _in_flight += 1
+            _stats["admitted"] += 1
+        else:
+            _stats["shed"] += 1
+    ADMISSIONS.inc(outcome="admitted" if admitted else "shed")
+
+    if admitted:
+        budget = kwargs.get("budget")
+        deadline = REQUEST_DEADLINE if budget is not None and budget.limited else None
+        future = get_request_executor().submit(fn, *args, **kwargs)
+        future.add_done_callback(_release)
+        try:
+            return future.result(timeout=deadline)
+        except concurrent.futures.TimeoutError:
+            # Dropped if it is still queued, a running request stops at its next stage
+            future.cancel()
+            budget.cancel()
+            with _lock:
+                _stats["timed_out"] += 1
+            ADMISSIONS.inc(outcome="timed_out")
+            print(f"{fn.__name__} missed its {REQUEST_DEADLINE}s deadline")
+    else:
+        print(f"Shedding {fn.__name__}, {_in_flight} requests in flight")
+
+    return fn(
+        *args,
+        **dict(
+            kwargs,
+            explain=False,
+            explain_workers=None,
+            budget=LatencyBudget(FALLBACK_BUDGET),
+        ),
+    )
+
+
+def admission_stats():
+    """
+    Load of the admission control.
+
+    Returns:
+        dict: Requests in flight, the limits and budgets, and how many were
+        admitted, shed and timed out
+    """
+    with _lock:
+        return {
+            "in_flight": _in_flight,
+            "max_in_flight": REQUEST_WORKERS + MAX_QUEUED_REQUESTS,
+            "deadline_seconds": REQUEST_DEADLINE,
+            "fallback_budget_seconds": FALLBACK_BUDGET,
+            **_stats,
+        }
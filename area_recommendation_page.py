@@ -1,12 +1,25 @@
+import os
 import streamlit as st
+import time
 import pandas as pd
 import plotly.express as px
 import random
 import folium
 from streamlit_folium import st_folium
-import json
-import urllib.parse
-from helper import process_area_selections, generate_area_recommendation_prompt
+from narrative import get_narrative, request_narrative
+from prompt_templates import render_prompt
+from session_store import clear_result, load_result, memory_footprint, store_result
+from admission_control import admission_stats, admit_request
+from latency_budget import LATENCY_BUDGET, LatencyBudget
+from profiler_hooks import profile_requested, recent_profiles, with_profiling
+from request_log import record_request
+from thread_governor import thread_settings
+from helper import (
+    CANDIDATE_LIMIT,
+    process_area_selections,
+    generate_area_recommendation_prompt,
+    load_zipcode_features,
+)
 
 
 def show():
@@ -110,31 +123,29 @@ def show():
         st.session_state.debug_mode = False
     if "recommended_zipcode" not in st.session_state:
         st.session_state.recommended_zipcode = None
-    if "confidence" not in st.session_state:
-        st.session_state.confidence = None
-    if "explanation" not in st.session_state:
-        st.session_state.explanation = None
-    if "distances" not in st.session_state:
-        st.session_state.distances = None
+    if "area_recommendation_data" not in st.session_state:
+        st.session_state.area_recommendation_data = None
 
-    # Load GeoJSON data
-    with open("data/zipcodes_with_geometry.geojson", "r") as f:
-        geojson_data = json.load(f)
+    # Load GeoJSON data, the Miami areas only once they are shown
+    cities = ["New York", "Los Angeles"]
+    if st.session_state.show_miami:
+        cities.append("Miami")
+    zipcode_features = load_zipcode_features(cities)
 
     # Filter zipcodes by city
     ny_zipcodes = [
         feature
-        for feature in geojson_data["features"]
+        for feature in zipcode_features
         if feature["properties"]["city_name"] == "New York"
     ]
     la_zipcodes = [
         feature
-        for feature in geojson_data["features"]
+        for feature in zipcode_features
         if feature["properties"]["city_name"] == "Los Angeles"
     ]
     miami_zipcodes = [
         feature
-        for feature in geojson_data["features"]
+        for feature in zipcode_features
         if feature["properties"]["city_name"] == "Miami"
     ]
 
@@ -503,29 +514,67 @@ def show():
 
             # Call helper function to process selections and store results
             with st.spinner("Finding your perfect Miami neighborhood..."):
-                recommendation_result = process_area_selections(
-                    more_of_zipcodes, less_of_zipcodes
+                # Admission control answers without LIME under load. Debug mode
+                # skips the latency budget and explains every candidate across
+                # all cores
+                started = time.perf_counter()
+                recommendation_result = admit_request(
+                    # Profiled when asked by header, environment or Debug Mode
+                    with_profiling(
+                        process_area_selections,
+                        profile_requested(
+                            st.context.headers, st.session_state.debug_mode
+                        ),
+                    ),
+                    more_of_zipcodes,
+                    less_of_zipcodes,
+                    explain_workers=(
+                        os.cpu_count() if st.session_state.debug_mode else None
+                    ),
+                    candidate_limit=CANDIDATE_LIMIT,
+                    budget=(
+                        None
+                        if st.session_state.debug_mode
+                        else LatencyBudget(LATENCY_BUDGET)
+                    ),
+                )
+                # Counted in the metrics, and logged for replays when capture is on
+                record_request(
+                    "area",
+                    more_of_zipcodes,
+                    less_of_zipcodes,
+                    recommendation_result,
+                    time.perf_counter() - started,
                 )
 
                 if recommendation_result:
-                    recommended_zip, confidence, explanation, distances = (
-                        recommendation_result
-                    )
                     # Store in session state
-                    st.session_state.recommended_zipcode = recommended_zip
-                    st.session_state.confidence = confidence
-                    st.session_state.explanation = explanation
-                    st.session_state.distances = distances
+                    st.session_state.recommended_zipcode = (
+                        recommendation_result.recommended
+                    )
+                    # The session only keeps a handle to the shared result cache
+                    store_result(
+                        st.session_state,
+                        "area_recommendation_data",
+                        recommendation_result,
+                    )
                     st.session_state.show_miami = True
                     st.rerun()
                 else:
                     st.error("Unable to generate a recommendation.")
 
-    if st.session_state.show_miami and st.session_state.recommended_zipcode:
+    # Load the recommendation, unless it was evicted from the cache
+    recommendation = load_result(st.session_state, "area_recommendation_data")
+    if (
+        st.session_state.show_miami
+        and st.session_state.recommended_zipcode
+        and recommendation
+    ):
         recommended_zip = st.session_state.recommended_zipcode
-        confidence = st.session_state.confidence
-        explanation = st.session_state.explanation
-        distances = st.session_state.distances
+        # Dict views are built on demand, the cache keeps the compact result
+        confidence = recommendation.confidence
+        explanation = recommendation.explanation_dict
+        distances = recommendation.distances_dict
 
         # Generate recommendation prompt
         area_recommendation = generate_area_recommendation_prompt(
@@ -598,9 +647,16 @@ def show():
         # Display Miami map
         st_folium(miami_map, width=900, height=600)
 
-        # Button to ask ChatGPT about the recommendation
-        encoded_prompt = urllib.parse.quote(area_recommendation)
-        chatgpt_url = f"https://chat.openai.com/?prompt={encoded_prompt}"
+        # Button to ask ChatGPT about the recommendation, with the size-capped prompt
+        _, chatgpt_url = render_prompt(
+            "area",
+            recommended_zip,
+            st.session_state.ny_more_of_areas + st.session_state.la_more_of_areas,
+            st.session_state.ny_less_of_areas + st.session_state.la_less_of_areas,
+            explanation,
+            distances,
+            compact=True,
+        )
 
         st.markdown(
             f"""
@@ -625,6 +681,43 @@ def show():
             unsafe_allow_html=True,
         )
 
+        if recommendation.degraded:
+            st.warning(
+                "We are very busy right now, so this recommendation comes without "
+                "its detailed explanation. Try again in a moment for the full one."
+            )
+
+        # Narrative of the recommendation, written in the background so the page
+        # never waits for the narrative backend
+        narrative_key = request_narrative(
+            area_recommendation,
+            {
+                "kind": "area",
+                "recommended": recommended_zip,
+                "top": st.session_state.ny_more_of_areas
+                + st.session_state.la_more_of_areas,
+                "bottom": st.session_state.ny_less_of_areas
+                + st.session_state.la_less_of_areas,
+                "explanation": explanation,
+                "distances": distances,
+            },
+        )
+        narrative = get_narrative(narrative_key, timeout=0.2)
+
+        # Poll for the narrative only while it is still being written
+        @st.fragment(run_every=None if narrative else 1)
+        def show_narrative():
+            text = get_narrative(narrative_key)
+            if text is None:
+                st.caption("✍️ Writing why you will love this area...")
+            elif narrative is None:
+                # Written since the page ran, show it and stop polling
+                st.rerun()
+            else:
+                st.info(text)
+
+        show_narrative()
+
         # Add Start Over button at the end
         if st.button("🔄 Start Over", use_container_width=True):
             st.session_state.ny_more_of_areas = []
@@ -633,9 +726,7 @@ def show():
             st.session_state.la_less_of_areas = []
             st.session_state.show_miami = False
             st.session_state.recommended_zipcode = None
-            st.session_state.confidence = None
-            st.session_state.explanation = None
-            st.session_state.distances = None
+            clear_result(st.session_state, "area_recommendation_data")
             st.rerun()
 
         # Debug mode content
@@ -714,4 +805,20 @@ def show():
                 st.markdown("### Distance Values")
                 st.json(distances)
 
+            # Memory held by this session and by the whole process
+            st.markdown("### Memory Footprint")
+            st.json(memory_footprint(st.session_state))
+
+            st.markdown("### Concurrency")
+            st.json(thread_settings())
+            st.json(admission_stats())
+
+            if recommendation.stages:
+                st.markdown("### Pipeline Stages")
+                st.json(recommendation.stages)
+
+            # At most one request is profiled per interval
+            st.markdown("### Profiles")
+            st.json(recent_profiles())
+
             st.markdown("</div>", unsafe_allow_html=True)
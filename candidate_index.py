@@ -0,0 +1,221 @@
+import numpy as np
+import polars as pl
+
+from distance_kernel import SCALAR_DISTANCES
+
+# Pair signals every entity is embedded with, against a set of anchor entities
+SIGNAL_COLUMNS = ["scenesDistance", "frequencyCosine"]
+
+
+def _standardize(matrix):
+    # Fill gaps with the column mean, then scale every column to unit variance
+    with np.errstate(invalid="ignore"):
+        means = np.nanmean(matrix, axis=0)
+    means = np.nan_to_num(means)
+    matrix = np.where(np.isnan(matrix), means, matrix)
+    stds = matrix.std(axis=0)
+    stds[stds == 0] = 1.0
+
+    return (matrix - means) / stds
+
+
+def build_entity_embeddings(
+    pairs_df, key_columns, attributes=None, max_anchors=64, seed=0
+):
+    """
+    Embed every entity of a pairs table as a fixed-length vector.
+
+    Each entity gets its scenesDistance and (1 - frequencyCosine) to a set of
+    anchor entities. When per-entity attributes are available they are
+    standardized and appended to the pair signals, and entities that only have
+    attributes are embedded too, with the mean pair signals.
+
+    Args:
+        pairs_df (pl.DataFrame): Pairs table
+        key_columns (tuple): The two entity key columns of the table
+        attributes (dict, optional): Prepared attributes from distance_kernel.load_entity_attributes
+        max_anchors (int): Maximum number of anchor entities
+        seed (int): Seed used to sample the anchors
+
+    Returns:
+        tuple: (keys, vectors) with one float32 row per entity key
+    """
+    key1, key2 = key_columns
+    signals = [
+        pl.col("scenesDistance").cast(pl.Float64),
+        (1 - pl.col("frequencyCosine").cast(pl.Float64)).alias("frequencyCosine"),
+    ]
+    edges = pl.concat(
+        [
+            pairs_df.select(
+                pl.col(key1).alias("entity"), pl.col(key2).alias("anchor"), *signals
+            ),
+            pairs_df.select(
+                pl.col(key2).alias("entity"), pl.col(key1).alias("anchor"), *signals
+            ),
+        ]
+    )
+
+    paired = sorted(set(edges["entity"].to_list()))
+    keys = paired
+    if attributes is not None:
+        keys = sorted(set(paired) | set(attributes["keys"]))
+    rows = {key: i for i, key in enumerate(keys)}
+
+    # Anchors need pairs, or every entity would be at an unknown distance
+    anchors = paired
+    if len(paired) > max_anchors:
+        rng = np.random.default_rng(seed)
+        anchors = [
+            paired[i] for i in sorted(rng.choice(len(paired), max_anchors, False))
+        ]
+    anchor_columns = {key: i for i, key in enumerate(anchors)}
+
+    edges = edges.filter(pl.col("anchor").is_in(anchors))
+    entity_rows = np.asarray([rows[key] for key in edges["entity"].to_list()])
+    anchor_cols = np.asarray([anchor_columns[key] for key in edges["anchor"].to_list()])
+
+    signal_matrix = np.full((len(keys), 2 * len(anchors)), np.nan)
+    for offset, column in enumerate(SIGNAL_COLUMNS):
+        signal_matrix[entity_rows, offset * len(anchors) + anchor_cols] = edges[
+            column
+        ].to_numpy()
+
+    # An anchor is at distance zero from itself
+    for key, column in anchor_columns.items():
+        signal_matrix[rows[key], column] = 0.0
+        signal_matrix[rows[key], len(anchors) + column] = 0.0
+
+    parts = [_standardize(signal_matrix)]
+
+    if attributes is not None:
+        attribute_rows = {key: i for i, key in enumerate(attributes["keys"])}
+        attribute_matrix = np.column_stack(
+            [attributes[name] for name in SCALAR_DISTANCES.values()]
+            + [attributes["latitude"], attributes["longitude"]]
+            + [attributes["race"], attributes["venue_share"]]
+        )
+        aligned = np.full((len(keys), attribute_matrix.shape[1]), np.nan)
+        for key, row in rows.items():
+            if key in attribute_rows:
+                aligned[row] = attribute_matrix[attribute_rows[key]]
+        parts.append(_standardize(aligned))
+
+    return keys, np.hstack(parts).astype(np.float32)
+
+
+class IVFIndex:
+    """
+    Inverted-file index: vectors are bucketed by their nearest k-means centroid,
+    and a query only scans the buckets of its n_probe closest centroids.
+    """
+
+    def __init__(self, vectors, n_lists=None, n_iter=10, seed=0):
+        self.vectors = vectors
+        n = len(vectors)
+        n_lists = min(n, n_lists or max(1, int(np.sqrt(n))))
+
+        # Plain Lloyd's k-means for the coarse quantizer
+        rng = np.random.default_rng(seed)
+        centroids = vectors[rng.choice(n, n_lists, replace=False)]
+        for _ in range(n_iter):
+            assignment = self._nearest_centroids(vectors, centroids, 1)[:, 0]
+            for c in range(n_lists):
+                members = vectors[assignment == c]
+                if len(members):
+                    centroids[c] = members.mean(axis=0)
+
+        self.centroids = centroids
+        assignment = self._nearest_centroids(vectors, centroids, 1)[:, 0]
+        self.lists = [np.flatnonzero(assignment == c) for c in range(n_lists)]
+
+    @staticmethod
+    def _squared_distances(queries, vectors):
+        return (
+            (queries**2).sum(axis=1)[:, None]
+            + (vectors**2).sum(axis=1)[None, :]
+            - 2 * queries @ vectors.T
+        )
+
+    def _nearest_centroids(self, queries, centroids, n_probe):
+        distances = self._squared_distances(queries, centroids)
+        return np.argsort(distances, axis=1)[:, :n_probe]
+
+    def nearest(self, queries, k, n_probe=None, allowed=None):
+        """
+        Find the k vectors closest to any of the queries.
+
+        Args:
+            queries (np.ndarray): (n_queries, dim) query vectors
+            k (int): Number of neighbours to return
+            n_probe (int, optional): Buckets scanned per query, defaults to a quarter of them
+            allowed (np.ndarray, optional): Boolean mask of the vectors that may be returned
+
+        Returns:
+            np.ndarray: Row indices of the neighbours, closest first
+        """
+        n_probe = min(n_probe or max(1, len(self.lists) // 4), len(self.lists))
+
+        # Widen the probe until the scanned buckets hold at least k vectors
+        while True:
+            probed = np.unique(
+                self._nearest_centroids(queries, self.centroids, n_probe)
+            )
+            scanned = np.concatenate([self.lists[c] for c in probed])
+            if allowed is not None:
+                scanned = scanned[allowed[scanned]]
+            if len(scanned) >= k or n_probe == len(self.lists):
+                break
+            n_probe = min(2 * n_probe, len(self.lists))
+
+        if len(scanned) == 0:
+            return scanned
+
+        # Exact distance inside the probed buckets, nearest to any query
+        distances = self._squared_distances(queries, self.vectors[scanned]).min(axis=0)
+        order = np.argsort(distances, kind="stable")[:k]
+
+        return scanned[order]
+
+
+class CandidateIndex:
+    """
+    Approximate nearest-neighbour candidate generation over a pairs table.
+    """
+
+    def __init__(self, pairs_df, key_columns, attributes=None, n_lists=None):
+        self.keys, vectors = build_entity_embeddings(
+            pairs_df, key_columns, attributes=attributes
+        )
+        self.rows = {key: i for i, key in enumerate(self.keys)}
+        self.index = IVFIndex(vectors, n_lists=n_lists)
+
+    def retrieve(self, liked, candidates, limit, n_probe=None):
+        """
+        Keep the candidates closest to the entities the user likes.
+
+        Args:
+            liked (list): Entity keys the user wants more of
+            candidates (list): Entity keys that may be recommended
+            limit (int): Maximum number of candidates to keep
+            n_probe (int, optional): Buckets scanned per liked entity
+
+        Returns:
+            list: At most limit candidates, closest first. Candidates that are
+            not in the index are kept, since they cannot be ranked
+        """
+        query_rows = [self.rows[key] for key in liked if key in self.rows]
+        if not query_rows:
+            return list(candidates)
+
+        allowed = np.zeros(len(self.keys), dtype=bool)
+        allowed[[self.rows[key] for key in candidates if key in self.rows]] = True
+        unindexed = [key for key in candidates if key not in self.rows]
+
+        neighbours = self.index.nearest(
+            self.index.vectors[query_rows], limit, n_probe=n_probe, allowed=allowed
+        )
+
+        return [self.keys[row] for row in neighbours] + unindexed[
+            : max(0, limit - len(neighbours))
+        ]
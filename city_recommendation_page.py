@@ -1,15 +1,25 @@
 import folium
+import os
 import streamlit as st
+import time
 import random
 from folium.features import Marker
 from streamlit_folium import st_folium
 from helper import (
+    CANDIDATE_LIMIT,
     generate_recommendation,
     generate_travel_recommendation_prompt,
     get_city_coordinates_data,
 )
 import plotly.graph_objects as go
-import urllib.parse
+from narrative import get_narrative, request_narrative
+from prompt_templates import render_prompt
+from session_store import clear_result, load_result, memory_footprint, store_result
+from admission_control import admission_stats, admit_request
+from latency_budget import LATENCY_BUDGET, LatencyBudget
+from profiler_hooks import profile_requested, recent_profiles, with_profiling
+from request_log import record_request
+from thread_governor import thread_settings
 
 
 # st.set_page_config(layout="wide", page_title="City Explorer", )
@@ -242,7 +252,7 @@ def show():
                 st.session_state.less_of_cities = []
                 st.session_state.recommended_city = None
                 st.session_state.show_recommendation_details = False
-                st.session_state.recommendation_data = None
+                clear_result(st.session_state, "recommendation_data")
                 st.rerun()
 
         with col2:
@@ -258,18 +268,50 @@ def show():
                         and city not in st.session_state.less_of_cities
                     ]
                     with st.spinner("Finding your perfect city match..."):
-                        recommendation_result = generate_recommendation(
+                        # Admission control answers without LIME under load. Debug
+                        # mode skips the latency budget and explains every candidate
+                        # across all cores
+                        started = time.perf_counter()
+                        recommendation_result = admit_request(
+                            # Profiled when asked by header, environment or Debug Mode
+                            with_profiling(
+                                generate_recommendation,
+                                profile_requested(
+                                    st.context.headers, st.session_state.debug_mode
+                                ),
+                            ),
                             non_selected,
                             st.session_state.more_of_cities,
                             st.session_state.less_of_cities,
+                            explain_workers=(
+                                os.cpu_count() if st.session_state.debug_mode else None
+                            ),
+                            candidate_limit=CANDIDATE_LIMIT,
+                            budget=(
+                                None
+                                if st.session_state.debug_mode
+                                else LatencyBudget(LATENCY_BUDGET)
+                            ),
+                        )
+                        # Counted in the metrics, and logged for replays when capture is on
+                        record_request(
+                            "city",
+                            st.session_state.more_of_cities,
+                            st.session_state.less_of_cities,
+                            recommendation_result,
+                            time.perf_counter() - started,
                         )
 
                     if recommendation_result:
-                        city, confidence, lime_explanation, distances = (
-                            recommendation_result
+                        st.session_state.recommended_city = (
+                            recommendation_result.recommended
+                        )
+                        # The session only keeps a handle to the shared result cache
+                        store_result(
+                            st.session_state,
+                            "recommendation_data",
+                            recommendation_result,
                         )
-                        st.session_state.recommended_city = city
-                        st.session_state.recommendation_data = recommendation_result
                         st.session_state.show_recommendation_details = True
                         st.rerun()
                     else:
@@ -278,15 +320,17 @@ def show():
                     st.warning("Please select at least one city in either category.")
         st.markdown("</div>", unsafe_allow_html=True)
 
-    # Display recommendation if available
+    # Display recommendation if available, unless it was evicted from the cache
+    recommendation = load_result(st.session_state, "recommendation_data")
     if (
         st.session_state.recommended_city
         and st.session_state.show_recommendation_details
-        and st.session_state.recommendation_data
+        and recommendation
     ):
-        confidence = st.session_state.recommendation_data[1]
-        lime_explanation = st.session_state.recommendation_data[2]
-        distances = st.session_state.recommendation_data[3]
+        # Dict views are built on demand, the cache keeps the compact result
+        confidence = recommendation.confidence
+        lime_explanation = recommendation.explanation_dict
+        distances = recommendation.distances_dict
 
         # Generate travel recommendation prompt
         travel_recommendation = generate_travel_recommendation_prompt(
@@ -296,9 +340,16 @@ def show():
             lime_explanation,
             distances,
         )
-        # Button to ask ChatGPT about the recommendation
-        encoded_prompt = urllib.parse.quote(travel_recommendation)
-        chatgpt_url = f"https://chat.openai.com/?prompt={encoded_prompt}"
+        # Button to ask ChatGPT about the recommendation, with the size-capped prompt
+        _, chatgpt_url = render_prompt(
+            "city",
+            st.session_state.recommended_city,
+            st.session_state.more_of_cities,
+            st.session_state.less_of_cities,
+            lime_explanation,
+            distances,
+            compact=True,
+        )
 
         st.markdown(
             f"""
@@ -323,6 +374,41 @@ def show():
             unsafe_allow_html=True,
         )
 
+        if recommendation.degraded:
+            st.warning(
+                "We are very busy right now, so this recommendation comes without "
+                "its detailed explanation. Try again in a moment for the full one."
+            )
+
+        # Narrative of the recommendation, written in the background so the page
+        # never waits for the narrative backend
+        narrative_key = request_narrative(
+            travel_recommendation,
+            {
+                "kind": "city",
+                "recommended": st.session_state.recommended_city,
+                "top": list(st.session_state.more_of_cities),
+                "bottom": list(st.session_state.less_of_cities),
+                "explanation": lime_explanation,
+                "distances": distances,
+            },
+        )
+        narrative = get_narrative(narrative_key, timeout=0.2)
+
+        # Poll for the narrative only while it is still being written
+        @st.fragment(run_every=None if narrative else 1)
+        def show_narrative():
+            text = get_narrative(narrative_key)
+            if text is None:
+                st.caption("✍️ Writing why you will love this city...")
+            elif narrative is None:
+                # Written since the page ran, show it and stop polling
+                st.rerun()
+            else:
+                st.info(text)
+
+        show_narrative()
+
         # Debug mode content
         if st.session_state.debug_mode:
             st.markdown('<div class="debug-box">', unsafe_allow_html=True)
@@ -403,6 +489,22 @@ def show():
                 st.markdown("### Distance Values")
                 st.json(distances)
 
+            # Memory held by this session and by the whole process
+            st.markdown("### Memory Footprint")
+            st.json(memory_footprint(st.session_state))
+
+            st.markdown("### Concurrency")
+            st.json(thread_settings())
+            st.json(admission_stats())
+
+            if recommendation.stages:
+                st.markdown("### Pipeline Stages")
+                st.json(recommendation.stages)
+
+            # At most one request is profiled per interval
+            st.markdown("### Profiles")
+            st.json(recent_profiles())
+
             st.markdown("</div>", unsafe_allow_html=True)
 
     # Handle marker clicks
@@ -469,7 +571,7 @@ def show():
                             # Clear recommendation data when a new city is selected
                             st.session_state.recommended_city = None
                             st.session_state.show_recommendation_details = False
-                            st.session_state.recommendation_data = None
+                            clear_result(st.session_state, "recommendation_data")
                             st.rerun()
 
                     with col2:
@@ -487,5 +589,5 @@ def show():
                             # Clear recommendation data when a new city is selected
                             st.session_state.recommended_city = None
                             st.session_state.show_recommendation_details = False
-                            st.session_state.recommendation_data = None
+                            clear_result(st.session_state, "recommendation_data")
                             st.rerun()
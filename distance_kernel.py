@@ -0,0 +1,180 @@
+import numpy as np
+import polars as pl
+
+EARTH_RADIUS_METERS = 6371008.8
+
+# Scalar attributes compared by absolute difference, keyed by pair column
+SCALAR_DISTANCES = {
+    "incomeDistance": "income",
+    "populationDistance": "population",
+    "bachelorDistance": "bachelor",
+    "employmentDistance": "employment",
+    "votingDistance": "voting",
+}
+
+# Vector attributes are spread over prefixed columns, e.g. race_white, venue_bar
+RACE_PREFIX = "race_"
+VENUE_PREFIX = "venue_"
+
+# Numeric columns of a pairs table, in the order of similar_cbsa_pairs.csv
+PAIR_COLUMNS = [
+    "raceDistance",
+    "incomeDistance",
+    "geographicDistance",
+    "scenesDistance",
+    "populationDistance",
+    "employmentDistance",
+    "bachelorDistance",
+    "frequencyDistance",
+    "frequencyCosine",
+    "categoriesJaccard",
+    "votingDistance",
+]
+
+
+def load_entity_attributes(csv_file, key_column, label_column=None):
+    """
+    Load per-entity attributes and precompute what the distance kernel needs.
+
+    The CSV holds one row per city or zipcode with latitude, longitude,
+    population, income, bachelor, employment and voting columns, race shares
+    in race_* columns and venue-category frequencies in venue_* columns.
+
+    Args:
+        csv_file (str): Path of the entity attributes CSV
+        key_column (str): Column identifying each entity (city name or zipcode)
+        label_column (str, optional): Extra per-entity column kept alongside the key
+
+    Returns:
+        dict: Entity keys, labels and attribute arrays, one row per entity
+    """
+    df = pl.read_csv(csv_file)
+    race_columns = [c for c in df.columns if c.startswith(RACE_PREFIX)]
+    venue_columns = [c for c in df.columns if c.startswith(VENUE_PREFIX)]
+
+    def matrix(columns):
+        return df.select(columns).cast(pl.Float64).fill_null(np.nan).to_numpy()
+
+    attributes = {
+        "keys": df[key_column].to_list(),
+        "labels": df[label_column].to_list() if label_column else None,
+        "latitude": matrix(["latitude"])[:, 0],
+        "longitude": matrix(["longitude"])[:, 0],
+        "race": matrix(race_columns),
+        "venue": matrix(venue_columns),
+    }
+    for attribute in SCALAR_DISTANCES.values():
+        attributes[attribute] = matrix([attribute])[:, 0]
+
+    return prepare_attributes(attributes)
+
+
+def prepare_attributes(attributes):
+    """
+    Add the per-entity terms reused by every block of pairs.
+
+    Args:
+        attributes (dict): Raw attribute arrays, one row per entity
+
+    Returns:
+        dict: The same attributes with the derived arrays added
+    """
+    venue = attributes["venue"]
+    race = attributes["race"]
+
+    # Scene profile: share of each venue category within the entity
+    venue_total = venue.sum(axis=1, keepdims=True)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        venue_share = venue / venue_total
+
+    presence = (venue > 0).astype(np.float64)
+
+    attributes.update(
+        {
+            "latitude_rad": np.radians(attributes["latitude"]),
+            "longitude_rad": np.radians(attributes["longitude"]),
+            "race_sq": (race**2).sum(axis=1),
+            "venue_sq": (venue**2).sum(axis=1),
+            "venue_share": venue_share,
+            "venue_share_sq": (venue_share**2).sum(axis=1),
+            "presence": presence,
+            "presence_count": presence.sum(axis=1),
+        }
+    )
+
+    return attributes
+
+
+def select_entities(attributes, rows):
+    """
+    Select a block of entities from the attribute arrays.
+
+    Args:
+        attributes (dict): Prepared attribute arrays
+        rows (slice or np.ndarray): Entities to keep
+
+    Returns:
+        dict: Attribute arrays restricted to the selected entities
+    """
+    return {
+        name: values[rows]
+        for name, values in attributes.items()
+        if isinstance(values, np.ndarray)
+    }
+
+
+def _euclidean(a, b, a_sq, b_sq):
+    # |a - b|² = |a|² + |b|² - 2 a·b, clipped against rounding below zero
+    squared = a_sq[:, None] + b_sq[None, :] - 2 * (a @ b.T)
+    return np.sqrt(np.maximum(squared, 0))
+
+
+def pair_distances(a, b):
+    """
+    Compute every pair column between two blocks of entities.
+
+    Args:
+        a (dict): Prepared attributes of the first block (n_a entities)
+        b (dict): Prepared attributes of the second block (n_b entities)
+
+    Returns:
+        dict: (n_a, n_b) float64 matrix per pair column
+    """
+    distances = {}
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for column, attribute in SCALAR_DISTANCES.items():
+            distances[column] = np.abs(a[attribute][:, None] - b[attribute][None, :])
+
+        # Great-circle distance between the entity centroids, in meters
+        dlat = b["latitude_rad"][None, :] - a["latitude_rad"][:, None]
+        dlon = b["longitude_rad"][None, :] - a["longitude_rad"][:, None]
+        h = (
+            np.sin(dlat / 2) ** 2
+            + np.cos(a["latitude_rad"])[:, None]
+            * np.cos(b["latitude_rad"])[None, :]
+            * np.sin(dlon / 2) ** 2
+        )
+        distances["geographicDistance"] = (
+            2 * EARTH_RADIUS_METERS * np.arcsin(np.sqrt(np.minimum(h, 1)))
+        )
+
+        distances["raceDistance"] = _euclidean(
+            a["race"], b["race"], a["race_sq"], b["race_sq"]
+        )
+        distances["scenesDistance"] = _euclidean(
+            a["venue_share"], b["venue_share"], a["venue_share_sq"], b["venue_share_sq"]
+        )
+        distances["frequencyDistance"] = _euclidean(
+            a["venue"], b["venue"], a["venue_sq"], b["venue_sq"]
+        )
+        distances["frequencyCosine"] = (a["venue"] @ b["venue"].T) / np.sqrt(
+            a["venue_sq"][:, None] * b["venue_sq"][None, :]
+        )
+
+        # Jaccard index of the venue categories present in each entity
+        shared = a["presence"] @ b["presence"].T
+        union = a["presence_count"][:, None] + b["presence_count"][None, :] - shared
+        distances["categoriesJaccard"] = shared / union
+
+    return {column: distances[column] for column in PAIR_COLUMNS}
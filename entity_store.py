@@ -0,0 +1,109 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from distance_kernel import load_entity_attributes, pair_distances, select_entities
+from ingest_pairs import ENTITY_COLUMNS
+
+# Per-entity attribute files, one row per CBSA or zipcode
+ENTITY_FILES = {
+    "cbsa": os.environ.get("CTS_CBSA_ENTITIES", "data/cbsa_entities.csv"),
+    "zipcode": os.environ.get("CTS_ZIPCODE_ENTITIES", "data/zipcode_entities.csv"),
+}
+
+# Stores loaded by this process, keyed by kind
+_entity_stores = {}
+
+
+class EntityFeatureStore:
+    """
+    Raw attributes for every entity, so the distances between any candidate and
+    the selected entities can be computed on demand instead of looked up in a
+    pre-joined pairs table.
+    """
+
+    def __init__(self, csv_file, kind):
+        columns = ENTITY_COLUMNS[kind]
+        self.attributes = load_entity_attributes(
+            csv_file, columns["key"], columns["label"]
+        )
+        self.rows = {key: i for i, key in enumerate(self.attributes["keys"])}
+
+    def __contains__(self, key):
+        return key in self.rows
+
+    def pair_distances(self, candidates, selected):
+        """
+        Compute the pair columns between candidates and selected entities.
+
+        Args:
+            candidates (list): Candidate entity keys
+            selected (list): Selected entity keys
+
+        Returns:
+            dict: (n_candidates, n_selected) matrix per pair column
+        """
+        candidate_rows = np.asarray([self.rows[key] for key in candidates], dtype=int)
+        selected_rows = np.asarray([self.rows[key] for key in selected], dtype=int)
+
+        return pair_distances(
+            select_entities(self.attributes, candidate_rows),
+            select_entities(self.attributes, selected_rows),
+        )
+
+    def aggregate_features(self, candidates, top, bottom, features):
+        """
+        Build the model input for each candidate: the mean distance of every
+        feature to the top entities and to the bottom entities.
+
+        Args:
+            candidates (list): Candidate entity keys
+            top (list): Entity keys the user wants more of
+            bottom (list): Entity keys the user wants less of
+            features (list): Distance features, in model order
+
+        Returns:
+            pd.DataFrame: One row per candidate, indexed by key, with the
+            mean_top_* and mean_bottom_* columns. Candidates without any
+            selected entity in the store are left out
+        """
+        candidates = [key for key in candidates if key in self.rows]
+        top = [key for key in top if key in self.rows]
+        bottom = [key for key in bottom if key in self.rows]
+        if not candidates or not (top or bottom):
+            return pd.DataFrame()
+
+        columns = {}
+        for prefix, selected in [("mean_top_", top), ("mean_bottom_", bottom)]:
+            if selected:
+                distances = self.pair_distances(candidates, selected)
+            for feat in features:
+                if not selected:
+                    columns[f"{prefix}{feat}"] = np.full(len(candidates), np.nan)
+                    continue
+                # NaN-aware mean, like drop_nans().drop_nulls().mean() on the pairs table
+                values = distances[feat]
+                counts = (~np.isnan(values)).sum(axis=1)
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    columns[f"{prefix}{feat}"] = np.nansum(values, axis=1) / counts
+
+        return pd.DataFrame(columns, index=candidates)
+
+
+def load_entity_store(kind):
+    """
+    Load the entity feature store once per process.
+
+    Args:
+        kind (str): "cbsa" or "zipcode"
+
+    Returns:
+        EntityFeatureStore: The store, or None when no attribute file exists
+    """
+    if kind not in _entity_stores:
+        if not os.path.exists(ENTITY_FILES[kind]):
+            return None
+        _entity_stores[kind] = EntityFeatureStore(ENTITY_FILES[kind], kind)
+
+    return _entity_stores[kind]
@@ -0,0 +1,144 @@
+import os
+
+import numpy as np
+
+DEFAULT_EXPLAINER_DIR = os.environ.get("CTS_EXPLAINER_DIR", "data/explainers")
+
+# Explainers loaded by this process, keyed by (kind, model_version, data_version)
+_explainers = {}
+
+
+def sample_background(
+    pair_index,
+    candidate_mask,
+    selectable_mask,
+    n_selections=256,
+    max_more=3,
+    max_less=2,
+    max_rows=2000,
+    seed=0,
+    drop_missing=True,
+):
+    """
+    Sample model inputs the way users produce them: random small selections
+    scored against every candidate.
+
+    Args:
+        pair_index (PairIndex): Pair index of the recommender
+        candidate_mask (np.ndarray): Entities the recommender may recommend
+        selectable_mask (np.ndarray): Entities the user may select
+        n_selections (int): Random selections to draw
+        max_more (int): Largest more-of selection
+        max_less (int): Largest less-of selection
+        max_rows (int): Rows kept in the sample
+        seed (int): Seed of the sampling
+        drop_missing (bool): Drop rows with NaNs, which LIME's scaler cannot use.
+            The rows being explained can still have them, see
+            helper.explain_prediction_with_lime
+
+    Returns:
+        np.ndarray: (n_rows, n_model_features) background sample
+    """
+    rng = np.random.default_rng(seed)
+    selectable_ids = np.flatnonzero(selectable_mask)
+
+    rows = []
+    for _ in range(n_selections):
+        n_more = rng.integers(1, max_more + 1)
+        n_less = rng.integers(1, max_less + 1)
+        picked = rng.choice(
+            selectable_ids, min(n_more + n_less, len(selectable_ids)), replace=False
+        )
+        more_mask = pair_index.mask(picked[:n_more])
+        less_mask = pair_index.mask(picked[n_more:])
+
+        candidate_ids = np.flatnonzero(candidate_mask & ~(more_mask | less_mask))
+        X, _ = pair_index.features_matrix(candidate_ids, more_mask, less_mask)
+        rows.append(X)
+
+    rows = np.vstack(rows)
+    if drop_missing:
+        # LIME's scaler needs complete rows
+        rows = rows[~np.isnan(rows).any(axis=1)]
+    if len(rows) > max_rows:
+        rows = rows[rng.choice(len(rows), max_rows, replace=False)]
+
+    return rows
+
+
+def build_explainer(background, feature_names):
+    """
+    Build a LIME explainer whose scaler statistics come from a background sample.
+
+    Args:
+        background (np.ndarray): Background sample of model inputs
+        feature_names (list): Model feature names
+
+    Returns:
+        LimeTabularExplainer: The explainer
+    """
+    from lime.lime_tabular import LimeTabularExplainer
+
+    return LimeTabularExplainer(
+        background,
+        feature_names=feature_names,
+        class_names=["Not Top", "Is Top"],
+        discretize_continuous=False,
+        mode="classification",
+        random_state=0,
+    )
+
+
+def load_explainer(
+    kind,
+    model_version,
+    data_version,
+    feature_names,
+    sample,
+    explainer_dir=DEFAULT_EXPLAINER_DIR,
+):
+    """
+    Load the explainer of a model once per process.
+
+    The background sample is saved to disk the first time, so later processes
+    (and the explanation workers) only load it instead of sampling again.
+
+    Args:
+        kind (str): "cbsa" or "zipcode"
+        model_version (str): Version of the model, a new model gets a new sample
+        data_version (str): Version of the pairs table the sample is drawn from,
+            a new table gets a new sample too
+        feature_names (list): Model feature names
+        sample (callable): Returns the background sample when none is saved
+        explainer_dir (str): Directory the background samples are saved in
+
+    Returns:
+        LimeTabularExplainer: The explainer, or None when no background rows
+        could be sampled
+    """
+    key = (kind, model_version, data_version)
+    if key in _explainers:
+        return _explainers[key]
+
+    path = os.path.join(explainer_dir, f"{kind}-{model_version}-{data_version}.npy")
+    background = None
+    if os.path.exists(path):
+        try:
+            background = np.load(path)
+        except (OSError, ValueError) as e:
+            print(f"Resampling LIME background {path}: {e}")
+
+    if background is None:
+        background = sample()
+        if len(background) == 0:
+            return None
+
+        # Write to a temporary file first so readers never see a partial sample
+        os.makedirs(explainer_dir, exist_ok=True)
+        tmp_path = f"{path}.tmp-{os.getpid()}.npy"
+        np.save(tmp_path, background)
+        os.replace(tmp_path, path)
+
+    _explainers[key] = build_explainer(background, feature_names)
+
+    return _explainers[key]
@@ -0,0 +1,155 @@
+import atexit
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+# Booster and LIME explainer loaded once per worker process by the pool initializer
+_worker_booster = None
+_worker_explainer = None
+
+# Pools are kept alive between calls, keyed by (model_file, max_workers)
+_pools = {}
+
+
+def _init_worker(model_file):
+    """
+    Load the scoring model and its LIME explainer once when a worker process starts.
+
+    Args:
+        model_file (str): Path of the LightGBM model file
+    """
+    global _worker_booster, _worker_explainer
+
+    from helper import get_lime_explainer, load_booster
+
+    _worker_booster = load_booster(model_file)
+    # The parent saved the background sample to disk, so workers load it and
+    # rebuild the explainer instead of sampling again. Its key needs the pairs
+    # table version, which builds this worker's own pair index
+    _worker_explainer = get_lime_explainer(model_file)
+
+
+def _explain_chunk(rows, feature_names, labels):
+    """
+    Explain a chunk of candidate rows inside a worker process.
+
+    Args:
+        rows (list): Feature values for each candidate
+        feature_names (list): Model feature names, in the same order as the rows
+        labels (list): Candidate names, used in failure messages
+
+    Returns:
+        tuple: Sorted feature importance dictionary per row, and how many rows
+        LIME failed on, counted by the parent whose metrics are exported
+    """
+    import pandas as pd
+    from helper import explain_feature_importance
+
+    explanations = []
+    failures = 0
+    for label, row in zip(labels, rows):
+        X = pd.DataFrame([row], columns=feature_names)
+        feature_importance, failed = explain_feature_importance(
+            _worker_booster, X, label, _worker_explainer
+        )
+        explanations.append(feature_importance)
+        failures += failed
+
+    return explanations, failures
+
+
+def get_pool(model_file, max_workers=None):
+    """
+    Get (or start) a process pool whose workers have the booster preloaded.
+
+    Workers are spawned rather than forked, since forking a process that
+    already runs polars and Streamlit threads is not safe.
+
+    Args:
+        model_file (str): Path of the LightGBM model file
+        max_workers (int, optional): Number of worker processes, defaults to every core
+
+    Returns:
+        ProcessPoolExecutor: The pool for this model and worker count
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    key = (model_file, max_workers)
+
+    if key not in _pools:
+        _pools[key] = ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(model_file,),
+        )
+
+    return _pools[key]
+
+
+def shutdown_pools():
+    """
+    Stop every worker pool started by this module.
+    """
+    for pool in _pools.values():
+        pool.shutdown(wait=True, cancel_futures=True)
+    _pools.clear()
+
+
+atexit.register(shutdown_pools)
+
+
+def explain_candidates(
+    model_file, feature_frames, labels=None, max_workers=None, chunk_size=None
+):
+    """
+    Explain many candidate predictions with LIME across a process pool.
+
+    Args:
+        model_file (str): Path of the LightGBM model file the workers load
+        feature_frames (list): One-row feature DataFrames, one per candidate
+        labels (list, optional): Candidate names, used in failure messages
+        max_workers (int, optional): Number of worker processes, defaults to every core
+        chunk_size (int, optional): Candidates sent to a worker at a time, defaults to
+            about two chunks per worker
+
+    Returns:
+        list: Sorted feature importance dictionary per candidate, in input order
+    """
+    if not feature_frames:
+        return []
+
+    if labels is None:
+        labels = list(range(len(feature_frames)))
+
+    max_workers = max_workers or os.cpu_count() or 1
+    if chunk_size is None:
+        chunk_size = max(1, math.ceil(len(feature_frames) / (max_workers * 2)))
+
+    # Send plain rows to the workers instead of pickling whole DataFrames
+    feature_names = list(feature_frames[0].columns)
+    rows = [X.iloc[0].tolist() for X in feature_frames]
+
+    pool = get_pool(model_file, max_workers)
+    futures = [
+        pool.submit(
+            _explain_chunk,
+            rows[start : start + chunk_size],
+            feature_names,
+            labels[start : start + chunk_size],
+        )
+        for start in range(0, len(rows), chunk_size)
+    ]
+
+    from helper import LIME_FAILURES
+
+    explanations = []
+    failures = 0
+    for future in futures:
+        chunk_explanations, chunk_failures = future.result()
+        explanations.extend(chunk_explanations)
+        failures += chunk_failures
+    if failures:
+        LIME_FAILURES.inc(failures)
+
+    return explanations
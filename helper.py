@@ -1,10 +1,162 @@
 import polars as pl
 import random
-import lightgbm as lgb
 import numpy as np
-import lime
-from lime.lime_tabular import LimeTabularExplainer
 import pandas as pd
+import json
+import os
+from shared_store import PAIR_TABLES, ZIPCODE_GEOMETRY_FILE, attach_store
+from candidate_index import CandidateIndex
+from entity_store import load_entity_store
+from explainer_store import load_explainer, sample_background
+from latency_budget import LatencyBudget
+from metrics import counter
+from packed_model import top_k_rows
+from pair_index import PairIndex
+from prompt_templates import FEATURE_TRANSLATIONS, render_prompt
+from recommendation_cache import (
+    get_recommendation_cache,
+    recommendation_key,
+    remember_recommendation,
+)
+from recommendation_result import (
+    FEATURES,
+    INSUFFICIENT_DATA_EXPLANATION,
+    MODEL_FEATURES,
+    RANDOM_EXPLANATION,
+    Explanation,
+    FeatureValues,
+    RecommendationResult,
+)
+from recommendation_table import (
+    DEFAULT_TABLE_DIR,
+    file_version,
+    load_recommendation_table,
+    materialize,
+)
+
+CBSA_MODEL_FILE = "data/lgbm_cbsa_k3_model.txt"
+ZIPCODE_MODEL_FILE = "data/lgbm_zipcodes_model.txt"
+
+# Pairs table each model was trained on
+MODEL_KINDS = {CBSA_MODEL_FILE: "cbsa", ZIPCODE_MODEL_FILE: "zipcode"}
+
+# Candidates the ANN pre-filter keeps, 0 scores every candidate. Off by
+# default: on the shipped 25-city table a limit of 8 saves under 2 ms of
+# scoring but changes the recommended city for about half the selections, it
+# pays off only on tables far larger than the model can score per request
+CANDIDATE_LIMIT = int(os.environ.get("CTS_CANDIDATE_LIMIT", 0)) or None
+
+# Candidate indexes built by this process, keyed by pairs table
+_candidate_indexes = {}
+
+# Pair indexes built by this process, keyed by pairs table
+_pair_indexes = {}
+
+# Version of the pairs table each pair index was built from
+_pairs_versions = {}
+
+# Entities each recommender may recommend, as masks over pair index IDs
+_candidate_masks = {}
+
+# Entities each recommender may recommend, entity store included, as keys
+_candidate_keys = {}
+
+# Score with the packed float32 models instead of the LightGBM boosters
+PACKED_MODELS = os.environ.get("CTS_PACKED_MODELS", "0") == "1"
+
+# Boosters loaded by this process, keyed by model file
+_boosters = {}
+
+# Version of each model file when this process loaded it
+_model_versions = {}
+
+# LIME perturbation samples per explanation (LIME's default), and the fewest
+# worth drawing when a latency budget shrinks the explanation
+LIME_SAMPLES = 5000
+MIN_LIME_SAMPLES = 500
+
+# Share of the remaining budget an explanation may use, the rest is left for
+# the stages after it
+EXPLAIN_BUDGET_SHARE = 0.5
+
+# Running estimate of LIME's cost, updated by every budgeted explanation
+_lime_cost = {"seconds_per_sample": 2e-5}
+
+CANDIDATES = counter(
+    "cts_candidates_total",
+    "Candidates considered by the recommenders, by how they were scored",
+    ["kind", "outcome"],
+)
+TABLE_LOOKUPS = counter(
+    "cts_table_lookups_total",
+    "Selections looked up in the precomputed recommendation table",
+    ["kind", "result"],
+)
+LIME_FAILURES = counter(
+    "cts_lime_failures_total", "LIME explanations that failed and used raw features"
+)
+RANDOM_FALLBACKS = counter(
+    "cts_random_fallbacks_total",
+    "Recommendations answered at random, without a model score",
+    ["kind", "reason"],
+)
+
+
+def load_lightgbm_booster(model_file):
+    """
+    Load a LightGBM booster once per process.
+
+    LightGBM is imported on first use, so pages that never score do not pay for it.
+
+    Args:
+        model_file (str): Path of the LightGBM model file
+
+    Returns:
+        lgb.Booster: The booster
+    """
+    if model_file not in _boosters:
+        import lightgbm as lgb
+
+        _model_versions[model_file] = file_version(model_file)
+        _boosters[model_file] = lgb.Booster(model_file=model_file)
+
+    return _boosters[model_file]
+
+
+def load_booster(model_file):
+    """
+    Load the model used for scoring once per process.
+
+    Args:
+        model_file (str): Path of the LightGBM model file
+
+    Returns:
+        The LightGBM booster, or its PackedModel when CTS_PACKED_MODELS=1
+    """
+    if PACKED_MODELS:
+        from packed_model import load_or_pack
+
+        # Packed models are reloaded whenever the file changes
+        _model_versions[model_file] = file_version(model_file)
+        return load_or_pack(model_file)
+
+    return load_lightgbm_booster(model_file)
+
+
+def model_version(model_file):
+    """
+    Get the version of the model this process scores with, recorded when it
+    was loaded.
+
+    Args:
+        model_file (str): Path of the LightGBM model file
+
+    Returns:
+        str: Version of the model file
+    """
+    load_booster(model_file)
+
+    return _model_versions[model_file]
 
 
 def get_city_coordinates_data():
@@ -26,177 +178,546 @@ def get_city_coordinates_data():
     return cities_dict
 
 
-def generate_recommendation(non_selected_cities, top_cities, bottom_cities):
+def load_pairs_table(kind):
     """
-    Generate a city recommendation based on user's preferences.
+    Load a pairs table, from the shared store when it has been published there.
 
     Args:
-        non_selected_cities (list): List of cities that haven't been selected
-        top_cities (list): List of top preferred cities (green)
-        bottom_cities (list): List of lower ranked cities (orange)
+        kind (str): "cbsa" or "zipcode"
 
     Returns:
-        tuple: (recommended_city, confidence_percentage, explanation_dict, distances_dict) or (None, None, None, None) if no recommendation possible
+        pl.DataFrame: The pairs table
     """
-    if not (non_selected_cities) and not (top_cities or bottom_cities):
-        print(
-            f"Missing data: top_cities={top_cities}, bottom_cities={bottom_cities}, non_selected count={len(non_selected_cities)}"
-        )
-        return None, None, None, None
-
-    features = [
-        "scenesDistance",
-        "frequencyCosine",
-        "geographicDistance",
-        "populationDistance",
-        "bachelorDistance",
-        "raceDistance",
-        "incomeDistance",
-        "employmentDistance",
-        "votingDistance",
+    store = attach_store()
+    if store is not None and store.has_pairs(kind):
+        return store.pairs_frame(kind)
+
+    return pl.read_csv(PAIR_TABLES[kind]["csv"])
+
+
+def load_zipcode_features(city_names=None):
+    """
+    Load the zipcode GeoJSON features, from the shared store when the geometry
+    has been published there.
+
+    Args:
+        city_names (list, optional): Cities whose zipcodes are loaded, all by default
+
+    Returns:
+        list: GeoJSON features of the zipcodes
+    """
+    store = attach_store()
+    if store is not None and store.has_geometry():
+        return store.zipcode_features(city_names)
+
+    with open(ZIPCODE_GEOMETRY_FILE, "r") as f:
+        geojson_data = json.load(f)
+
+    return [
+        feature
+        for feature in geojson_data["features"]
+        if city_names is None or feature["properties"]["city_name"] in city_names
     ]
 
-    # Load the saved model
-    booster = lgb.Booster(model_file="data/lgbm_cbsa_k3_model.txt")
 
-    pairs_df = pl.read_csv("data/similar_cbsa_pairs.csv")
+def prefilter_candidates(kind, candidates, liked, limit=None):
+    """
+    Keep only the candidates closest to the liked entities, using an ANN index
+    over their pair signals and, when the entity store has them, attributes.
 
-    city_scores = {}
-    city_distances = {}
+    Args:
+        kind (str): "cbsa" or "zipcode", the pairs table the index is built from
+        candidates (list): Entity keys that may be recommended
+        liked (list): Entity keys the user wants more of
+        limit (int, optional): Number of candidates to keep, no filtering when not set
 
-    for city in non_selected_cities:
-        city_pairs = pairs_df.filter(
-            (pl.col("cbsa1_name") == city) | (pl.col("cbsa2_name") == city)
+    Returns:
+        list: The candidates to score with the model
+    """
+    if not limit or not liked or len(candidates) <= limit:
+        return candidates
+
+    if kind not in _candidate_indexes:
+        store = load_entity_store(kind)
+        _candidate_indexes[kind] = CandidateIndex(
+            load_pairs_table(kind),
+            PAIR_TABLES[kind]["keys"],
+            attributes=store.attributes if store is not None else None,
         )
 
-        if len(city_pairs) == 0:
-            print("skipped city because of no city pairs")
-            # Skip cities with no data
-            continue
+    return _candidate_indexes[kind].retrieve(liked, candidates, limit)
 
-        city_pairs = city_pairs.with_columns(
-            pl.when(pl.col("cbsa1_name") == city)
-            .then(pl.col("cbsa1_name"))
-            .otherwise(pl.col("cbsa2_name"))
-            .alias("city_name")
-        )
 
-        top_pairs = city_pairs.filter(
-            pl.col("cbsa1_name").is_in(top_cities)
-            | pl.col("cbsa2_name").is_in(top_cities)
-        )
+def get_pair_index(kind):
+    """
+    Get the pair index of a pairs table, built once per process.
 
-        bottom_pairs = city_pairs.filter(
-            pl.col("cbsa1_name").is_in(bottom_cities)
-            | pl.col("cbsa2_name").is_in(bottom_cities)
-        )
+    With the table in the shared store the index maps its adjacency, so the
+    edges are shared by every worker instead of copied into each.
 
-        # Skip if no data for comparison with selected cities
-        if len(top_pairs) == 0 and len(bottom_pairs) == 0:
-            print("skipped - no data for comparison with selected cities")
-            continue
+    Args:
+        kind (str): "cbsa" or "zipcode"
 
-        top_distances = top_pairs.group_by(["city_name"]).agg(
-            [
-                pl.col(feat).drop_nans().drop_nulls().mean().alias(f"mean_top_{feat}")
-                for feat in features
-            ]
-        )
-        bottom_distances = bottom_pairs.group_by(["city_name"]).agg(
-            [
-                pl.col(feat)
-                .drop_nans()
-                .drop_nulls()
-                .mean()
-                .alias(f"mean_bottom_{feat}")
-                for feat in features
-            ]
-        )
+    Returns:
+        PairIndex: Adjacency view of the pairs table
+    """
+    if kind not in _pair_indexes:
+        store = attach_store()
+        if store is not None and store.has_pairs(kind):
+            _pairs_versions[kind] = store.version(kind)
+            _pair_indexes[kind] = PairIndex.from_store(store, kind, FEATURES)
+        else:
+            _pairs_versions[kind] = file_version(PAIR_TABLES[kind]["csv"])
+            _pair_indexes[kind] = PairIndex.from_frame(
+                load_pairs_table(kind),
+                PAIR_TABLES[kind]["keys"],
+                FEATURES,
+                PAIR_TABLES[kind]["labels"],
+            )
+
+    return _pair_indexes[kind]
+
+
+def pairs_version(kind):
+    """
+    Get the version of the pairs table this process scores with, recorded when
+    its pair index was built.
+
+    Args:
+        kind (str): "cbsa" or "zipcode"
+
+    Returns:
+        str: Version of the CSV or of the shared store table
+    """
+    get_pair_index(kind)
+
+    return _pairs_versions[kind]
+
+
+def loaded_versions():
+    """
+    Versions of the models and pairs tables this process loaded so far,
+    without loading the others.
+
+    Returns:
+        dict: Version of every model file and pairs table, None when not loaded
+    """
+    versions = {}
+    for model_file, kind in MODEL_KINDS.items():
+        versions[f"{kind} model"] = _model_versions.get(model_file)
+    for kind in PAIR_TABLES:
+        versions[f"{kind} pairs"] = _pairs_versions.get(kind)
+
+    return versions
+
+
+def get_candidate_mask(kind):
+    """
+    Get the entities a recommender may recommend, computed once per process.
+
+    Args:
+        kind (str): "cbsa" for every city or "zipcode" for the Miami zipcodes
+
+    Returns:
+        np.ndarray: Boolean mask over the pair index IDs
+    """
+    if kind not in _candidate_masks:
+        pair_index = get_pair_index(kind)
+        if kind == "cbsa":
+            _candidate_masks[kind] = np.ones(len(pair_index.keys), dtype=bool)
+        else:
+            _candidate_masks[kind] = pair_index.label_mask("Miami")
+
+    return _candidate_masks[kind]
 
-        joined_distances = top_distances.join(
-            bottom_distances,
-            on=["city_name"],
-            how="full",
-            suffix="_bottom",
-        )
 
-        df = joined_distances.to_pandas()
+def get_candidate_keys(kind):
+    """
+    Get every entity a recommender may recommend, computed once per process.
 
-        # Skip cities with missing data - ADDING DEBUG PRINT
-        if df.empty:
-            print("skipped city because of empty dataframe")
-            continue
+    Entities in the entity store count too, so a Miami zipcode the pairs table
+    has no pairs for is still scored from its attributes.
 
-        X = df[
-            [f"mean_top_{feat}" for feat in features]
-            + [f"mean_bottom_{feat}" for feat in features]
-        ]
+    Args:
+        kind (str): "cbsa" for every city or "zipcode" for the Miami zipcodes
 
-        predictions = booster.predict(X)
+    Returns:
+        list: Entity keys, those of the pair index first
+    """
+    if kind not in _candidate_keys:
+        pair_index = get_pair_index(kind)
+        keys = pair_index.to_keys(np.flatnonzero(get_candidate_mask(kind)))
+        store = load_entity_store(kind)
+        if store is not None:
+            known = set(pair_index.keys)
+            attributes = store.attributes
+            for key, label in zip(attributes["keys"], attributes["labels"]):
+                if key not in known and (kind == "cbsa" or label == "Miami"):
+                    keys.append(key)
+        _candidate_keys[kind] = keys
+
+    return _candidate_keys[kind]
+
+
+def ranked_by_table(kind, candidates):
+    """
+    Whether the precomputed table ranks every candidate that could be scored.
+
+    The table is built from the pairs table, so it misses the candidates only
+    the entity store has data for.
+
+    Args:
+        kind (str): "cbsa" or "zipcode"
+        candidates (list): Candidate keys
+
+    Returns:
+        bool: Whether a table answer is the best of all candidates
+    """
+    store = load_entity_store(kind)
+    if store is None:
+        return True
 
-        # Create fallback simple explanation if LIME fails
-        feature_importance = {}
+    pair_ids = get_pair_index(kind).ids
+
+    return all(key in pair_ids or key not in store for key in candidates)
+
+
+def materialize_recommendation_table(
+    kind, table_dir=DEFAULT_TABLE_DIR, max_more=2, max_less=1, top_k=5
+):
+    """
+    Precompute the top-K candidates of every small selection for a recommender.
+
+    Args:
+        kind (str): "cbsa" for cities or "zipcode" for Miami areas
+        table_dir (str): Directory holding one table per kind
+        max_more (int): Largest more-of selection
+        max_less (int): Largest less-of selection
+        top_k (int): Candidates kept per selection
+
+    Returns:
+        int: Number of selections in the table
+    """
+    model_file = CBSA_MODEL_FILE if kind == "cbsa" else ZIPCODE_MODEL_FILE
+    booster = load_booster(model_file)
+    pair_index = get_pair_index(kind)
+
+    candidate_mask = get_candidate_mask(kind)
+    candidates = pair_index.to_keys(np.flatnonzero(candidate_mask))
+    if kind == "cbsa":
+        selectable = candidates
+    else:
+        selectable = pair_index.to_keys(np.flatnonzero(~candidate_mask))
+
+    return materialize(
+        booster,
+        pair_index,
+        selectable,
+        candidates,
+        os.path.join(table_dir, kind),
+        model_version(model_file),
+        pairs_version(kind),
+        max_more=max_more,
+        max_less=max_less,
+        top_k=top_k,
+    )
+
+
+def recommend_from_table(kind, model, model_file, candidate_mask, top, bottom):
+    """
+    Answer a selection from the precomputed recommendation table.
 
-        try:
-            # Add LIME explanation
-            feature_names = list(X.columns)
-            explanation = explain_prediction_with_lime(booster, X, feature_names)
+    Only the recommended candidate is rebuilt and re-scored, so its features can
+    be explained.
 
-            # Store the explanation results and sort them by absolute value
-            feature_importance_list = explanation.as_list()
-            # Sort by absolute magnitude of feature importance
-            sorted_importance = sorted(
-                feature_importance_list, key=lambda x: abs(x[1]), reverse=True
+    Args:
+        kind (str): "cbsa" or "zipcode"
+        model: Trained LightGBM booster
+        model_file (str): Path of the booster, the table must match its version and
+            the pairs table this process loaded
+        candidate_mask (np.ndarray): Mask of the pair index IDs that may be recommended
+        top (list): Keys of the entities the user wants more of
+        bottom (list): Keys of the entities the user wants less of
+
+    Returns:
+        tuple: (candidate, score, features_df), or None when the selection is
+        not in the table
+    """
+    table = load_recommendation_table(
+        kind, model_version(model_file), pairs_version(kind)
+    )
+    if table is None:
+        return None
+
+    best = table.lookup(top, bottom)
+    if not best:
+        return None
+
+    pair_index = get_pair_index(kind)
+    best_ids = pair_index.to_ids([candidate for candidate, _ in best])
+    best_ids = best_ids[candidate_mask[best_ids]]
+    if len(best_ids) == 0:
+        return None
+
+    X, _ = pair_index.features_matrix(
+        best_ids[:1], pair_index.selection_mask(top), pair_index.selection_mask(bottom)
+    )
+    X = pd.DataFrame(X, columns=MODEL_FEATURES)
+
+    return pair_index.keys[best_ids[0]], float(model.predict(X)[0]), X
+
+
+def score_candidates(kind, model, candidates, top, bottom, top_k=None):
+    """
+    Score many candidates against one selection with a single predict call.
+
+    Args:
+        kind (str): "cbsa" or "zipcode"
+        model: Trained LightGBM booster
+        candidates (list): Candidate keys
+        top (list): Keys of the entities the user wants more of
+        bottom (list): Keys of the entities the user wants less of
+        top_k (int, optional): Only keep the top_k best candidates, which saves
+            building a feature frame for the others. Every candidate is kept
+            when not set
+
+    Returns:
+        tuple: (scored, unpaired) where scored maps the candidates with pairs
+        data (all of them, or the top_k best) to (score, features_df), and
+        unpaired lists the candidates without any pair with the selection
+    """
+    pair_index = get_pair_index(kind)
+    candidate_ids = pair_index.to_ids(candidates)
+    unpaired = [key for key in candidates if key not in pair_index.ids]
+
+    X, has_pairs = pair_index.features_matrix(
+        candidate_ids, pair_index.selection_mask(top), pair_index.selection_mask(bottom)
+    )
+    unpaired += pair_index.to_keys(candidate_ids[~has_pairs])
+    candidate_ids = candidate_ids[has_pairs]
+    if len(candidate_ids) == 0:
+        return {}, unpaired
+
+    features_df = pd.DataFrame(X[has_pairs], columns=MODEL_FEATURES)
+    if top_k:
+        rows, predictions = top_k_rows(model, X[has_pairs], k=top_k)
+    else:
+        rows, predictions = np.arange(len(features_df)), model.predict(features_df)
+
+    keys = pair_index.to_keys(candidate_ids)
+    scored = {}
+    for row, prediction in zip(rows, predictions):
+        X = features_df.iloc[[row]].reset_index(drop=True)
+        scored[keys[row]] = (float(prediction), X)
+
+    return scored, unpaired
+
+
+def score_unpaired_candidates(kind, model, candidates, top, bottom):
+    """
+    Score candidates the pairs table has no comparison data for, computing their
+    distances to the selected entities on demand from the entity feature store.
+
+    Args:
+        kind (str): "cbsa" or "zipcode"
+        model: Trained LightGBM booster
+        candidates (list): Candidate keys without pairs data
+        top (list): Keys of the entities the user wants more of
+        bottom (list): Keys of the entities the user wants less of
+
+    Returns:
+        dict: (score, features_df) per candidate that could be scored
+    """
+    store = load_entity_store(kind)
+    if store is None or not candidates:
+        return {}
+
+    features_df = store.aggregate_features(candidates, top, bottom, FEATURES)
+    if features_df.empty:
+        return {}
+
+    predictions = model.predict(features_df[MODEL_FEATURES])
+
+    scored = {}
+    for i, candidate in enumerate(features_df.index):
+        X = features_df[MODEL_FEATURES].iloc[[i]].reset_index(drop=True)
+        scored[candidate] = (float(predictions[i]), X)
+
+    return scored
+
+
+def count_candidates(kind, candidates, paired, unpaired):
+    """
+    Count how the candidates of one recommendation were scored.
+
+    Args:
+        kind (str): "cbsa" or "zipcode"
+        candidates (int): Candidates considered
+        paired (int): Candidates scored from the pairs table, early exits included
+        unpaired (int): Candidates scored from the entity store
+    """
+    CANDIDATES.inc(paired, kind=kind, outcome="paired")
+    # Missing from the pairs table, scored from the entity store instead
+    CANDIDATES.inc(unpaired, kind=kind, outcome="unpaired")
+    # Missing from both, or left out by the latency budget
+    CANDIDATES.inc(candidates - paired - unpaired, kind=kind, outcome="skipped")
+
+
+def generate_recommendation(
+    non_selected_cities,
+    top_cities,
+    bottom_cities,
+    explain_workers=None,
+    candidate_limit=None,
+    explain=True,
+    budget=None,
+):
+    """
+    Generate a city recommendation based on user's preferences.
+
+    Args:
+        non_selected_cities (list): List of cities that haven't been selected
+        top_cities (list): List of top preferred cities (green)
+        bottom_cities (list): List of lower ranked cities (orange)
+        explain_workers (int, optional): Number of worker processes used to explain the scored cities. Explanations run serially when not set
+        candidate_limit (int, optional): Only score the cities an ANN index finds closest to the top cities
+        explain (bool): Explain the recommendation with LIME. Without it the result is cheap and flagged as degraded
+        budget (LatencyBudget, optional): Time budget, optional stages shrink or are skipped to meet it. Runs in full when not set
+
+    Returns:
+        RecommendationResult: Recommended city, confidence percentage, explanation and distances, all None if no recommendation possible
+    """
+    if not (non_selected_cities) and not (top_cities or bottom_cities):
+        print(
+            f"Missing data: top_cities={top_cities}, bottom_cities={bottom_cities}, non_selected count={len(non_selected_cities)}"
+        )
+        return RecommendationResult(None, None, None, None)
+
+    if budget is None:
+        budget = LatencyBudget()
+
+    # Answer repeated selections from the recommendation cache
+    cache_key = recommendation_key(
+        "cbsa",
+        model_version(CBSA_MODEL_FILE),
+        pairs_version("cbsa"),
+        top_cities,
+        bottom_cities,
+        non_selected_cities,
+        candidate_limit=candidate_limit,
+    )
+    cached = get_recommendation_cache().get(cache_key)
+    if cached is not None:
+        return cached
+
+    # Load the saved model
+    booster = load_booster(CBSA_MODEL_FILE)
+
+    # Answer from the precomputed table when this selection was materialized,
+    # and no city outside the pairs table competes with its answer
+    precomputed = None
+    if ranked_by_table("cbsa", non_selected_cities):
+        with budget.stage("table"):
+            precomputed = recommend_from_table(
+                "cbsa",
+                booster,
+                CBSA_MODEL_FILE,
+                get_pair_index("cbsa").selection_mask(non_selected_cities),
+                top_cities,
+                bottom_cities,
             )
+        TABLE_LOOKUPS.inc(kind="cbsa", result="miss" if precomputed is None else "hit")
+    if precomputed is not None:
+        recommended, score, X = precomputed
+        explanation = explain_within_budget(
+            booster, CBSA_MODEL_FILE, X, recommended, budget, explain
+        )
+        return remember_recommendation(
+            cache_key,
+            RecommendationResult(
+                recommended,
+                int(max(60, min(95, score * 100))),
+                Explanation.from_dict(explanation) if explanation else {},
+                collect_distances(X, budget),
+                degraded=not budget.ran("explain"),
+                stages=budget.report(),
+            ),
+        )
 
-            # Store as ordered dictionary
-            feature_importance = {feat: value for feat, value in sorted_importance}
-        except Exception as e:
-            print(f"LIME explanation failed for {city}: {e}")
-            # Create a fallback simplified explanation using the raw feature values
-            for feat in features:
-                top_key = f"mean_top_{feat}"
-                bottom_key = f"mean_bottom_{feat}"
-                if top_key in df.columns and bottom_key in df.columns:
-                    feature_importance[top_key] = float(df[top_key].iloc[0])
-                    feature_importance[bottom_key] = float(df[bottom_key].iloc[0])
-
-        # Store the raw distance values for this city
-        raw_distances = {}
-        for feat in features:
-            if f"mean_top_{feat}" in df.columns:
-                raw_distances[f"top_{feat}"] = float(df[f"mean_top_{feat}"].iloc[0])
-            if f"mean_bottom_{feat}" in df.columns:
-                raw_distances[f"bottom_{feat}"] = float(
-                    df[f"mean_bottom_{feat}"].iloc[0]
-                )
-
-        city_distances[city] = raw_distances
-
-        # Store city score and explanation
-        city_scores[city] = {
-            "score": float(predictions[0]),
-            "explanation": feature_importance,
-        }
+    city_scores = {}
+    city_features = {}
+
+    with budget.stage("filter"):
+        candidates = prefilter_candidates(
+            "cbsa", non_selected_cities, top_cities, candidate_limit
+        )
+
+    # Score every city with pairs data in one pass over the pair index. Unless
+    # every city is explained only the best one is kept, and packed models stop
+    # evaluating the others as soon as they cannot win
+    with budget.stage("score", candidates=len(candidates)):
+        scored, unpaired = score_candidates(
+            "cbsa",
+            booster,
+            candidates,
+            top_cities,
+            bottom_cities,
+            top_k=None if explain and not budget.limited else 1,
+        )
+    for city in unpaired:
+        # Leave cities with no data to the entity store
+        print(f"skipped {city} - no data for comparison with selected cities")
+
+    # Score the cities the pairs table has no data for from their raw attributes,
+    # unless the budget is spent and other cities were scored
+    attribute_scored = {}
+    if unpaired and scored and budget.expired():
+        budget.skip("unpaired", "over budget")
+    else:
+        with budget.stage("unpaired", candidates=len(unpaired)):
+            attribute_scored = score_unpaired_candidates(
+                "cbsa", booster, unpaired, top_cities, bottom_cities
+            )
+    scored.update(attribute_scored)
+    count_candidates(
+        "cbsa",
+        len(candidates),
+        len(candidates) - len(unpaired),
+        len(attribute_scored),
+    )
+    for city, (score, X) in scored.items():
+        city_features[city] = X
+        # Store city score, the explanation is filled in once all cities are scored
+        city_scores[city] = {"score": score, "explanation": {}}
+
+    # Explain every scored city, in a process pool when workers are requested.
+    # On a time budget only the recommended city is explained, further down.
+    if explain and not budget.limited:
+        with budget.stage("explain", candidates=len(city_features)):
+            explanations = explain_scored_candidates(
+                booster, CBSA_MODEL_FILE, city_features, explain_workers
+            )
+        for city, feature_importance in explanations.items():
+            city_scores[city]["explanation"] = feature_importance
 
     # If no cities were scored, return random recommendation with simple explanation
     if not city_scores:
         if non_selected_cities:
+            RANDOM_FALLBACKS.inc(kind="cbsa", reason="no_scores")
             recommended = random.choice(non_selected_cities)
             confidence = random.randint(60, 95)
 
-            # Create a simple explanation
-            simple_explanation = {
-                "random_recommendation": 1.0,
-                "insufficient_data": 0.8,
-            }
-
             # Create simple distances
             simple_distances = {"notice": "Insufficient data for detailed analysis"}
 
-            return recommended, confidence, simple_explanation, simple_distances
+            return RecommendationResult(
+                recommended,
+                confidence,
+                INSUFFICIENT_DATA_EXPLANATION,
+                simple_distances,
+            )
         else:
-            return None, None, None, None
+            return RecommendationResult(None, None, None, None)
 
     # Find city with highest score
     recommended = max(city_scores.keys(), key=lambda c: city_scores[c]["score"])
@@ -206,23 +727,414 @@ def generate_recommendation(non_selected_cities, top_cities, bottom_cities):
     score = city_scores[recommended]["score"]
     confidence = int(max(60, min(95, score * 100)))
 
+    if budget.limited or not explain:
+        city_scores[recommended]["explanation"] = explain_within_budget(
+            booster,
+            CBSA_MODEL_FILE,
+            city_features[recommended],
+            recommended,
+            budget,
+            explain,
+        )
+
     # Return the top recommendation, confidence score, and explanation
-    return (
-        recommended,
-        confidence,
-        city_scores[recommended]["explanation"],
-        city_distances[recommended],
+    return remember_recommendation(
+        cache_key,
+        RecommendationResult(
+            recommended,
+            confidence,
+            Explanation.from_dict(city_scores[recommended]["explanation"]),
+            collect_distances(city_features[recommended], budget),
+            degraded=not budget.ran("explain"),
+            stages=budget.report(),
+        ),
+    )
+
+
+# Ways to combine the scores of several profiles into one group ranking
+CONSENSUS_METHODS = ["mean", "min", "borda"]
+
+
+def score_profiles(kind, model, candidates, profiles):
+    """
+    Score the same candidates for several user profiles with one predict call.
+
+    Args:
+        kind (str): "cbsa" or "zipcode"
+        model: Trained LightGBM booster
+        candidates (list): Candidate keys
+        profiles (list): (top, bottom) key lists, one per profile
+
+    Returns:
+        tuple: (candidate_keys, scores) where scores is a
+        (n_profiles, n_candidates) array, NaN where a candidate has no pair
+        with the selection of a profile
+    """
+    pair_index = get_pair_index(kind)
+    candidate_ids = pair_index.to_ids(candidates)
+    if not profiles:
+        return pair_index.to_keys(candidate_ids), np.empty((0, len(candidate_ids)))
+
+    # Stack the candidate rows of every profile into one (profiles x candidates) matrix
+    rows = []
+    scored = []
+    for top, bottom in profiles:
+        X, has_pairs = pair_index.features_matrix(
+            candidate_ids,
+            pair_index.selection_mask(top),
+            pair_index.selection_mask(bottom),
+        )
+        rows.append(X)
+        scored.append(has_pairs)
+    rows = np.vstack(rows)
+    scored = np.concatenate(scored)
+
+    scores = np.full(len(rows), np.nan)
+    if scored.any():
+        scores[scored] = model.predict(
+            pd.DataFrame(rows[scored], columns=MODEL_FEATURES)
+        )
+
+    return pair_index.to_keys(candidate_ids), scores.reshape(len(profiles), -1)
+
+
+def aggregate_profile_scores(scores, method="mean"):
+    """
+    Combine per-profile scores into one consensus score per candidate.
+
+    Args:
+        scores (np.ndarray): (n_profiles, n_candidates) scores, NaN where unscored
+        method (str): "mean" or "min" of the scores, or "borda" for the Borda
+            count of the per-profile rankings
+
+    Returns:
+        np.ndarray: Consensus score per candidate, NaN when no profile scored it
+    """
+    if method not in CONSENSUS_METHODS:
+        raise ValueError(f"Unknown consensus method: {method}")
+
+    scored = ~np.isnan(scores)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        if method == "mean":
+            consensus = np.nansum(scores, axis=0) / scored.sum(axis=0)
+        elif method == "min":
+            # A candidate is only as good as it is for the least happy member
+            consensus = np.where(
+                scored.any(axis=0),
+                np.where(scored, scores, np.inf).min(axis=0, initial=np.inf),
+                np.nan,
+            )
+        else:
+            # Each profile gives n - 1 points to its best candidate, down to 0
+            ranks = np.argsort(
+                np.argsort(-np.where(scored, scores, -np.inf), axis=1), axis=1
+            )
+            points = np.where(scored, scored.sum(axis=1, keepdims=True) - 1 - ranks, 0)
+            consensus = np.where(scored.any(axis=0), points.sum(axis=0), np.nan)
+
+    return consensus
+
+
+def generate_group_recommendation(non_selected_cities, profiles, consensus="mean"):
+    """
+    Recommend a city for a group trip from the preferences of every member.
+
+    Args:
+        non_selected_cities (list): Cities that may be recommended
+        profiles (list): (top_cities, bottom_cities) per group member
+        consensus (str): How the member scores are combined, one of CONSENSUS_METHODS
+
+    Returns:
+        dict: "recommended" city, "consensus" list of (city, score) best first,
+        and "rankings" with the (city, score) list of every profile, best first.
+        Without profiles, or without any scored city, "recommended" is None
+    """
+    # Cities picked by any member are not recommended to the group
+    selected = {city for top, bottom in profiles for city in list(top) + list(bottom)}
+    candidates = [city for city in non_selected_cities if city not in selected]
+
+    booster = load_booster(CBSA_MODEL_FILE)
+    cities, scores = score_profiles("cbsa", booster, candidates, profiles)
+    consensus_scores = aggregate_profile_scores(scores, consensus)
+
+    def ranking(values):
+        order = np.argsort(-np.nan_to_num(values, nan=-np.inf), kind="stable")
+        return [(cities[i], float(values[i])) for i in order if not np.isnan(values[i])]
+
+    consensus_ranking = ranking(consensus_scores)
+
+    return {
+        "recommended": consensus_ranking[0][0] if consensus_ranking else None,
+        "consensus": consensus_ranking,
+        "rankings": [ranking(profile_scores) for profile_scores in scores],
+    }
+
+
+def get_lime_explainer(model_file):
+    """
+    Get the persistent LIME explainer of a model.
+
+    Its scaler statistics come from a background sample of the pair features the
+    model actually sees. The sample is drawn once per model and pairs table
+    version and saved to disk, and the explainer is built once per process and reused by every
+    explanation.
+
+    Args:
+        model_file (str): Path of the LightGBM model file
+
+    Returns:
+        LimeTabularExplainer: The explainer, or None for a model without a pairs table
+    """
+    kind = MODEL_KINDS.get(model_file)
+    if kind is None:
+        return None
+
+    return load_explainer(
+        kind,
+        model_version(model_file),
+        pairs_version(kind),
+        MODEL_FEATURES,
+        lambda: sample_model_inputs(kind),
+    )
+
+
+def sample_model_inputs(kind, drop_missing=True):
+    """
+    Sample the pair features a model sees for random user selections.
+
+    Args:
+        kind (str): "cbsa" or "zipcode"
+        drop_missing (bool): Drop rows with missing features
+
+    Returns:
+        np.ndarray: (n_rows, n_model_features) model inputs
+    """
+    candidate_mask = get_candidate_mask(kind)
+    # Zipcode users select New York and Los Angeles areas, not Miami ones
+    selectable_mask = candidate_mask if kind == "cbsa" else ~candidate_mask
+
+    return sample_background(
+        get_pair_index(kind),
+        candidate_mask,
+        selectable_mask,
+        drop_missing=drop_missing,
     )
 
 
-def explain_prediction_with_lime(model, features_df, feature_names):
+def get_feature_importance(model, X, label, explainer=None, num_samples=LIME_SAMPLES):
+    """
+    Explain a single prediction with LIME and sort the result by importance.
+
+    Falls back to the raw feature values when LIME cannot explain the row, and
+    counts the failure in LIME_FAILURES.
+
+    Args:
+        model: Trained LightGBM booster
+        X (pd.DataFrame): One-row DataFrame with the model features
+        label: Candidate being explained, only used in the failure message
+        explainer (LimeTabularExplainer, optional): Persistent explainer, one is built from the row when not set
+        num_samples (int): LIME perturbation samples
+
+    Returns:
+        dict: Feature importance values ordered by absolute magnitude
+    """
+    feature_importance, failed = explain_feature_importance(
+        model, X, label, explainer, num_samples
+    )
+    if failed:
+        LIME_FAILURES.inc()
+
+    return feature_importance
+
+
+def explain_feature_importance(
+    model, X, label, explainer=None, num_samples=LIME_SAMPLES
+):
+    """
+    Explain a single prediction like get_feature_importance, without counting
+    failures, e.g. in explanation pool workers whose metrics nobody exports.
+
+    Args:
+        model: Trained LightGBM booster
+        X (pd.DataFrame): One-row DataFrame with the model features
+        label: Candidate being explained, only used in the failure message
+        explainer (LimeTabularExplainer, optional): Persistent explainer, one is built from the row when not set
+        num_samples (int): LIME perturbation samples
+
+    Returns:
+        tuple: Feature importance dict, and whether LIME failed
+    """
+    # Create fallback simple explanation if LIME fails
+    feature_importance = {}
+    failed = False
+
+    try:
+        # Add LIME explanation
+        feature_names = list(X.columns)
+        explanation = explain_prediction_with_lime(
+            model, X, feature_names, explainer, num_samples
+        )
+
+        # Store the explanation results and sort them by absolute value
+        feature_importance_list = explanation.as_list()
+        # Sort by absolute magnitude of feature importance
+        sorted_importance = sorted(
+            feature_importance_list, key=lambda x: abs(x[1]), reverse=True
+        )
+
+        # Store as ordered dictionary
+        feature_importance = {feat: value for feat, value in sorted_importance}
+    except Exception as e:
+        print(f"LIME explanation failed for {label}: {e}")
+        failed = True
+        # Create a fallback simplified explanation using the raw feature values
+        for feat in FEATURES:
+            top_key = f"mean_top_{feat}"
+            bottom_key = f"mean_bottom_{feat}"
+            if top_key in X.columns and bottom_key in X.columns:
+                feature_importance[top_key] = float(X[top_key].iloc[0])
+                feature_importance[bottom_key] = float(X[bottom_key].iloc[0])
+
+    return feature_importance, failed
+
+
+def lime_samples_within(budget):
+    """
+    LIME samples an explanation can afford in the remaining budget.
+
+    Args:
+        budget (LatencyBudget): Budget of the request
+
+    Returns:
+        int: Samples to draw, 0 when not even MIN_LIME_SAMPLES fit
+    """
+    if not budget.limited:
+        return LIME_SAMPLES
+
+    affordable = int(
+        budget.remaining() * EXPLAIN_BUDGET_SHARE / _lime_cost["seconds_per_sample"]
+    )
+    if affordable < MIN_LIME_SAMPLES:
+        return 0
+
+    return min(LIME_SAMPLES, affordable)
+
+
+def explain_within_budget(model, model_file, X, label, budget, explain=True):
+    """
+    Explain the recommended candidate with as many LIME samples as the budget allows.
+
+    Args:
+        model: Trained LightGBM booster
+        model_file (str): Path of the booster, selects its LIME explainer
+        X (pd.DataFrame): One-row DataFrame with the model features
+        label: Candidate being explained
+        budget (LatencyBudget): Budget of the request
+        explain (bool): Whether an explanation was requested at all
+
+    Returns:
+        dict: Feature importance, empty when the explanation was skipped. When
+        LIME fails it holds the raw feature values and the stage is reported as
+        skipped, so the result counts as degraded
+    """
+    if not explain:
+        budget.skip("explain", "not requested")
+        return {}
+
+    num_samples = lime_samples_within(budget)
+    if not num_samples:
+        budget.skip("explain", "over budget")
+        return {}
+
+    explainer = get_lime_explainer(model_file)
+    with budget.stage("explain", candidates=1, samples=num_samples) as stage:
+        feature_importance, failed = explain_feature_importance(
+            model, X, label, explainer, num_samples
+        )
+
+    if failed:
+        # A failed run says nothing about what the samples cost
+        LIME_FAILURES.inc()
+        budget.skip("explain", "failed")
+        return feature_importance
+
+    # Smooth the cost estimate so one slow run does not starve the next ones
+    _lime_cost["seconds_per_sample"] = (
+        0.8 * _lime_cost["seconds_per_sample"] + 0.2 * stage["seconds"] / num_samples
+    )
+
+    return feature_importance
+
+
+def collect_distances(X, budget):
+    """
+    Collect the raw distance values of the recommendation, unless the budget is spent.
+
+    Args:
+        X (pd.DataFrame): One-row DataFrame with the model features
+        budget (LatencyBudget): Budget of the request
+
+    Returns:
+        FeatureValues: The distances, or a notice dict when they were skipped
+    """
+    if budget.expired():
+        budget.skip("distances", "over budget")
+        return {"notice": "Distances skipped to meet the latency budget"}
+
+    with budget.stage("distances"):
+        return FeatureValues.from_frame(X)
+
+
+def explain_scored_candidates(
+    model, model_file, candidate_features, explain_workers=None
+):
+    """
+    Explain the predictions for every scored candidate.
+
+    Args:
+        model: Trained LightGBM booster, used for the serial path
+        model_file (str): Path of the booster, loaded by each worker process
+        candidate_features (dict): One-row feature DataFrame per candidate
+        explain_workers (int, optional): Number of worker processes, runs serially when not set
+
+    Returns:
+        dict: Sorted feature importance dictionary per candidate
+    """
+    # Built (and saved for the workers) before any candidate is explained
+    explainer = get_lime_explainer(model_file)
+
+    if explain_workers and explain_workers > 1 and len(candidate_features) > 1:
+        from explanation_pool import explain_candidates
+
+        explanations = explain_candidates(
+            model_file,
+            list(candidate_features.values()),
+            list(candidate_features.keys()),
+            max_workers=explain_workers,
+        )
+        return dict(zip(candidate_features.keys(), explanations))
+
+    return {
+        candidate: get_feature_importance(model, X, candidate, explainer)
+        for candidate, X in candidate_features.items()
+    }
+
+
+def explain_prediction_with_lime(
+    model, features_df, feature_names, explainer=None, num_samples=LIME_SAMPLES
+):
     """
     Use LIME to explain a prediction made by a LightGBM model.
 
+    Missing feature values are replaced by the mean of the explainer's
+    background sample, LIME's perturbation cannot start from a NaN.
+
     Args:
         model: Trained LightGBM booster
         features_df: Pandas DataFrame with feature values
         feature_names: List of feature names
+        explainer (LimeTabularExplainer, optional): Persistent explainer, one is built from features_df when not set
+        num_samples (int): LIME perturbation samples
 
     Returns:
         lime.explanation.Explanation: LIME explanation object
@@ -236,21 +1148,32 @@ def explain_prediction_with_lime(model, features_df, feature_names):
         # Convert to the format LIME expects: array of shape (n_samples, n_classes)
         return np.vstack([1 - predictions, predictions]).T
 
-    # Create the LIME explainer
-    explainer = LimeTabularExplainer(
-        features_df.values,
-        feature_names=feature_names,
-        class_names=class_names,
-        discretize_continuous=False,
-        mode="classification",
-    )
+    # Create the LIME explainer when no persistent one is given
+    if explainer is None:
+        # LIME pulls in scikit-learn and SciPy, import it only when explaining
+        from lime.lime_tabular import LimeTabularExplainer
+
+        explainer = LimeTabularExplainer(
+            features_df.values,
+            feature_names=feature_names,
+            class_names=class_names,
+            discretize_continuous=False,
+            mode="classification",
+        )
 
     # Generate explanation for the first instance
     instance_idx = 0
+    instance = features_df.iloc[instance_idx].to_numpy(dtype=np.float64)
+    missing = np.isnan(instance)
+    if missing.any():
+        # LIME cannot perturb around a NaN, so missing distances are explained
+        # at the mean of the explainer's background sample
+        instance = np.where(missing, explainer.scaler.mean_, instance)
     explanation = explainer.explain_instance(
-        features_df.iloc[instance_idx].values,
+        instance,
         predict_proba_wrapper,
         num_features=len(feature_names),
+        num_samples=num_samples,
     )
 
     return explanation
@@ -324,319 +1247,287 @@ def generate_travel_recommendation(
     return recommendation
 
 
-def generate_travel_recommendation_prompt(
-    recommended_city, top_cities, bottom_cities, lime_explanation, distances
+def generate_area_recommendation(
+    recommended_zipcode, more_of_zipcodes, less_of_zipcodes, explanation, distances
 ):
     """
-    Generate a personalized travel recommendation prompt for an LLM system.
+    Generate a personalized area recommendation based on user preferences and ML explanation.
 
     Args:
-        recommended_city (str): The recommended city name
-        top_cities (list): List of user's top preferred cities
-        bottom_cities (list): List of user's lower ranked cities
-        lime_explanation (dict): LIME explanation with feature importance values
-        distances (dict): Raw distance values between cities
+        recommended_zipcode (str): The recommended Miami zipcode
+        more_of_zipcodes (list): List of zipcodes the user likes more
+        less_of_zipcodes (list): List of zipcodes the user likes less
+        explanation (dict): Explanation with feature importance values
+        distances (dict): Raw distance values between zipcodes
 
     Returns:
-        str: A formatted LLM prompt for generating travel recommendations
+        str: A personalized area recommendation paragraph
     """
-    if not lime_explanation or not distances:
-        return f"Based on your preferences, {recommended_city} seems like a great match for your next travel destination!"
-
-    # Feature name translation dictionary
-    feature_translations = {
-        "scenesDistance": "cultural vibe",
-        "frequencyCosine": "venue mix and attractions",
-        "geographicDistance": "geographical location",
-        "populationDistance": "city size and atmosphere",
-        "bachelorDistance": "educational environment",
-        "raceDistance": "cultural diversity",
-        "incomeDistance": "economic character",
-        "employmentDistance": "job market and infrastructure",
-        "votingDistance": "local community values",
-    }
-
-    # Format lists for the prompt
-    top_cities_str = ", ".join(top_cities) if top_cities else "None provided"
-    bottom_cities_str = ", ".join(bottom_cities) if bottom_cities else "None provided"
-
-    # Format the LIME explanations and distances for readability
-    lime_explanations_formatted = "\n".join(
-        [f"    {k}: {v}" for k, v in lime_explanation.items()]
-    )
-
-    # Format distances dictionary
-    distances_formatted = "\n".join([f"    {k}: {v}" for k, v in distances.items()])
-
-    # Create the prompt template
-    prompt = f"""
-Task: Write a 3-4 sentence travel recommendation for {recommended_city} based on the user’s preferences, using the provided data to justify why it’s a better fit than alternatives. Focus on relatable comparisons (e.g., "like [TOP_CITY], but with [DIFFERENCE]") and avoid jargon.
+    if not explanation or not distances:
+        return f"Based on your preferences, Miami zipcode {recommended_zipcode} seems like a great match for your preferences!"
 
-Input Data:
+    # Get the top 2 most influential features (by absolute value)
+    top_features = sorted(explanation.items(), key=lambda x: abs(x[1]), reverse=True)[
+        :2
+    ]
 
-    Top Cities (Favorite): {top_cities_str} → The user enjoys these places the most.
+    feature_translations = FEATURE_TRANSLATIONS["area"]
 
-    Bottom Cities (Ok): {bottom_cities_str} → The user visited these places but didn't enjoy them as much.
+    # Generate recommendation text
+    more_of = more_of_zipcodes[0] if more_of_zipcodes else "your preferred areas"
+    less_of = less_of_zipcodes[0] if less_of_zipcodes else "the areas you liked less"
 
-    Key LIME Explanations (Influence Scores):
-    {lime_explanations_formatted}
+    # Build recommendation text
+    recommendation = (
+        f"Miami's {recommended_zipcode} is a great fit for the neighborhoods you love. "
+    )
 
-    Raw Distance Values:
-    {distances_formatted}
+    # Add insights about top features
+    for feature_name, importance in top_features:
+        base_feature = feature_name.replace("mean_top_", "").replace("mean_bottom_", "")
+        friendly_name = feature_translations.get(base_feature, base_feature)
 
-Instructions:
+        top_key = f"top_{base_feature}"
+        bottom_key = f"bottom_{base_feature}"
 
-    Prioritize Top LIME Factors: Highlight the 2-3 most influential metrics (e.g., scenesDistance, frequencyCosine) and explain their impact.
+        if top_key in distances and bottom_key in distances:
+            top_value = distances[top_key]
+            bottom_value = distances[bottom_key]
 
-    Example: "If mean_top_scenesDistance is high, say: ‘Its artsy vibe feels more like [TOP_CITY] than [BOTTOM_CITY].’"
+            if "top" in feature_name and importance > 0:
+                recommendation += f"Like {more_of}, it has a familiar {friendly_name} (a distance of {top_value:.2f} compared to {bottom_value:.2f} for {less_of}). "
+            elif "bottom" in feature_name and importance < 0:
+                recommendation += f"Unlike {less_of}, its {friendly_name} sets it apart in the way you prefer. "
 
-    Avoid Jargon: Translate metrics into traveler benefits:
+    # Add a compelling call to action
+    recommendation += (
+        f"Come see how {recommended_zipcode} brings the best of {more_of} to Miami!"
+    )
 
-        scenesDistance → "cultural vibe"
+    return recommendation
 
-        frequencyCosine → "similar types of attractions"
 
-        employmentDistance → "tourist-friendly infrastructure"
+def generate_travel_recommendation_prompt(
+    recommended_city,
+    top_cities,
+    bottom_cities,
+    lime_explanation,
+    distances,
+    compact=False,
+):
+    """
+    Generate a personalized travel recommendation prompt for an LLM system.
 
-    Persuasive Hook: End with a call to action (e.g., "If you love [TOP_CITY]'s [trait], you'll feel right at home here!").
-    
-    Simplify Metrics: Always translate raw data into traveler-friendly terms (e.g., "employmentDistance" → "easy-to-navigate infrastructure").
-    
-    Stronger Hook: Start with a confident, personalized opener (e.g., "[CITY] is a perfect blend of what you love about [TOP_CITY] and [TOP_CITY]!").
-    
-    Explicit Comparisons: Directly contrast top/bottom cities (e.g., "Unlike [BOTTOM_CITY], [CITY] has [TRAIT]...").
-    
-    Raw Value Comparisons: Use these only to support claims (e.g., "Its venue mix is closer to Boston’s (0.93) than Portland’s (0.96)" → rewritten as "You’ll find familiar restaurants and nightlife, like in Boston.").
-    
-    Use this feature meanings: {str(feature_translations)}
+    Args:
+        recommended_city (str): The recommended city name
+        top_cities (list): List of user's top preferred cities
+        bottom_cities (list): List of user's lower ranked cities
+        lime_explanation (dict): LIME explanation with feature importance values
+        distances (dict): Raw distance values between cities
+        compact (bool): Build the size-capped compact prompt used in links
 
-Output Template:
-"{recommended_city} is the ideal next stop for you. Like {top_cities[0] if top_cities else 'your favorite destinations'}, it's [trait1] and [trait2], so you'll feel right at home. Unlike {bottom_cities[0] if bottom_cities else 'your less preferred cities'}, it avoids [disliked_trait]—instead offering [alternative]. If you loved {top_cities[0] if top_cities else 'your top city'}'s [aspect], you'll adore {recommended_city}'s twist on it!"
-"""
+    Returns:
+        str: A formatted LLM prompt for generating travel recommendations
+    """
+    # Rendered from a precompiled template and memoized per recommendation
+    prompt, _ = render_prompt(
+        "city",
+        recommended_city,
+        top_cities,
+        bottom_cities,
+        lime_explanation,
+        distances,
+        compact,
+    )
 
     return prompt
 
 
-def process_area_selections(more_of_zipcodes, less_of_zipcodes):
+def process_area_selections(
+    more_of_zipcodes,
+    less_of_zipcodes,
+    explain_workers=None,
+    candidate_limit=None,
+    explain=True,
+    budget=None,
+):
     """
     Process the user's zipcode selections to recommend a Miami area.
+
+    Args:
+        more_of_zipcodes (list): List of zipcodes the user likes more
+        less_of_zipcodes (list): List of zipcodes the user likes less
+        explain_workers (int, optional): Number of worker processes used to explain the scored zipcodes. Explanations run serially when not set
+        candidate_limit (int, optional): Only score the zipcodes an ANN index finds closest to the more-of zipcodes
+        explain (bool): Explain the recommendation with LIME. Without it the result is cheap and flagged as degraded
+        budget (LatencyBudget, optional): Time budget, optional stages shrink or are skipped to meet it. Runs in full when not set
+
+    Returns:
+        RecommendationResult: Recommended zipcode, confidence percentage, explanation and distances
     """
     print(f"User likes more of: {more_of_zipcodes}")
     print(f"User likes less of: {less_of_zipcodes}")
 
-    # Convert zipcode strings to integers
-    more_of_zipcodes_int = [int(z) for z in more_of_zipcodes]
-    less_of_zipcodes_int = [int(z) for z in less_of_zipcodes]
-
     if not more_of_zipcodes and not less_of_zipcodes:
         print("No zipcode selections provided")
-        return (
+        RANDOM_FALLBACKS.inc(kind="zipcode", reason="no_selection")
+        return RecommendationResult(
             "33139",
             75,
-            {"random_recommendation": 1.0},
+            RANDOM_EXPLANATION,
             {"notice": "Insufficient data for detailed analysis"},
         )
 
-    # Load the zipcode pairs data
-    pairs_df = pl.read_csv("data/similar_zipcode_pairs.csv")
+    if budget is None:
+        budget = LatencyBudget()
+
+    # Convert zipcode strings to integers, the keys of the zipcode pairs table
+    more_of_zipcodes_int = [int(z) for z in more_of_zipcodes]
+    less_of_zipcodes_int = [int(z) for z in less_of_zipcodes]
 
     # Load the saved model (use zipcode specific model if available)
     try:
-        booster = lgb.Booster(model_file="data/lgbm_zipcodes_model.txt")
+        model_file = ZIPCODE_MODEL_FILE
+        booster = load_booster(model_file)
     except:
         # Fallback to city model if zipcode model not available
-        booster = lgb.Booster(model_file="data/lgbm_cbsa_k3_model.txt")
-
-    # Get all unique Miami zipcodes for recommendations
-    miami_zipcodes = (
-        pairs_df.filter(
-            pl.col("city1_name").eq("Miami") | pl.col("city2_name").eq("Miami")
-        )
-        .select(
-            pl.when(pl.col("city1_name").eq("Miami"))
-            .then(pl.col("zipcode1"))
-            .otherwise(pl.col("zipcode2"))
-            .unique()
-            .alias("miami_zipcode")
-        )
-        .to_series()
-        .to_list()
+        model_file = CBSA_MODEL_FILE
+        booster = load_booster(model_file)
+
+    # Answer repeated selections from the recommendation cache
+    cache_key = recommendation_key(
+        "zipcode",
+        model_version(model_file),
+        pairs_version("zipcode"),
+        more_of_zipcodes_int,
+        less_of_zipcodes_int,
+        candidate_limit=candidate_limit,
+    )
+    cached = get_recommendation_cache().get(cache_key)
+    if cached is not None:
+        return cached
+
+    # Every Miami zipcode that the user has not selected, from the pairs table
+    # and the entity store
+    selected = set(more_of_zipcodes_int + less_of_zipcodes_int)
+    candidates = [key for key in get_candidate_keys("zipcode") if key not in selected]
+    pair_index = get_pair_index("zipcode")
+    candidate_mask = get_candidate_mask("zipcode") & ~pair_index.selection_mask(
+        list(selected)
     )
 
-    # Filter out any selected Miami zipcodes from recommendations
-    miami_zipcodes = [
-        z
-        for z in miami_zipcodes
-        if z not in more_of_zipcodes_int and z not in less_of_zipcodes_int
-    ]
-
-    if not miami_zipcodes:
+    if not candidates:
         print("No available Miami zipcodes for recommendation")
-        return (
+        RANDOM_FALLBACKS.inc(kind="zipcode", reason="all_selected")
+        return RecommendationResult(
             "33139",
             75,
-            {"random_recommendation": 1.0},
+            RANDOM_EXPLANATION,
             {"notice": "All Miami zipcodes already selected"},
         )
 
-    # Define features to use for similarity
-    features = [
-        "scenesDistance",
-        "frequencyCosine",
-        "geographicDistance",
-        "populationDistance",
-        "bachelorDistance",
-        "raceDistance",
-        "incomeDistance",
-        "employmentDistance",
-        "votingDistance",
-    ]
-
-    # Calculate scores for each potential Miami zipcode
-    zipcode_scores = {}
-    zipcode_distances = {}
-
-    for miami_zip in miami_zipcodes:
-        # Get pairs between this Miami zipcode and selected zipcodes
-        miami_pairs = pairs_df.filter(
-            (
-                # Get pairs where either end is this Miami zipcode
-                (pl.col("city1_name").eq("Miami") & pl.col("zipcode1").eq(miami_zip))
-                | (pl.col("city2_name").eq("Miami") & pl.col("zipcode2").eq(miami_zip))
-            )
-            & (
-                # And the other end is in our selected zipcodes
-                (
-                    pl.col("zipcode1").is_in(
-                        more_of_zipcodes_int + less_of_zipcodes_int
-                    )
-                    | pl.col("zipcode2").is_in(
-                        more_of_zipcodes_int + less_of_zipcodes_int
-                    )
-                )
+    # Answer from the precomputed table when this selection was materialized,
+    # and no zipcode outside the pairs table competes with its answer
+    precomputed = None
+    if ranked_by_table("zipcode", candidates):
+        with budget.stage("table"):
+            precomputed = recommend_from_table(
+                "zipcode",
+                booster,
+                model_file,
+                candidate_mask,
+                more_of_zipcodes_int,
+                less_of_zipcodes_int,
             )
+        TABLE_LOOKUPS.inc(
+            kind="zipcode", result="miss" if precomputed is None else "hit"
         )
-
-        # Simplify the transformation to just identify which zipcode is from the "other" city
-        miami_pairs = miami_pairs.with_columns(
-            [
-                # For each pair, get the non-Miami zipcode
-                pl.when(pl.col("city1_name").eq("Miami"))
-                .then(pl.col("zipcode2"))
-                .otherwise(pl.col("zipcode1"))
-                .alias("other_zipcode"),
-                # For each pair, get the non-Miami zipcode
-                pl.when(pl.col("city1_name").eq("Miami"))
-                .then(pl.col("zipcode1"))
-                .otherwise(pl.col("zipcode2"))
-                .alias("selected_zipcode"),
-            ],
+    if precomputed is not None:
+        recommended_zip, score, X = precomputed
+        print(score, recommended_zip)
+        explanation = explain_within_budget(
+            booster, model_file, X, recommended_zip, budget, explain
         )
-
-        # Now separate into more_of and less_of pairs - much simpler now
-        more_of_pairs = miami_pairs.filter(
-            pl.col("other_zipcode").is_in(more_of_zipcodes_int)
-        )
-
-        less_of_pairs = miami_pairs.filter(
-            pl.col("other_zipcode").is_in(less_of_zipcodes_int)
+        return remember_recommendation(
+            cache_key,
+            RecommendationResult(
+                str(recommended_zip),
+                int(score * 100),
+                Explanation.from_dict(explanation) if explanation else {},
+                collect_distances(X, budget),
+                degraded=not budget.ran("explain"),
+                stages=budget.report(),
+            ),
         )
 
-        # Skip if no comparison data
-        if len(more_of_pairs) == 0 and len(less_of_pairs) == 0:
-            print(f"No relevant comparison data for Miami zipcode {miami_zip}")
-            continue
+    # Calculate scores for each potential Miami zipcode
+    zipcode_scores = {}
+    zipcode_features = {}
 
-        top_distances = more_of_pairs.group_by(["selected_zipcode"]).agg(
-            [
-                pl.col(feat).drop_nans().drop_nulls().mean().alias(f"mean_top_{feat}")
-                for feat in features
-            ]
-        )
-        bottom_distances = less_of_pairs.group_by(["selected_zipcode"]).agg(
-            [
-                pl.col(feat)
-                .drop_nans()
-                .drop_nulls()
-                .mean()
-                .alias(f"mean_bottom_{feat}")
-                for feat in features
-            ]
+    with budget.stage("filter"):
+        candidates = prefilter_candidates(
+            "zipcode", candidates, more_of_zipcodes_int, candidate_limit
         )
 
-        joined_distances = top_distances.join(
-            bottom_distances,
-            on=["selected_zipcode"],
-            how="full",
-            suffix="_bottom",
+    # Score every Miami zipcode in one pass over the pair index. Unless every
+    # zipcode is explained only the best one is kept, and packed models stop
+    # evaluating the others as soon as they cannot win
+    with budget.stage("score", candidates=len(candidates)):
+        scored, unpaired = score_candidates(
+            "zipcode",
+            booster,
+            candidates,
+            more_of_zipcodes_int,
+            less_of_zipcodes_int,
+            top_k=None if explain and not budget.limited else 1,
         )
-
-        df = joined_distances.to_pandas()
-
-        # Skip if empty dataframe
-        if df.empty:
-            print(f"Empty dataframe for Miami zipcode {miami_zip}")
-            continue
-
-        X = df[
-            [f"mean_top_{feat}" for feat in features]
-            + [f"mean_bottom_{feat}" for feat in features]
-        ]
-
-        predictions = booster.predict(X)
-
-        # Create fallback simple explanation if LIME fails
-        feature_importance = {}
-
-        try:
-            # Add LIME explanation
-            feature_names = list(X.columns)
-            explanation = explain_prediction_with_lime(booster, X, feature_names)
-
-            # Store the explanation results and sort them by absolute value
-            feature_importance_list = explanation.as_list()
-            # Sort by absolute magnitude of feature importance
-            sorted_importance = sorted(
-                feature_importance_list, key=lambda x: abs(x[1]), reverse=True
+    for miami_zip in unpaired:
+        print(f"No relevant comparison data for Miami zipcode {miami_zip}")
+
+    # Score the zipcodes the pairs table has no data for from their raw attributes,
+    # unless the budget is spent and other zipcodes were scored
+    attribute_scored = {}
+    if unpaired and scored and budget.expired():
+        budget.skip("unpaired", "over budget")
+    else:
+        with budget.stage("unpaired", candidates=len(unpaired)):
+            attribute_scored = score_unpaired_candidates(
+                "zipcode",
+                booster,
+                unpaired,
+                more_of_zipcodes_int,
+                less_of_zipcodes_int,
             )
-
-            # Store as ordered dictionary
-            feature_importance = {feat: value for feat, value in sorted_importance}
-        except Exception as e:
-            print(f"LIME explanation failed for {miami_zip}: {e}")
-            # Create a fallback simplified explanation using the raw feature values
-            for feat in features:
-                top_key = f"mean_top_{feat}"
-                bottom_key = f"mean_bottom_{feat}"
-                if top_key in df.columns and bottom_key in df.columns:
-                    feature_importance[top_key] = float(df[top_key].iloc[0])
-                    feature_importance[bottom_key] = float(df[bottom_key].iloc[0])
-
-        # Store the raw distance values for this zipcode
-        raw_distances = {}
-        for feat in features:
-            if f"mean_top_{feat}" in df.columns:
-                raw_distances[f"top_{feat}"] = float(df[f"mean_top_{feat}"].iloc[0])
-            if f"mean_bottom_{feat}" in df.columns:
-                raw_distances[f"bottom_{feat}"] = float(
-                    df[f"mean_bottom_{feat}"].iloc[0]
-                )
-
-        zipcode_distances[miami_zip] = raw_distances
-
-        # Store zipcode score and explanation
-        zipcode_scores[miami_zip] = {
-            "score": float(predictions[0]),
-            "explanation": feature_importance,
-        }
+    scored.update(attribute_scored)
+    count_candidates(
+        "zipcode",
+        len(candidates),
+        len(candidates) - len(unpaired),
+        len(attribute_scored),
+    )
+    for miami_zip, (score, X) in scored.items():
+        zipcode_features[miami_zip] = X
+        # Store zipcode score, the explanation is filled in once all zipcodes are scored
+        zipcode_scores[miami_zip] = {"score": score, "explanation": {}}
+
+    # Explain every scored zipcode, in a process pool when workers are requested.
+    # On a time budget only the recommended zipcode is explained, further down.
+    if explain and not budget.limited:
+        with budget.stage("explain", candidates=len(zipcode_features)):
+            explanations = explain_scored_candidates(
+                booster, model_file, zipcode_features, explain_workers
+            )
+        for miami_zip, feature_importance in explanations.items():
+            zipcode_scores[miami_zip]["explanation"] = feature_importance
 
     # If no zipcodes were scored, return random recommendation with simple explanation
     if not zipcode_scores:
         print("No Miami zipcodes could be scored")
-        return (
+        RANDOM_FALLBACKS.inc(kind="zipcode", reason="no_scores")
+        return RecommendationResult(
             "33139",
             75,
-            {"random_recommendation": 1.0},
+            RANDOM_EXPLANATION,
             {"notice": "Insufficient data for detailed analysis"},
         )
 
@@ -648,6 +1539,16 @@ def process_area_selections(more_of_zipcodes, less_of_zipcodes):
     score = zipcode_scores[recommended_zip]["score"]
     confidence = int(score * 100)
 
+    if budget.limited or not explain:
+        zipcode_scores[recommended_zip]["explanation"] = explain_within_budget(
+            booster,
+            model_file,
+            zipcode_features[recommended_zip],
+            recommended_zip,
+            budget,
+            explain,
+        )
+
     # Prepare explanation for display
     explanation_dict = zipcode_scores[recommended_zip]["explanation"]
 
@@ -658,16 +1559,26 @@ def process_area_selections(more_of_zipcodes, less_of_zipcodes):
 
     print(score, recommended_zip)
 
-    return (
-        str(recommended_zip),
-        confidence,
-        sorted_explanation,
-        zipcode_distances[recommended_zip],
+    return remember_recommendation(
+        cache_key,
+        RecommendationResult(
+            str(recommended_zip),
+            confidence,
+            Explanation.from_dict(sorted_explanation),
+            collect_distances(zipcode_features[recommended_zip], budget),
+            degraded=not budget.ran("explain"),
+            stages=budget.report(),
+        ),
     )
 
 
 def generate_area_recommendation_prompt(
-    recommended_zipcode, more_of_zipcodes, less_of_zipcodes, explanation, distances
+    recommended_zipcode,
+    more_of_zipcodes,
+    less_of_zipcodes,
+    explanation,
+    distances,
+    compact=False,
 ):
     """
     Generate a personalized area recommendation prompt for an LLM system.
@@ -678,73 +1589,20 @@ def generate_area_recommendation_prompt(
         less_of_zipcodes (list): List of zipcodes the user likes less
         explanation (dict): Explanation with feature importance values
         distances (dict): Raw distance values between zipcodes
+        compact (bool): Build the size-capped compact prompt used in links
 
     Returns:
         str: A formatted LLM prompt for generating area recommendations
     """
-    if not explanation or not distances:
-        return f"Based on your preferences, Miami zipcode {recommended_zipcode} seems like a great match for your preferences!"
-
-    # Feature name translation dictionary
-    feature_translations = {
-        "scenesDistance": "urban atmosphere",
-        "frequencyCosine": "venue mix and attractions",
-        "geographicDistance": "neighborhood layout",
-        "populationDistance": "population density and feel",
-        "bachelorDistance": "educational character",
-        "raceDistance": "cultural diversity",
-        "incomeDistance": "economic profile",
-        "employmentDistance": "professional opportunities",
-        "votingDistance": "community values",
-    }
-
-    # Format zipcode lists for the prompt
-    more_of_str = ", ".join(more_of_zipcodes) if more_of_zipcodes else "None provided"
-    less_of_str = ", ".join(less_of_zipcodes) if less_of_zipcodes else "None provided"
-
-    # Format the explanations and distances for readability
-    explanations_formatted = "\n".join(
-        [f"    {k}: {v}" for k, v in explanation.items()]
+    # Rendered from a precompiled template and memoized per recommendation
+    prompt, _ = render_prompt(
+        "area",
+        recommended_zipcode,
+        more_of_zipcodes,
+        less_of_zipcodes,
+        explanation,
+        distances,
+        compact,
     )
 
-    # Format distances dictionary
-    distances_formatted = "\n".join([f"    {k}: {v}" for k, v in distances.items()])
-
-    # Create the prompt template
-    prompt = f"""
-Task: Write a 3-4 sentence neighborhood recommendation for Miami zipcode {recommended_zipcode} based on the user's preferences from New York and Los Angeles. Explain why this Miami area matches their preferences and what they'll love about it.
-
-Input Data:
-
-    More Of Zipcodes (Preferred): {more_of_str} → The user enjoys these neighborhood characteristics.
-
-    Less Of Zipcodes (Less Preferred): {less_of_str} → The user wants to avoid these neighborhood characteristics.
-
-    Explanation Scores (Higher values = better match):
-    {explanations_formatted}
-
-    Raw Distance Values (Lower = more similar):
-    {distances_formatted}
-
-Instructions:
-
-    Focus on Neighborhood Character: Highlight how this Miami area captures the essence of neighborhoods the user likes (using more_of_zipcodes) while avoiding aspects they don't (from less_of_zipcodes).
-    
-    Translate Technical Terms: Use these friendly translations for metrics:
-        scenesDistance → "urban atmosphere & street vibe"
-        frequencyCosine → "local businesses & amenities"
-        populationDistance → "neighborhood density & energy"
-        raceDistance → "cultural character"
-        incomeDistance → "local economy"
-        
-    Compare Directly: Use phrases like "Similar to New York's 10001, you'll find..." or "Unlike LA's 90210, this area offers..."
-    
-    Be Specific: Mention actual characteristics of the recommended area (local cafes, walkability, nightlife, etc.)
-    
-    End with Enthusiasm: Finish with a compelling reason why they'll love living/visiting there
-
-Output Template:
-"Miami's {recommended_zipcode} neighborhood captures everything you love about {more_of_zipcodes[0] if more_of_zipcodes else 'your preferred areas'} with its [specific characteristic]. You'll appreciate the [feature] that resembles [specific NY/LA area], while avoiding the [less desirable trait] found in {less_of_zipcodes[0] if less_of_zipcodes else 'areas you liked less'}. This vibrant area offers [unique Miami benefit] that makes it perfect for [activity/lifestyle]."
-"""
-
     return prompt
@@ -0,0 +1,78 @@
+import argparse
+import subprocess
+import sys
+
+# Modules imported when each page of the app is first shown
+ENTRY_MODULES = [
+    "home_page",
+    "city_recommendation_page",
+    "area_recommendation_page",
+    "helper",
+]
+
+
+def profile_import(module):
+    """
+    Measure the import time of a module in a fresh interpreter with -X importtime.
+
+    Args:
+        module (str): Module to import
+
+    Returns:
+        list: (cumulative_us, self_us, name) for every module it imported,
+        slowest cumulative first
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+    )
+
+    timings = []
+    for line in result.stderr.splitlines():
+        # Lines look like "import time:  self [us] | cumulative | imported package"
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        timings.append((int(cumulative_us), int(self_us), name.rstrip()))
+
+    return sorted(timings, reverse=True)
+
+
+def import_profile_report(modules=ENTRY_MODULES, top=10):
+    """
+    Build a report of the slowest imports behind each entry module.
+
+    Args:
+        modules (list): Entry modules to profile
+        top (int): Slowest imports listed per module
+
+    Returns:
+        str: The report
+    """
+    lines = []
+    for module in modules:
+        timings = profile_import(module)
+        if not timings:
+            lines.append(f"{module}: import failed")
+            continue
+
+        total = next((t for t in timings if t[2].strip() == module), timings[0])
+        lines.append(f"{module}: {total[0] / 1e6:.3f}s")
+        for cumulative_us, self_us, name in timings[:top]:
+            lines.append(
+                f"    {cumulative_us / 1e6:8.3f}s  (self {self_us / 1e6:.3f}s)  {name}"
+            )
+
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Report the slowest imports behind each page of the app"
+    )
+    parser.add_argument("modules", nargs="*", default=ENTRY_MODULES)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    print(import_profile_report(args.modules, args.top))
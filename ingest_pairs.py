@@ -0,0 +1,221 @@
+import argparse
+import json
+import os
+from collections import Counter
+
+import numpy as np
+
+from distance_kernel import (
+    PAIR_COLUMNS,
+    load_entity_attributes,
+    pair_distances,
+    select_entities,
+)
+from recommendation_table import file_version
+from shared_store import DEFAULT_STORE_DIR, PAIR_TABLES, replace_store, stage_store
+
+# Entity attribute columns used as key and label for each pairs table
+ENTITY_COLUMNS = {
+    "cbsa": {"key": "name", "label": "cbsa_id", "skip_same_label": False},
+    "zipcode": {"key": "zipcode_id", "label": "city_name", "skip_same_label": True},
+}
+
+
+def count_pairs(labels, skip_same_label):
+    """
+    Count the pairs the ingestion will write.
+
+    Args:
+        labels (list): Label of every entity
+        skip_same_label (bool): Whether pairs within the same label are left out
+
+    Returns:
+        int: Number of unordered pairs
+    """
+    n = len(labels)
+    total = n * (n - 1) // 2
+    if skip_same_label:
+        total -= sum(count * (count - 1) // 2 for count in Counter(labels).values())
+
+    return total
+
+
+def _write_adjacency(table_dir, id1, id2, columns, n_entities, chunk_size):
+    """
+    Write the pair index adjacency of the ingested pairs, one chunk of pairs at
+    a time.
+
+    Edges are placed with a counting sort in the order a stable sort by source
+    entity gives, first the pairs an entity is id1 of, then those it is id2 of.
+
+    Args:
+        table_dir (str): Directory of the table being written
+        id1 (np.ndarray): First entity of every pair
+        id2 (np.ndarray): Second entity of every pair
+        columns (dict): Values of every feature column per pair
+        n_entities (int): Number of entities
+        chunk_size (int): Pairs placed per step
+    """
+    n_pairs = len(id1)
+    degrees = np.zeros(n_entities, dtype=np.int64)
+    for start in range(0, n_pairs, chunk_size):
+        degrees += np.bincount(id1[start : start + chunk_size], minlength=n_entities)
+        degrees += np.bincount(id2[start : start + chunk_size], minlength=n_entities)
+    offsets = np.concatenate([[0], np.cumsum(degrees)])
+    np.save(os.path.join(table_dir, "adjacency_offsets.npy"), offsets)
+
+    neighbours = np.lib.format.open_memmap(
+        os.path.join(table_dir, "adjacency_neighbours.npy"),
+        mode="w+",
+        dtype=np.int32,
+        shape=(2 * n_pairs,),
+    )
+    values = np.lib.format.open_memmap(
+        os.path.join(table_dir, "adjacency_values.npy"),
+        mode="w+",
+        dtype=np.float64,
+        shape=(2 * n_pairs, len(columns)),
+    )
+
+    cursor = offsets[:-1].copy()
+    for sources, targets in [(id1, id2), (id2, id1)]:
+        for start in range(0, n_pairs, chunk_size):
+            chunk = slice(start, start + chunk_size)
+            order = np.argsort(sources[chunk], kind="stable")
+            chunk_sources = np.asarray(sources[chunk])[order]
+            # Position of every edge among the chunk's edges of its entity
+            rank = np.arange(len(order)) - np.searchsorted(chunk_sources, chunk_sources)
+            positions = cursor[chunk_sources] + rank
+            neighbours[positions] = np.asarray(targets[chunk])[order]
+            values[positions] = np.column_stack(
+                [np.asarray(column[chunk])[order] for column in columns.values()]
+            )
+            cursor += np.bincount(chunk_sources, minlength=n_entities)
+
+    neighbours.flush()
+    values.flush()
+
+
+def build_pairs_store(entities_csv, kind, store_dir=DEFAULT_STORE_DIR, chunk_size=1024):
+    """
+    Compute every pair of entities and stream them into the columnar pairs store.
+
+    Pairs are computed one (chunk_size x chunk_size) block at a time and written
+    straight into preallocated memory-mapped columns, so memory stays bounded by
+    the block size instead of the O(N²) pair count.
+
+    The table is written into a new version of the whole store, with the other
+    tables and the geometry linked in from the current one, which then replaces
+    it in one step. Readers never see a half-written or partial store.
+
+    Args:
+        entities_csv (str): Path of the per-entity attributes CSV
+        kind (str): "cbsa" or "zipcode", the pairs table to build
+        store_dir (str): Shared store directory the table is written into
+        chunk_size (int): Number of entities per block
+
+    Returns:
+        int: Number of pairs written
+
+    Raises:
+        ValueError: If the store lacks the other tables or geometry and their
+            source files are missing
+    """
+    columns = ENTITY_COLUMNS[kind]
+    attributes = load_entity_attributes(entities_csv, columns["key"], columns["label"])
+    keys = attributes["keys"]
+    labels = attributes["labels"]
+    skip_same_label = columns["skip_same_label"]
+    n_entities = len(keys)
+    n_pairs = count_pairs(labels, skip_same_label)
+
+    # Integer label codes so blocks can compare labels with NumPy
+    label_codes = {label: i for i, label in enumerate(dict.fromkeys(labels))}
+    label_ids = np.asarray([label_codes[label] for label in labels])
+
+    tmp_store = stage_store(store_dir, kind)
+    table_dir = os.path.join(tmp_store, kind)
+    os.makedirs(table_dir)
+
+    def open_column(name, dtype):
+        return np.lib.format.open_memmap(
+            os.path.join(table_dir, f"{name}.npy"),
+            mode="w+",
+            dtype=dtype,
+            shape=(n_pairs,),
+        )
+
+    id1 = open_column("id1", np.int32)
+    id2 = open_column("id2", np.int32)
+    outputs = {column: open_column(column, np.float64) for column in PAIR_COLUMNS}
+
+    written = 0
+    for i0 in range(0, n_entities, chunk_size):
+        i1 = min(i0 + chunk_size, n_entities)
+        block_a = select_entities(attributes, slice(i0, i1))
+
+        for j0 in range(i0, n_entities, chunk_size):
+            j1 = min(j0 + chunk_size, n_entities)
+            block_b = select_entities(attributes, slice(j0, j1))
+
+            # Keep each unordered pair once (i < j), optionally across labels only
+            rows = np.arange(i0, i1)[:, None]
+            cols = np.arange(j0, j1)[None, :]
+            keep = rows < cols
+            if skip_same_label:
+                keep &= label_ids[rows] != label_ids[cols]
+
+            n_block = int(keep.sum())
+            if n_block == 0:
+                continue
+
+            block_rows, block_cols = np.nonzero(keep)
+            id1[written : written + n_block] = block_rows + i0
+            id2[written : written + n_block] = block_cols + j0
+
+            distances = pair_distances(block_a, block_b)
+            for column, values in distances.items():
+                outputs[column][written : written + n_block] = values[keep]
+
+            written += n_block
+
+        print(f"Ingested {written}/{n_pairs} {kind} pairs")
+
+    for array in [id1, id2, *outputs.values()]:
+        array.flush()
+    _write_adjacency(table_dir, id1, id2, outputs, n_entities, chunk_size * chunk_size)
+    del id1, id2, outputs
+
+    table = PAIR_TABLES[kind]
+    with open(os.path.join(table_dir, "entities.json"), "w") as f:
+        json.dump(
+            {
+                "columns": list(table["keys"]) + list(table["labels"]) + PAIR_COLUMNS,
+                "feature_columns": PAIR_COLUMNS,
+                "null_columns": [],
+                "keys": keys,
+                "labels": labels,
+                "version": file_version(entities_csv),
+            },
+            f,
+        )
+
+    replace_store(tmp_store, store_dir)
+
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build a pairs table from per-entity attributes"
+    )
+    parser.add_argument("entities_csv", help="Per-entity attributes CSV")
+    parser.add_argument("--kind", choices=sorted(ENTITY_COLUMNS), default="cbsa")
+    parser.add_argument("--store", default=DEFAULT_STORE_DIR, help="Store directory")
+    parser.add_argument("--chunk-size", type=int, default=1024)
+    args = parser.parse_args()
+
+    n_pairs = build_pairs_store(
+        args.entities_csv, args.kind, args.store, args.chunk_size
+    )
+    print(f"Wrote {n_pairs} pairs to {os.path.join(args.store, args.kind)}")
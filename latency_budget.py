@@ -0,0 +1,117 @@
+import math
+import os
+import time
+from contextlib import contextmanager
+
+from metrics import histogram
+
+# Seconds a recommendation may take end to end, queueing included. Kept under
+# the admission deadline so the pipeline trims itself before it is abandoned.
+LATENCY_BUDGET = float(os.environ.get("CTS_LATENCY_BUDGET", 8))
+
+STAGE_SECONDS = histogram(
+    "cts_stage_seconds", "Seconds each recommendation pipeline stage took", ["stage"]
+)
+
+
+class RequestCancelled(Exception):
+    """
+    Raised when a stage starts after its request was cancelled.
+    """
+
+
+class LatencyBudget:
+    """
+    Time left for one request, and what each stage of its pipeline did.
+
+    A budget without seconds never runs out, so the pipeline runs in full.
+    A cancelled budget has no time left and stops the pipeline at its next stage.
+    """
+
+    def __init__(self, seconds=None):
+        self.seconds = seconds
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.cancelled = False
+
+    @property
+    def limited(self):
+        return self.seconds is not None
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def remaining(self):
+        """
+        Seconds left in the budget.
+
+        Returns:
+            float: Seconds left, never negative, inf for an unlimited budget
+        """
+        if self.cancelled:
+            return 0.0
+        if not self.limited:
+            return math.inf
+        return max(0.0, self.seconds - self.elapsed())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def cancel(self):
+        """
+        Stop the request at its next stage, e.g. once nobody waits for it.
+        """
+        self.cancelled = True
+
+    @contextmanager
+    def stage(self, name, **details):
+        """
+        Time a stage that runs.
+
+        Args:
+            name (str): Stage name
+            **details: Extra values reported with the stage, e.g. its size
+
+        Yields:
+            dict: The stage's report entry, seconds are added when it ends
+
+        Raises:
+            RequestCancelled: When the request was cancelled
+        """
+        if self.cancelled:
+            raise RequestCancelled(name)
+        entry = {"ran": True, **details}
+        self.stages[name] = entry
+        start = time.perf_counter()
+        try:
+            yield entry
+        finally:
+            seconds = time.perf_counter() - start
+            entry["seconds"] = round(seconds, 4)
+            STAGE_SECONDS.observe(seconds, stage=name)
+
+    def skip(self, name, reason):
+        """
+        Record a stage that was skipped.
+
+        Args:
+            name (str): Stage name
+            reason (str): Why it did not run
+        """
+        self.stages[name] = {"ran": False, "reason": reason}
+
+    def ran(self, name):
+        return self.stages.get(name, {}).get("ran", False)
+
+    def report(self):
+        """
+        Summarize the budget for the result.
+
+        Returns:
+            dict: Budget and elapsed seconds, and the report of every stage
+        """
+        return {
+            "budget_seconds": self.seconds,
+            "elapsed_seconds": round(self.elapsed(), 4),
+            "stages": {name: dict(entry) for name, entry in self.stages.items()},
+        }
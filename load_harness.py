@@ -0,0 +1,383 @@
+import argparse
+import json
+import multiprocessing
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from replay_requests import latency_summary
+from session_store import memory_footprint, process_rss_bytes
+
+# Maps each page draws, in order. A simulated click lands on one of them.
+PAGE_MAPS = {"city": ["city"], "area": ["ny", "la", "miami"]}
+
+# Areas a simulated user may pick on each map of the area page
+AREA_MAPS = {"ny": "New York", "la": "Los Angeles"}
+
+# Seconds AppTest waits for one script run, recommendations included
+SCRIPT_TIMEOUT = 120
+
+# Seconds a session waits for the others to be ready before it starts anyway
+START_TIMEOUT = 600
+
+_targets = {}
+
+
+def _simulated_map(fig, **kwargs):
+    # Stands in for st_folium, which AppTest cannot render or click: it returns
+    # the click the harness queued for this map, as the real component would
+    import streamlit as st
+
+    maps = PAGE_MAPS[st.session_state._harness_page]
+    index = st.session_state._harness_map_calls
+    st.session_state._harness_map_calls = index + 1
+
+    out = {"last_object_clicked": None, "last_object_clicked_tooltip": None}
+    click = st.session_state.get("_harness_click")
+    if not click or index >= len(maps) or click[0] != maps[index]:
+        return out
+
+    if click[0] == "city":
+        lat, lng = get_click_targets()["city"][click[1]]
+        out["last_object_clicked"] = {"lat": lat, "lng": lng}
+    else:
+        out["last_object_clicked_tooltip"] = click[1]
+
+    return out
+
+
+def run_page(page):
+    """
+    Run a page inside an AppTest session, timing the script and measuring the
+    memory of the session after it.
+
+    Args:
+        page (str): "city" or "area"
+    """
+    import streamlit as st
+
+    if page == "city":
+        import city_recommendation_page as module
+    else:
+        import area_recommendation_page as module
+    module.st_folium = _simulated_map
+
+    st.session_state._harness_page = page
+    st.session_state._harness_map_calls = 0
+    for key in ["_harness_script_seconds", "_harness_memory_bytes"]:
+        if key not in st.session_state:
+            st.session_state[key] = []
+
+    start = time.perf_counter()
+    try:
+        module.show()
+    finally:
+        # st.rerun ends a run with an exception, it still counts
+        st.session_state._harness_script_seconds.append(time.perf_counter() - start)
+        footprint = memory_footprint(st.session_state)
+        st.session_state._harness_memory_bytes.append(
+            footprint["session_state_bytes"] + footprint["session_cached_bytes"]
+        )
+
+
+def _city_app():
+    import load_harness
+
+    load_harness.run_page("city")
+
+
+def _area_app():
+    import load_harness
+
+    load_harness.run_page("area")
+
+
+APPS = {"city": _city_app, "area": _area_app}
+
+
+def get_click_targets():
+    """
+    Markers and areas the simulated users can click, loaded once.
+
+    Returns:
+        dict: City coordinates by name, and the zipcodes of the New York and
+        Los Angeles maps
+    """
+    if not _targets:
+        from helper import get_city_coordinates_data, load_zipcode_features
+
+        features = load_zipcode_features(list(AREA_MAPS.values()))
+        _targets["city"] = get_city_coordinates_data()
+        for map_name, city_name in AREA_MAPS.items():
+            _targets[map_name] = [
+                feature["properties"]["zipcode_id"]
+                for feature in features
+                if feature["properties"]["city_name"] == city_name
+            ]
+
+    return _targets
+
+
+def _selection_plan(page, rng):
+    # Clicks of one journey: (map, marker, button key), 1-3 cities or 1-4 areas
+    targets = get_click_targets()
+    if page == "city":
+        cities = rng.sample(sorted(targets["city"]), rng.randint(1, 3))
+        return [("city", city, rng.choice(["more", "less"])) for city in cities]
+
+    plan = []
+    for map_name in AREA_MAPS:
+        for zipcode in rng.sample(targets[map_name], rng.randint(0, 2)):
+            plan.append(
+                (map_name, zipcode, f"{map_name}_{rng.choice(['more', 'less'])}")
+            )
+
+    return plan or [("ny", rng.choice(targets["ny"]), "ny_more")]
+
+
+def _prepare_process():
+    # Load the models and data before the sessions start, so they are not
+    # measured as the first user's latency or memory growth
+    from thread_governor import configure_threads
+    from warmup import warmup
+
+    configure_threads()
+    warmup()
+    get_click_targets()
+
+
+def simulate_user(page, seed, journeys=1, start_barrier=None):
+    """
+    Drive one session through the page like a user: click markers, mark them as
+    more-of or less-of, request a recommendation and start over.
+
+    Args:
+        page (str): "city" or "area"
+        seed (int): Seed of the user's random choices
+        journeys (int): Selections and recommendations made in the same session
+        start_barrier (Barrier, optional): Waited on before the first interaction,
+            so simultaneous users start together
+
+    Returns:
+        dict: Seconds of every interaction by type, seconds of every script run,
+        session bytes after every run, the process RSS growth and the
+        exceptions the page raised
+    """
+    from streamlit.testing.v1 import AppTest
+
+    if start_barrier is not None:
+        start_barrier.wait(START_TIMEOUT)
+
+    rss_before = process_rss_bytes()
+    rng = random.Random(seed)
+    at = AppTest.from_function(APPS[page], default_timeout=SCRIPT_TIMEOUT)
+    interactions = {}
+    exceptions = []
+
+    def interact(action, widget=None):
+        if widget is not None:
+            widget.click()
+        start = time.perf_counter()
+        at.run()
+        interactions.setdefault(action, []).append(time.perf_counter() - start)
+        exceptions.extend(f"{page} {action}: {e.value}" for e in at.exception)
+
+    def button(label=None, key=None):
+        for widget in at.button:
+            if widget.key == key if key else label in widget.label:
+                return None if widget.disabled else widget
+        return None
+
+    interact("load")
+    for _ in range(journeys):
+        for map_name, marker, key in _selection_plan(page, rng):
+            at.session_state["_harness_click"] = (map_name, marker)
+            interact("click_marker")
+            # Disabled once the category is full
+            toggle = button(key=key)
+            if toggle:
+                interact("toggle", toggle)
+
+        # The map keeps its last click, leave it before moving on
+        at.session_state["_harness_click"] = None
+        recommend = button("Get Recommendation")
+        if recommend:
+            interact("recommend", recommend)
+        reset = button("Reset" if page == "city" else "Start Over")
+        if reset:
+            interact("reset", reset)
+
+    return {
+        "page": page,
+        "interactions": interactions,
+        "script_seconds": list(at.session_state["_harness_script_seconds"]),
+        "memory_bytes": list(at.session_state["_harness_memory_bytes"]),
+        "rss_growth_bytes": process_rss_bytes() - rss_before,
+        "exceptions": exceptions,
+    }
+
+
+def run_load(pages=("city", "area"), users=4, journeys=1, seed=0):
+    """
+    Run simulated users in parallel, each in its own session.
+
+    AppTest swaps a process-wide runtime in and out on every run, so sessions
+    cannot run side by side in one process: each user gets its own process,
+    warmed up before all of them start at once.
+
+    Args:
+        pages (tuple): Pages the users are spread over, round robin
+        users (int): Simultaneous sessions
+        journeys (int): Journeys each user makes in their session
+        seed (int): Seed of the first user, the others follow it
+
+    Returns:
+        dict: Summaries of interaction latency, script time, session state and
+        RSS growth per page, and the exceptions raised
+    """
+    # Forking a process with polars' thread pool running can deadlock
+    context = multiprocessing.get_context("spawn")
+    with context.Manager() as manager, ProcessPoolExecutor(
+        max_workers=users, mp_context=context, initializer=_prepare_process
+    ) as executor:
+        start_barrier = manager.Barrier(users)
+        start = time.perf_counter()
+        sessions = list(
+            executor.map(
+                simulate_user,
+                [pages[i % len(pages)] for i in range(users)],
+                [seed + i for i in range(users)],
+                [journeys] * users,
+                [start_barrier] * users,
+            )
+        )
+        seconds = time.perf_counter() - start
+
+    report = {
+        "users": users,
+        "journeys": journeys,
+        "seconds": seconds,
+        "exceptions": [e for session in sessions for e in session["exceptions"]],
+        "pages": {},
+    }
+    for page in pages:
+        page_sessions = [s for s in sessions if s["page"] == page]
+        actions = sorted({a for s in page_sessions for a in s["interactions"]})
+        report["pages"][page] = {
+            "interactions": {
+                action: latency_summary(
+                    [
+                        t
+                        for s in page_sessions
+                        for t in s["interactions"].get(action, [])
+                    ]
+                )
+                for action in actions
+            },
+            "script": latency_summary(
+                [t for s in page_sessions for t in s["script_seconds"]]
+            ),
+            # Bytes the session held after its last run beyond its first
+            "session_growth_bytes": [
+                s["memory_bytes"][-1] - s["memory_bytes"][0] for s in page_sessions
+            ],
+            "rss_growth_bytes": [s["rss_growth_bytes"] for s in page_sessions],
+        }
+
+    return report
+
+
+def load_report(report):
+    """
+    Build a readable report of a load run.
+
+    Args:
+        report (dict): Result of run_load
+
+    Returns:
+        str: The report
+    """
+    lines = [
+        f"{report['users']} users x {report['journeys']} journeys in "
+        f"{report['seconds']:.2f}s, {len(report['exceptions'])} exceptions"
+    ]
+    for page, summary in report["pages"].items():
+        lines.append(f"{page}:")
+        timings = dict(summary["interactions"], script=summary["script"])
+        for name, timing in timings.items():
+            if not timing["count"]:
+                continue
+            lines.append(
+                f"    {name:<13} n={timing['count']:<4d} p50 {timing['p50']:.3f}s  "
+                f"p90 {timing['p90']:.3f}s  max {timing['max']:.3f}s"
+            )
+        growth = summary["session_growth_bytes"]
+        if growth:
+            lines.append(
+                f"    session state growth max {max(growth) / 1024:.1f} KB, "
+                f"mean {sum(growth) / len(growth) / 1024:.1f} KB"
+            )
+            rss_growth = summary["rss_growth_bytes"]
+            lines.append(
+                f"    process RSS growth max {max(rss_growth) / 1024**2:.1f} MB, "
+                f"mean {sum(rss_growth) / len(rss_growth) / 1024**2:.1f} MB"
+            )
+    for exception in report["exceptions"]:
+        lines.append(f"exception: {exception}")
+
+    return "\n".join(lines)
+
+
+def check_thresholds(report, max_p90=None, max_growth=None):
+    """
+    Find the limits a load run broke.
+
+    Args:
+        report (dict): Result of run_load
+        max_p90 (float, optional): Seconds the p90 of every interaction must stay under
+        max_growth (int, optional): Bytes every session may grow by
+
+    Returns:
+        list: Descriptions of the broken limits, empty when the run passed
+    """
+    failures = [f"exception: {e}" for e in report["exceptions"]]
+    for page, summary in report["pages"].items():
+        for action, timing in summary["interactions"].items():
+            if max_p90 is not None and timing["count"] and timing["p90"] > max_p90:
+                failures.append(
+                    f"{page} {action} p90 {timing['p90']:.3f}s > {max_p90}s"
+                )
+        for growth in summary["session_growth_bytes"]:
+            if max_growth is not None and growth > max_growth:
+                failures.append(f"{page} session grew {growth} bytes > {max_growth}")
+
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Drive simultaneous simulated sessions through the recommendation pages"
+    )
+    parser.add_argument(
+        "--pages", nargs="+", choices=list(PAGE_MAPS), default=list(PAGE_MAPS)
+    )
+    parser.add_argument("--users", type=int, default=4)
+    parser.add_argument("--journeys", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--max-p90", type=float, help="Fail when an interaction's p90 exceeds it"
+    )
+    parser.add_argument(
+        "--max-session-growth", type=int, help="Fail when a session grows more bytes"
+    )
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    report = run_load(tuple(args.pages), args.users, args.journeys, args.seed)
+    print(json.dumps(report, indent=2) if args.json else load_report(report))
+
+    failures = check_thresholds(report, args.max_p90, args.max_session_growth)
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    sys.exit(1 if failures else 0)
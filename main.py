@@ -1,26 +1,57 @@
+import os
+from thread_governor import configure_threads
+
+# Cap the thread pools of polars, LightGBM and BLAS before they are loaded
+configure_threads()
+
 import streamlit as st
 from streamlit_option_menu import option_menu
-import city_recommendation_page
-import home_page
-import area_recommendation_page
 
 # Set page to wide mode
 st.set_page_config(layout="wide", page_title="From Cities To Streets", page_icon="🏙️")
 
-# Create a horizontal menu
+# Create a horizontal menu, with the Operations page when operators configured it
+options = ["Home", "City Recommendation", "Area Recommendation"]
+icons = ["house", "map", "building"]
+if os.environ.get("CTS_OPERATIONS_TOKEN"):
+    options.append("Operations")
+    icons.append("speedometer2")
+
 selected = option_menu(
     menu_title=None,
-    options=["Home", "City Recommendation", "Area Recommendation"],
-    icons=["house", "map", "building"],
+    options=options,
+    icons=icons,
     menu_icon="cast",
     default_index=0,
     orientation="horizontal",
 )
 
-# Display the selected page
+# Display the selected page, importing it on first use so the Home page
+# does not load the models, maps and charts of the recommendation pages
 if selected == "Home":
+    import home_page
+
     home_page.show()
 elif selected == "City Recommendation":
+    import city_recommendation_page
+
     city_recommendation_page.show()
 elif selected == "Area Recommendation":
+    import area_recommendation_page
+
     area_recommendation_page.show()
+elif selected == "Operations":
+    import operations_page
+
+    operations_page.show()
+
+# Serve or write the metrics when configured, once per process
+from metrics import start_metrics_exporter
+
+start_metrics_exporter()
+
+# Optionally preload the models and data once the page has been sent
+if os.environ.get("CTS_WARMUP", "0") == "1":
+    from warmup import start_background_warmup
+
+    start_background_warmup()
@@ -0,0 +1,354 @@
+import bisect
+import math
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Port of the Prometheus text endpoint, off unless it is set
+METRICS_PORT = int(os.environ.get("CTS_METRICS_PORT", 0))
+# Interface the endpoint listens on, local only unless a scraper elsewhere needs it
+METRICS_HOST = os.environ.get("CTS_METRICS_HOST", "127.0.0.1")
+
+# File the Prometheus text is written to every METRICS_INTERVAL seconds, off
+# unless it is set
+METRICS_FILE = os.environ.get("CTS_METRICS_FILE", "")
+METRICS_INTERVAL = float(os.environ.get("CTS_METRICS_INTERVAL", 15))
+
+_metrics = {}
+_metrics_lock = threading.Lock()
+_exporter = {"started": False}
+
+
+def _label_text(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for name, value in pairs
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+class Counter:
+    """
+    Monotonic count per label set, e.g. requests per page.
+    """
+
+    kind = "counter"
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        """
+        Add to the count of a label set.
+
+        Args:
+            amount (float): Amount added
+            **labels: Value of every label of the counter
+        """
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self.lock:
+            return self.values.get(key, 0)
+
+    def totals_by(self, label):
+        """
+        Sum the counts over every label but one.
+
+        Args:
+            label (str): Label the totals are kept apart by
+
+        Returns:
+            dict: Total count per value of the label
+        """
+        position = self.labels.index(label)
+        totals = {}
+        with self.lock:
+            for key, value in self.values.items():
+                totals[key[position]] = totals.get(key[position], 0) + value
+
+        return totals
+
+    def expose(self):
+        with self.lock:
+            values = sorted(self.values.items())
+
+        return [
+            f"{self.name}{_label_text(self.labels, key)} {value}"
+            for key, value in values
+        ]
+
+
+class Histogram:
+    """
+    Distribution of values per label set, with HDR-style log-linear buckets.
+
+    Every power of two between lowest and highest is split into sub_buckets
+    linear buckets, so any quantile is known within 1 / sub_buckets of its
+    value at a fixed cost per observation. The Prometheus exposition only
+    lists the power-of-two bounds to keep scrapes small.
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self, name, description, labels=(), lowest=1e-5, highest=1e3, sub_buckets=8
+    ):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.sub_buckets = sub_buckets
+        low, high = math.floor(math.log2(lowest)), math.ceil(math.log2(highest))
+        self.bounds = [
+            2.0**exponent * (1 + step / sub_buckets)
+            for exponent in range(low, high)
+            for step in range(1, sub_buckets + 1)
+        ]
+        self.bounds.insert(0, 2.0**low)
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        """
+        Record one value.
+
+        Args:
+            value (float): Observed value, e.g. seconds
+            **labels: Value of every label of the histogram
+        """
+        key = tuple(str(labels[name]) for name in self.labels)
+        # The last slot counts the values above the highest bound
+        index = bisect.bisect_left(self.bounds, value)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = {
+                    "counts": [0] * (len(self.bounds) + 1),
+                    "count": 0,
+                    "sum": 0.0,
+                }
+            series["counts"][index] += 1
+            series["count"] += 1
+            series["sum"] += value
+
+    def label_sets(self):
+        """
+        Label sets observed so far.
+
+        Returns:
+            list: Dict of label values per label set
+        """
+        with self.lock:
+            keys = sorted(self.series)
+
+        return [dict(zip(self.labels, key)) for key in keys]
+
+    def quantiles(self, qs=(0.5, 0.95, 0.99), **labels):
+        """
+        Estimate quantiles of a label set, or of every label set together when
+        no labels are given.
+
+        Args:
+            qs (tuple): Quantiles between 0 and 1
+            **labels: Value of every label of the histogram
+
+        Returns:
+            dict: Count, sum, and the upper bound of the bucket holding each quantile
+        """
+        with self.lock:
+            if labels:
+                key = tuple(str(labels[name]) for name in self.labels)
+                selected = [self.series[key]] if key in self.series else []
+            else:
+                selected = list(self.series.values())
+            counts = [sum(column) for column in zip(*(s["counts"] for s in selected))]
+            count = sum(s["count"] for s in selected)
+            total = sum(s["sum"] for s in selected)
+
+        summary = {"count": count, "sum": total}
+        for q in qs:
+            summary[f"p{q * 100:g}"] = self._quantile(counts, count, q)
+
+        return summary
+
+    def _quantile(self, counts, count, q):
+        if not count:
+            return None
+        rank = max(1, math.ceil(q * count))
+        seen = 0
+        for index, bucket_count in enumerate(counts):
+            seen += bucket_count
+            if seen >= rank:
+                return self.bounds[index] if index < len(self.bounds) else math.inf
+        return math.inf
+
+    def expose(self):
+        with self.lock:
+            series = sorted(
+                (key, list(s["counts"]), s["count"], s["sum"])
+                for key, s in self.series.items()
+            )
+
+        lines = []
+        for key, counts, count, total in series:
+            cumulative = 0
+            for index, bound in enumerate(self.bounds):
+                cumulative += counts[index]
+                # Power-of-two bounds only
+                if index % self.sub_buckets == 0:
+                    le = _label_text(self.labels, key, [("le", f"{bound:g}")])
+                    lines.append(f"{self.name}_bucket{le} {cumulative}")
+            le = _label_text(self.labels, key, [("le", "+Inf")])
+            lines.append(f"{self.name}_bucket{le} {count}")
+            lines.append(f"{self.name}_sum{_label_text(self.labels, key)} {total}")
+            lines.append(f"{self.name}_count{_label_text(self.labels, key)} {count}")
+
+        return lines
+
+
+def _register(cls, name, description, labels, **options):
+    with _metrics_lock:
+        metric = _metrics.get(name)
+        if metric is None:
+            metric = _metrics[name] = cls(name, description, labels, **options)
+        elif not isinstance(metric, cls) or metric.labels != tuple(labels):
+            raise ValueError(f"Metric {name} is already registered differently")
+
+    return metric
+
+
+def counter(name, description, labels=()):
+    """
+    Get or register a counter.
+
+    Args:
+        name (str): Metric name, ending in _total
+        description (str): Help text of the metric
+        labels (tuple): Label names
+
+    Returns:
+        Counter: The process-wide counter
+    """
+    return _register(Counter, name, description, labels)
+
+
+def histogram(name, description, labels=(), **options):
+    """
+    Get or register a histogram.
+
+    Args:
+        name (str): Metric name, with its unit as suffix
+        description (str): Help text of the metric
+        labels (tuple): Label names
+        **options: lowest, highest and sub_buckets of the buckets
+
+    Returns:
+        Histogram: The process-wide histogram
+    """
+    return _register(Histogram, name, description, labels, **options)
+
+
+def get_metric(name):
+    with _metrics_lock:
+        return _metrics.get(name)
+
+
+def prometheus_text():
+    """
+    Every metric in the Prometheus text exposition format.
+
+    Returns:
+        str: The exposition
+    """
+    with _metrics_lock:
+        metrics = sorted(_metrics.values(), key=lambda metric: metric.name)
+
+    lines = []
+    for metric in metrics:
+        lines.append(f"# HELP {metric.name} {metric.description}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.expose())
+
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics_file(path=None):
+    """
+    Write the exposition to a file a scraper or node exporter can read,
+    replacing it in one step.
+
+    Args:
+        path (str, optional): File written, METRICS_FILE when not set
+    """
+    path = path or METRICS_FILE
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(f"{path}.tmp", "w") as f:
+        f.write(prometheus_text())
+    os.replace(f"{path}.tmp", path)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes would flood the app log
+        pass
+
+
+def _write_metrics_periodically():
+    while True:
+        time.sleep(METRICS_INTERVAL)
+        try:
+            write_metrics_file()
+        except OSError as e:
+            print(f"Writing metrics to {METRICS_FILE} failed: {e}")
+
+
+def start_metrics_exporter():
+    """
+    Serve /metrics on METRICS_HOST:METRICS_PORT and write METRICS_FILE, whichever are set,
+    once per process.
+
+    Returns:
+        bool: Whether this call started an exporter
+    """
+    with _metrics_lock:
+        if _exporter["started"] or not (METRICS_PORT or METRICS_FILE):
+            return False
+        _exporter["started"] = True
+
+    if METRICS_PORT:
+        try:
+            server = ThreadingHTTPServer((METRICS_HOST, METRICS_PORT), _MetricsHandler)
+        except OSError as e:
+            print(f"Serving metrics on {METRICS_HOST}:{METRICS_PORT} failed: {e}")
+        else:
+            threading.Thread(
+                target=server.serve_forever, name="metrics-server", daemon=True
+            ).start()
+    if METRICS_FILE:
+        threading.Thread(
+            target=_write_metrics_periodically, name="metrics-file", daemon=True
+        ).start()
+
+    return True
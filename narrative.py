@@ -0,0 +1,221 @@
+import hashlib
+import json
+import os
+import threading
+import urllib.request
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from prompt_templates import FALLBACK_PROMPTS
+
+# Which backend writes the narratives: "template" (local, no network) or "local"
+# (an OpenAI-compatible inference server such as llama.cpp, vLLM or Ollama)
+NARRATIVE_BACKEND = os.environ.get("CTS_NARRATIVE_BACKEND", "template")
+NARRATIVE_URL = os.environ.get("CTS_NARRATIVE_URL", "http://localhost:8080")
+NARRATIVE_MODEL = os.environ.get("CTS_NARRATIVE_MODEL", "local")
+NARRATIVE_TIMEOUT = float(os.environ.get("CTS_NARRATIVE_TIMEOUT", 20))
+
+# Narratives already written, keyed by backend and prompt hash
+NARRATIVE_CACHE_SIZE = 1024
+_narratives = OrderedDict()
+_pending = {}
+_narratives_lock = threading.Lock()
+
+_executor = None
+_backend = None
+
+
+class TemplateBackend:
+    """
+    Deterministic narrative written from the explanation with fixed templates.
+    Needs no network and no model.
+    """
+
+    name = "template"
+
+    def generate(self, prompt, context):
+        """
+        Write the narrative of a recommendation.
+
+        Args:
+            prompt (str): LLM prompt of the recommendation, unused by the templates
+            context (dict): kind, recommended, top, bottom, explanation and distances
+
+        Returns:
+            str: The narrative
+        """
+        import helper
+
+        write = (
+            helper.generate_travel_recommendation
+            if context["kind"] == "city"
+            else helper.generate_area_recommendation
+        )
+        return write(
+            context["recommended"],
+            context["top"],
+            context["bottom"],
+            context["explanation"],
+            context["distances"],
+        )
+
+
+class LocalServerBackend:
+    """
+    Narrative written by a local inference server with an OpenAI-compatible
+    chat completions endpoint.
+    """
+
+    name = "local"
+
+    def __init__(
+        self, url=NARRATIVE_URL, model=NARRATIVE_MODEL, timeout=NARRATIVE_TIMEOUT
+    ):
+        self.url = url.rstrip("/") + "/v1/chat/completions"
+        self.model = model
+        self.timeout = timeout
+
+    def generate(self, prompt, context):
+        """
+        Ask the server to complete the prompt.
+
+        Args:
+            prompt (str): LLM prompt of the recommendation
+            context (dict): Recommendation details, unused by the server
+
+        Returns:
+            str: The narrative
+        """
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps(
+                {
+                    "model": self.model,
+                    "messages": [{"role": "user", "content": prompt}],
+                    "temperature": 0,
+                }
+            ).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            body = json.load(response)
+
+        return body["choices"][0]["message"]["content"].strip()
+
+
+BACKENDS = {"template": TemplateBackend, "local": LocalServerBackend}
+
+
+def get_backend():
+    """
+    Get the narrative backend configured with CTS_NARRATIVE_BACKEND.
+
+    Returns:
+        The backend, TemplateBackend when the name is unknown
+    """
+    global _backend
+    if _backend is None:
+        _backend = BACKENDS.get(NARRATIVE_BACKEND, TemplateBackend)()
+
+    return _backend
+
+
+def set_backend(backend):
+    """
+    Replace the narrative backend, e.g. with a different server.
+
+    Args:
+        backend: Object with a name attribute and a generate(prompt, context) method
+    """
+    global _backend
+    _backend = backend
+
+
+def _get_executor():
+    global _executor
+    with _narratives_lock:
+        if _executor is None:
+            # Generation is I/O bound for the server backend and cheap for the
+            # template one, so a couple of threads serve every session
+            _executor = ThreadPoolExecutor(
+                max_workers=2, thread_name_prefix="narrative"
+            )
+
+    return _executor
+
+
+def _write(backend, prompt, context):
+    # Never leave the page without a narrative: the templates stand in for a
+    # failed backend, and a fixed message for failed templates
+    backends = [backend]
+    if backend.name != TemplateBackend.name:
+        backends.append(TemplateBackend())
+    for writer in backends:
+        try:
+            return writer.generate(prompt, context)
+        except Exception as e:
+            print(f"Narrative backend {writer.name} failed: {e}")
+
+    kind = context.get("kind", "city")
+    return FALLBACK_PROMPTS[kind].format(recommended=context.get("recommended"))
+
+
+def _generate(backend, key, prompt, context):
+    text = _write(backend, prompt, context)
+
+    with _narratives_lock:
+        _narratives[key] = text
+        if len(_narratives) > NARRATIVE_CACHE_SIZE:
+            _narratives.popitem(last=False)
+        _pending.pop(key, None)
+
+    return text
+
+
+def request_narrative(prompt, context):
+    """
+    Start writing the narrative of a recommendation without waiting for it.
+
+    Args:
+        prompt (str): LLM prompt of the recommendation
+        context (dict): kind, recommended, top, bottom, explanation and distances
+
+    Returns:
+        str: Cache key of the narrative, passed to get_narrative
+    """
+    backend = get_backend()
+    key = hashlib.sha256(f"{backend.name}\n{prompt}".encode("utf-8")).hexdigest()
+    executor = _get_executor()
+
+    with _narratives_lock:
+        if key not in _narratives and key not in _pending:
+            _pending[key] = executor.submit(_generate, backend, key, prompt, context)
+
+    return key
+
+
+def get_narrative(key, timeout=0):
+    """
+    Get a narrative, waiting at most timeout seconds for it to be written.
+
+    Args:
+        key (str): Key returned by request_narrative
+        timeout (float): Seconds to wait when it is still being written
+
+    Returns:
+        str: The narrative, or None when it is not ready yet
+    """
+    with _narratives_lock:
+        if key in _narratives:
+            _narratives.move_to_end(key)
+            return _narratives[key]
+        future = _pending.get(key)
+
+    if future is None:
+        return None
+
+    try:
+        return future.result(timeout=timeout)
+    except TimeoutError:
+        # Still being written
+        return None
@@ -0,0 +1,204 @@
+import hmac
+import os
+import time
+
+import pandas as pd
+import streamlit as st
+
+from admission_control import admission_stats
+from helper import PACKED_MODELS, loaded_versions
+from metrics import get_metric
+from profiler_hooks import recent_profiles
+from recommendation_cache import get_recommendation_cache
+from request_log import recent_requests
+from session_store import get_result_cache, process_rss_bytes
+from thread_governor import thread_settings
+from warmup import warmup_status
+
+# Token operators enter to open the page, the page stays closed without one
+OPERATIONS_TOKEN = os.environ.get("CTS_OPERATIONS_TOKEN", "")
+
+# Seconds of recent requests the throughput is measured over
+THROUGHPUT_WINDOW = 60
+
+# Seconds between refreshes while auto refresh is on
+REFRESH_INTERVAL = 5
+
+
+def _unlocked():
+    # Operators unlock the page once per session
+    if st.session_state.get("operations_unlocked"):
+        return True
+    if not OPERATIONS_TOKEN:
+        st.info(
+            "The Operations page is disabled, set CTS_OPERATIONS_TOKEN to enable it."
+        )
+        return False
+
+    token = st.text_input("Operations token", type="password")
+    if token and hmac.compare_digest(token, OPERATIONS_TOKEN):
+        st.session_state.operations_unlocked = True
+        st.rerun()
+    elif token:
+        st.error("Wrong token.")
+
+    return False
+
+
+def _milliseconds(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
+
+
+def latency_table(metric_name, label):
+    """
+    Latency percentiles of every label set of a histogram.
+
+    Args:
+        metric_name (str): Histogram name
+        label (str): Label the rows are split by
+
+    Returns:
+        pd.DataFrame: Count and p50/p95/p99 in milliseconds per label value
+    """
+    metric = get_metric(metric_name)
+    rows = []
+    for labels in metric.label_sets() if metric else []:
+        summary = metric.quantiles(**labels)
+        rows.append(
+            {
+                label: labels[label],
+                "count": summary["count"],
+                "p50 ms": _milliseconds(summary["p50"]),
+                "p95 ms": _milliseconds(summary["p95"]),
+                "p99 ms": _milliseconds(summary["p99"]),
+            }
+        )
+
+    return pd.DataFrame(rows)
+
+
+def hit_ratio(metric_name, hit_label, hits, misses):
+    """
+    Share of lookups a counter records as hits.
+
+    Args:
+        metric_name (str): Counter name
+        hit_label (str): Label telling hits from misses
+        hits (list): Label values counted as hits
+        misses (list): Label values counted as misses
+
+    Returns:
+        float: Hit ratio, None before the first lookup
+    """
+    metric = get_metric(metric_name)
+    totals = metric.totals_by(hit_label) if metric else {}
+    hit_count = sum(totals.get(value, 0) for value in hits)
+    total = hit_count + sum(totals.get(value, 0) for value in misses)
+
+    return round(hit_count / total, 3) if total else None
+
+
+def data_versions():
+    """
+    Versions of the models and pairs tables this process serves, captured when
+    they were loaded, so a file replaced on disk does not show until a restart
+    picks it up.
+
+    Returns:
+        dict: Version of every model file and pairs table, None when not loaded yet
+    """
+    versions = loaded_versions()
+    versions["packed models"] = PACKED_MODELS
+
+    return versions
+
+
+def show_operations():
+    requests = recent_requests()
+    now = time.time()
+    window = [r for r in requests if now - r["time"] <= THROUGHPUT_WINDOW]
+
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric(
+        f"Requests/s ({THROUGHPUT_WINDOW}s)", f"{len(window) / THROUGHPUT_WINDOW:.2f}"
+    )
+    col2.metric("Process RSS", f"{process_rss_bytes() / 1024**2:.0f} MB")
+    admission = admission_stats()
+    col3.metric("In flight", f"{admission['in_flight']}/{admission['max_in_flight']}")
+    col4.metric(
+        "Degraded (recent)",
+        f"{sum(r['degraded'] for r in requests)}/{len(requests)}",
+    )
+
+    st.markdown("### Latency")
+    col1, col2 = st.columns(2)
+    with col1:
+        st.markdown("#### Requests by page")
+        st.dataframe(latency_table("cts_request_seconds", "page"), hide_index=True)
+    with col2:
+        st.markdown("#### Pipeline stages")
+        st.dataframe(latency_table("cts_stage_seconds", "stage"), hide_index=True)
+
+    st.markdown("### Caches")
+    recommendation_cache = get_recommendation_cache().stats()
+    result_cache = get_result_cache().stats()
+    col1, col2, col3 = st.columns(3)
+    col1.metric(
+        "Recommendation cache hit ratio",
+        hit_ratio(
+            "cts_recommendation_cache_lookups_total", "tier", ["l1", "l2"], ["miss"]
+        ),
+    )
+    col2.metric(
+        "Precomputed table hit ratio",
+        hit_ratio("cts_table_lookups_total", "result", ["hit"], ["miss"]),
+    )
+    col3.metric(
+        "Result cache",
+        f"{result_cache['bytes'] / 1024**2:.1f}/"
+        f"{result_cache['max_bytes'] / 1024**2:.0f} MB",
+    )
+    with st.expander("Cache details"):
+        st.json({"recommendation": recommendation_cache, "result": result_cache})
+
+    st.markdown("### Slowest recent requests")
+    slowest = sorted(requests, key=lambda r: r["seconds"], reverse=True)[:10]
+    if slowest:
+        table = pd.DataFrame(slowest)
+        table["time"] = pd.to_datetime(table["time"], unit="s")
+        st.dataframe(
+            table[["time", "page", "seconds", "recommended", "degraded", "cache"]],
+            hide_index=True,
+        )
+    else:
+        st.info("No recommendation requests yet.")
+
+    st.markdown("### Process")
+    col1, col2 = st.columns(2)
+    with col1:
+        st.markdown("#### Models and data")
+        st.json(data_versions())
+        st.markdown("#### Warmup")
+        st.json(warmup_status())
+    with col2:
+        st.markdown("#### Concurrency")
+        st.json(thread_settings())
+        st.json(admission)
+        st.markdown("#### Profiles")
+        st.json(recent_profiles())
+
+
+def show():
+    st.title("Operations")
+
+    if not _unlocked():
+        return
+
+    auto_refresh = st.checkbox(f"Refresh every {REFRESH_INTERVAL}s", value=False)
+
+    # Only the dashboard reruns on refresh, not the whole app
+    @st.fragment(run_every=REFRESH_INTERVAL if auto_refresh else None)
+    def dashboard():
+        show_operations()
+
+    dashboard()
@@ -0,0 +1,556 @@
+import argparse
+import json
+import os
+
+import numpy as np
+
+from recommendation_table import file_version
+
+DEFAULT_PACKED_DIR = os.environ.get("CTS_PACKED_DIR", "data/packed")
+
+# How a split sends missing values, as in LightGBM
+MISSING_NONE = 0
+MISSING_ZERO = 1
+MISSING_NAN = 2
+MISSING_TYPES = {"None": MISSING_NONE, "Zero": MISSING_ZERO, "NaN": MISSING_NAN}
+
+# LightGBM treats values this close to zero as zero
+ZERO_THRESHOLD = 1e-35
+
+# Bits of the per-node flags
+DEFAULT_LEFT = 1
+MISSING_SHIFT = 1
+
+# Largest prediction difference the accuracy check accepts
+ACCURACY_TOLERANCE = 1e-4
+
+# Trees evaluated between two pruning steps of the early-exit top-K scorer
+EARLY_EXIT_BLOCK = 10
+
+# Fewest rows worth pruning. On the 100-tree city model pruning costs more
+# than it saves up to a few hundred rows (10 ms against 2 ms of predict for 16
+# rows) and wins from about 1000 rows on (69 ms against 86 ms). A live
+# selection has a few dozen candidates, so only materialize's batches reach it
+EARLY_EXIT_MIN_ROWS = 512
+
+# Slack on the raw score bounds, covers float32 rounding of the packed trees
+PRUNE_MARGIN = 1e-6
+
+# Packed models loaded by this process, keyed by (model file, version)
+_packed_models = {}
+
+
+class PackedModel:
+    """
+    LightGBM binary or regression ensemble in flat, compact arrays.
+
+    Nodes of every tree are stored one after another: split feature (int16),
+    float32 threshold, child indices (int16, leaves as ~leaf_index) and flags
+    with the default direction and missing type. Leaf values of every tree are
+    packed into one float32 array.
+    """
+
+    def __init__(
+        self,
+        split_feature,
+        threshold,
+        left_child,
+        right_child,
+        flags,
+        leaf_value,
+        node_offsets,
+        leaf_offsets,
+        roots,
+        feature_names,
+        sigmoid=None,
+    ):
+        self.split_feature = split_feature
+        self.threshold = threshold
+        self.left_child = left_child
+        self.right_child = right_child
+        self.flags = flags
+        self.leaf_value = leaf_value
+        self.node_offsets = node_offsets
+        self.leaf_offsets = leaf_offsets
+        self.roots = roots
+        self.feature_names = list(feature_names)
+        self.sigmoid = sigmoid
+
+    def arrays(self):
+        """
+        The arrays that make up the model.
+
+        Returns:
+            dict: Array name to array
+        """
+        return {
+            "split_feature": self.split_feature,
+            "threshold": self.threshold,
+            "left_child": self.left_child,
+            "right_child": self.right_child,
+            "flags": self.flags,
+            "leaf_value": self.leaf_value,
+            "node_offsets": self.node_offsets,
+            "leaf_offsets": self.leaf_offsets,
+            "roots": self.roots,
+        }
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in self.arrays().values())
+
+    def num_trees(self):
+        """
+        Number of trees, like lgb.Booster.num_trees.
+
+        Returns:
+            int: Trees in the ensemble
+        """
+        return len(self.roots)
+
+    def feature_name(self):
+        """
+        Names of the model inputs, like lgb.Booster.feature_name.
+
+        Returns:
+            list: Feature names, in the column order predict expects
+        """
+        return list(self.feature_names)
+
+    def leaf_values(self, X, trees=None):
+        """
+        Find the leaf every row reaches in some trees.
+
+        Args:
+            X (np.ndarray or pd.DataFrame): (n_rows, n_features) model inputs
+            trees (slice or np.ndarray, optional): Trees to evaluate, all when not set
+
+        Returns:
+            np.ndarray: (n_rows, n_trees) float32 value of each reached leaf
+        """
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        if trees is None:
+            trees = slice(0, len(self.roots))
+        n_rows = len(X)
+        rows = np.arange(n_rows)[:, None]
+        node_base = self.node_offsets[trees].astype(np.int64)
+        roots = self.roots[trees].astype(np.int64)
+
+        # Current node of every (row, tree), negative once it reached a leaf
+        node = np.broadcast_to(roots, (n_rows, len(roots))).copy()
+        internal = node >= 0
+        while internal.any():
+            index = node_base + np.where(internal, node, 0)
+            values = X[rows, self.split_feature[index]]
+            flags = self.flags[index]
+            missing_type = flags >> MISSING_SHIFT
+
+            # Splits without a missing type compare NaN as zero
+            values = np.where(
+                np.isnan(values) & (missing_type != MISSING_NAN), 0.0, values
+            )
+            is_missing = (
+                (missing_type == MISSING_ZERO) & (np.abs(values) <= ZERO_THRESHOLD)
+            ) | ((missing_type == MISSING_NAN) & np.isnan(values))
+            go_left = np.where(
+                is_missing,
+                (flags & DEFAULT_LEFT).astype(bool),
+                values <= self.threshold[index],
+            )
+
+            child = np.where(go_left, self.left_child[index], self.right_child[index])
+            node = np.where(internal, child, node)
+            internal = node >= 0
+
+        leaves = self.leaf_offsets[trees] + ~node
+        return self.leaf_value[leaves]
+
+    def link(self, raw):
+        """
+        Turn raw scores into predictions.
+
+        Args:
+            raw (np.ndarray): Raw scores
+
+        Returns:
+            np.ndarray: Probabilities for binary models, the raw scores otherwise
+        """
+        if self.sigmoid is None:
+            return raw
+
+        return 1.0 / (1.0 + np.exp(-self.sigmoid * raw))
+
+    def predict(self, X, raw_score=False):
+        """
+        Predict like lgb.Booster.predict.
+
+        Args:
+            X (np.ndarray or pd.DataFrame): (n_rows, n_features) model inputs
+            raw_score (bool): Return the raw scores instead of probabilities
+
+        Returns:
+            np.ndarray: Prediction of every row
+        """
+        # Summed in tree order, prune_top_k sums the same way
+        raw = self.leaf_values(X).sum(axis=1, dtype=np.float64)
+
+        return raw if raw_score else self.link(raw)
+
+    def leaf_bounds(self):
+        """
+        Smallest and largest leaf value of every tree.
+
+        Returns:
+            tuple: (tree_min, tree_max) float64 arrays
+        """
+        starts = self.leaf_offsets[:-1]
+        return (
+            np.minimum.reduceat(self.leaf_value, starts).astype(np.float64),
+            np.maximum.reduceat(self.leaf_value, starts).astype(np.float64),
+        )
+
+    def prune_top_k(self, X, k=1, groups=None, block_size=EARLY_EXIT_BLOCK):
+        """
+        Find the rows that can still be among the k best of their group.
+
+        Trees are evaluated in blocks. After each block a row's final raw score
+        is bounded by its partial score plus the smallest and largest leaves of
+        the remaining trees, and rows whose upper bound is below the k-th best
+        lower bound of their group are dropped.
+
+        Only pays off on large inputs, see EARLY_EXIT_MIN_ROWS: top_k_rows uses
+        it for the batches of materialize, not for live requests.
+
+        Args:
+            X (np.ndarray): (n_rows, n_features) model inputs
+            k (int): Rows wanted per group
+            groups (np.ndarray, optional): Non-negative group of every row, one
+                group when not set
+            block_size (int): Trees evaluated between two pruning steps
+
+        Returns:
+            tuple: (rows, raw) indices of the rows that survived, in ascending
+            order, and their raw scores over every tree
+        """
+        X = np.asarray(X, dtype=np.float64)
+        n_rows = len(X)
+        groups = (
+            np.zeros(n_rows, dtype=np.int64)
+            if groups is None
+            else np.asarray(groups, dtype=np.int64)
+        )
+        n_trees = len(self.roots)
+        tree_min, tree_max = self.leaf_bounds()
+        # Trees with the widest leaf range first, so the bounds tighten fastest.
+        # The order only affects pruning, the survivors are rescored in full.
+        tree_order = np.argsort(tree_min - tree_max, kind="stable")
+        tree_min, tree_max = tree_min[tree_order], tree_max[tree_order]
+        # Bounds of the trees from each position on, zero after the last tree
+        remaining_min = np.append(np.cumsum(tree_min[::-1])[::-1], 0.0)
+        remaining_max = np.append(np.cumsum(tree_max[::-1])[::-1], 0.0)
+
+        alive = np.arange(n_rows)
+        partial = np.zeros(n_rows)
+        leaves = np.zeros((n_rows, n_trees), dtype=np.float32)
+        for start in range(0, n_trees, block_size):
+            stop = min(start + block_size, n_trees)
+            block = tree_order[start:stop]
+            values = self.leaf_values(X[alive], block)
+            leaves[np.ix_(alive, block)] = values
+            partial[alive] += values.sum(axis=1, dtype=np.float64)
+            if stop == n_trees or len(alive) == 0:
+                break
+
+            lower = partial[alive] + remaining_min[stop]
+            upper = partial[alive] + remaining_max[stop]
+            kth = _kth_largest(lower, groups[alive], k)
+            alive = alive[upper >= kth[groups[alive]] - PRUNE_MARGIN]
+
+        # The survivors reached a leaf in every tree, sum them like predict does
+        return alive, leaves[alive].sum(axis=1, dtype=np.float64)
+
+
+def _kth_largest(values, groups, k):
+    # k-th largest value of every group, -inf for groups with fewer than k values
+    kth = np.full(groups.max() + 1 if len(groups) else 0, -np.inf)
+    order = np.lexsort((-values, groups))
+    sorted_groups = groups[order]
+    at_k = _group_rank(sorted_groups) == k - 1
+    kth[sorted_groups[at_k]] = values[order][at_k]
+
+    return kth
+
+
+def top_k_rows(model, X, k=1, groups=None, block_size=EARLY_EXIT_BLOCK):
+    """
+    Find the k best rows of every group without evaluating every tree for
+    every row.
+
+    Rows of a PackedModel are pruned block by block once there are at least
+    EARLY_EXIT_MIN_ROWS of them. The survivors went through every tree and
+    their leaves are summed in tree order, so the result matches ranking the
+    full predictions. Live requests have fewer rows than that, for them this
+    is a full predict and a ranking.
+
+    Args:
+        model: PackedModel, or any model with predict, which scores every row
+        X (np.ndarray): (n_rows, n_features) model inputs
+        k (int): Rows wanted per group
+        groups (np.ndarray, optional): Non-negative group of every row, one
+            group when not set
+        block_size (int): Trees evaluated between two pruning steps
+
+    Returns:
+        tuple: (rows, scores) of the best rows, ordered by group, then by
+        descending score, then by row index
+    """
+    X = np.asarray(X, dtype=np.float64)
+    groups = (
+        np.zeros(len(X), dtype=np.int64)
+        if groups is None
+        else np.asarray(groups, dtype=np.int64)
+    )
+    if len(X) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+
+    if isinstance(model, PackedModel) and len(X) >= EARLY_EXIT_MIN_ROWS:
+        rows, raw = model.prune_top_k(X, k, groups, block_size)
+        scores = model.link(raw)
+    else:
+        # LightGBM's native predict beats the NumPy evaluator even on the rows
+        # pruning would skip, so other models and small inputs score every row
+        rows = np.arange(len(X))
+        scores = model.predict(X)
+
+    order = np.lexsort((rows, -scores, groups[rows]))
+    rows, scores = rows[order], scores[order]
+    keep = _group_rank(groups[rows]) < k
+
+    return rows[keep], scores[keep]
+
+
+def _group_rank(sorted_groups):
+    # Position of every value within its group, for values sorted by group
+    starts = np.flatnonzero(np.r_[True, sorted_groups[1:] != sorted_groups[:-1]])
+    return np.arange(len(sorted_groups)) - np.repeat(
+        starts, np.diff(np.r_[starts, len(sorted_groups)])
+    )
+
+
+def _objective_sigmoid(objective):
+    # "binary sigmoid:1" -> 1.0, regression objectives have no link function
+    name, *params = objective.split()
+    if name == "binary":
+        params = dict(param.split(":", 1) for param in params)
+        return float(params.get("sigmoid", 1.0))
+    if name.startswith("regression"):
+        return None
+
+    raise ValueError(f"Cannot pack a model with objective {objective}")
+
+
+def pack_booster(booster):
+    """
+    Pack a LightGBM booster into a PackedModel.
+
+    Args:
+        booster (lgb.Booster): Booster with numerical splits and a single output
+
+    Returns:
+        PackedModel: The packed model
+    """
+    dump = booster.dump_model()
+    if dump["num_class"] != 1:
+        raise ValueError("Cannot pack a multiclass model")
+    sigmoid = _objective_sigmoid(dump["objective"])
+
+    split_feature, threshold, left_child, right_child, flags = [], [], [], [], []
+    leaf_value = []
+    node_offsets, leaf_offsets, roots = [0], [0], []
+
+    for tree in dump["tree_info"]:
+        nodes, leaves = [], []
+
+        def visit(node):
+            # Index of the node within its tree, ~leaf index for leaves
+            if "leaf_value" in node:
+                leaves.append(node["leaf_value"])
+                return ~(len(leaves) - 1)
+            if node["decision_type"] != "<=":
+                raise ValueError("Cannot pack a model with categorical splits")
+
+            index = len(nodes)
+            nodes.append(None)
+            left = visit(node["left_child"])
+            right = visit(node["right_child"])
+            nodes[index] = (
+                node["split_feature"],
+                node["threshold"],
+                left,
+                right,
+                (DEFAULT_LEFT if node["default_left"] else 0)
+                | (MISSING_TYPES[node["missing_type"]] << MISSING_SHIFT),
+            )
+            return index
+
+        roots.append(visit(tree["tree_structure"]))
+        if len(nodes) > np.iinfo(np.int16).max or len(leaves) > np.iinfo(np.int16).max:
+            raise ValueError("Cannot pack a tree with more than 32767 nodes")
+
+        for feature, value, left, right, node_flags in nodes:
+            split_feature.append(feature)
+            threshold.append(value)
+            left_child.append(left)
+            right_child.append(right)
+            flags.append(node_flags)
+        leaf_value.extend(leaves)
+        node_offsets.append(node_offsets[-1] + len(nodes))
+        leaf_offsets.append(leaf_offsets[-1] + len(leaves))
+
+    # LightGBM's 1e300 "always left" thresholds become inf, which splits the same way
+    with np.errstate(over="ignore"):
+        threshold = np.array(threshold, dtype=np.float64).astype(np.float32)
+
+    return PackedModel(
+        split_feature=np.array(split_feature, dtype=np.int16),
+        threshold=threshold,
+        left_child=np.array(left_child, dtype=np.int16),
+        right_child=np.array(right_child, dtype=np.int16),
+        flags=np.array(flags, dtype=np.uint8),
+        leaf_value=np.array(leaf_value, dtype=np.float32),
+        node_offsets=np.array(node_offsets, dtype=np.int32),
+        leaf_offsets=np.array(leaf_offsets, dtype=np.int32),
+        roots=np.array(roots, dtype=np.int16),
+        feature_names=dump["feature_names"],
+        sigmoid=sigmoid,
+    )
+
+
+def save_packed_model(model, path):
+    """
+    Save a packed model as one uncompressed .npz file.
+
+    Args:
+        model (PackedModel): Model to save
+        path (str): Destination file
+    """
+    meta = {"feature_names": model.feature_names, "sigmoid": model.sigmoid}
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    # Write to a temporary file first so readers never see a partial model
+    tmp_path = f"{path}.tmp-{os.getpid()}.npz"
+    np.savez(tmp_path, meta=np.array(json.dumps(meta)), **model.arrays())
+    os.replace(tmp_path, path)
+
+
+def load_packed_model(path):
+    """
+    Load a packed model saved by save_packed_model.
+
+    Args:
+        path (str): The .npz file
+
+    Returns:
+        PackedModel: The model
+    """
+    with np.load(path) as data:
+        meta = json.loads(str(data["meta"]))
+        arrays = {name: data[name] for name in data.files if name != "meta"}
+
+    return PackedModel(
+        feature_names=meta["feature_names"], sigmoid=meta["sigmoid"], **arrays
+    )
+
+
+def load_or_pack(model_file, packed_dir=DEFAULT_PACKED_DIR):
+    """
+    Load the packed version of a LightGBM model file once per process, packing
+    it the first time.
+
+    Args:
+        model_file (str): Path of the LightGBM model file
+        packed_dir (str): Directory the packed models are saved in
+
+    Returns:
+        PackedModel: The packed model
+    """
+    version = file_version(model_file)
+    key = (model_file, version)
+    if key in _packed_models:
+        return _packed_models[key]
+
+    name = os.path.splitext(os.path.basename(model_file))[0]
+    path = os.path.join(packed_dir, f"{name}-{version}.npz")
+    model = None
+    if os.path.exists(path):
+        try:
+            model = load_packed_model(path)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Repacking model {path}: {e}")
+
+    if model is None:
+        import lightgbm as lgb
+
+        model = pack_booster(lgb.Booster(model_file=model_file))
+        save_packed_model(model, path)
+
+    _packed_models[key] = model
+
+    return model
+
+
+def check_accuracy(booster, model, X, tolerance=ACCURACY_TOLERANCE):
+    """
+    Compare the predictions of a packed model with its LightGBM booster.
+
+    Args:
+        booster (lgb.Booster): Original booster
+        model (PackedModel): Packed version of the booster
+        X (np.ndarray): (n_rows, n_features) model inputs
+        tolerance (float): Largest accepted absolute difference
+
+    Returns:
+        dict: Rows compared, maximum and mean absolute difference, rows whose
+        rank order changed against the next row, and whether it passed
+    """
+    expected = booster.predict(X)
+    actual = model.predict(X)
+    diff = np.abs(expected - actual)
+
+    return {
+        "rows": len(X),
+        "max_abs_diff": float(diff.max()) if len(diff) else 0.0,
+        "mean_abs_diff": float(diff.mean()) if len(diff) else 0.0,
+        "order_flips": int(
+            np.sum(np.sign(np.diff(expected)) != np.sign(np.diff(actual)))
+        ),
+        "passed": bool(len(diff) == 0 or diff.max() <= tolerance),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Pack the LightGBM models and check them against lgb.Booster.predict"
+    )
+    parser.add_argument("--packed-dir", default=DEFAULT_PACKED_DIR)
+    parser.add_argument("--tolerance", type=float, default=ACCURACY_TOLERANCE)
+    args = parser.parse_args()
+
+    import helper
+
+    failed = False
+    for model_file, kind in helper.MODEL_KINDS.items():
+        packed = load_or_pack(model_file, args.packed_dir)
+        X = helper.sample_model_inputs(kind, drop_missing=False)
+        report = check_accuracy(
+            helper.load_lightgbm_booster(model_file), packed, X, args.tolerance
+        )
+        failed |= not report["passed"]
+        print(
+            f"{model_file}: {packed.num_trees()} trees, {packed.nbytes} bytes packed "
+            f"vs {os.path.getsize(model_file)} bytes of text, {report}"
+        )
+
+    raise SystemExit(1 if failed else 0)
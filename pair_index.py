@@ -0,0 +1,260 @@
+import numpy as np
+import polars as pl
+
+
+class PairIndex:
+    """
+    Adjacency view of a pairs table: for every entity, the entities it has
+    pairs with and the feature values of those pairs.
+
+    Entities are dictionary-encoded as dense int32 IDs, and selections are
+    boolean masks over those IDs. Aggregating the pairs of a whole selection for
+    every candidate at once is then a gather plus a bincount, instead of one
+    filter per candidate.
+    """
+
+    def __init__(
+        self, keys, neighbours, values, offsets, features, labels=None, columns=None
+    ):
+        """
+        Args:
+            keys (list): Entity keys, the position of a key is its ID
+            neighbours (np.ndarray): int32 ID at the far end of every edge,
+                edges grouped by source entity
+            values (np.ndarray): (n_edges, n_columns) pair feature values of every edge
+            offsets (np.ndarray): Position of the first edge of every entity,
+                followed by the number of edges
+            features (list): Names of the features aggregated
+            labels (list, optional): Label of every entity (e.g. its city), or None
+            columns (list, optional): Column of values holding each feature,
+                values holds exactly the features in order when not set
+        """
+        self.features = list(features)
+        self.keys = list(keys)
+        self.ids = {key: i for i, key in enumerate(self.keys)}
+        # Kept as given, so arrays mapped from the shared store stay shared
+        self.neighbours = neighbours
+        self.values = values
+        self.offsets = offsets
+        self.columns = np.arange(len(self.features)) if columns is None else columns
+
+        # Label of every entity, dictionary-encoded as well
+        self.labels = []
+        self.label_ids = np.full(len(self.keys), -1, dtype=np.int32)
+        if labels is not None:
+            labels = [None if label is None else str(label) for label in labels]
+            self.labels = sorted(set(labels) - {None})
+            codes = {label: i for i, label in enumerate(self.labels)}
+            self.label_ids[:] = [codes.get(label, -1) for label in labels]
+
+    @classmethod
+    def from_frame(cls, pairs_df, key_columns, features, label_columns=None):
+        """
+        Build the index from a pairs table, sorting the edges in this process.
+
+        Args:
+            pairs_df (pl.DataFrame): Pairs table
+            key_columns (tuple): Columns of the two entities of a pair
+            features (list): Feature columns aggregated
+            label_columns (tuple, optional): Columns of the labels of both entities
+
+        Returns:
+            PairIndex: The index
+        """
+        key1, key2 = key_columns
+        keys = sorted(set(pairs_df[key1].to_list()) | set(pairs_df[key2].to_list()))
+        ids = {key: i for i, key in enumerate(keys)}
+
+        id1 = pairs_df[key1].replace_strict(ids, return_dtype=pl.Int32).to_numpy()
+        id2 = pairs_df[key2].replace_strict(ids, return_dtype=pl.Int32).to_numpy()
+        values = pairs_df.select(features).cast(pl.Float64).fill_null(np.nan).to_numpy()
+
+        labels = None
+        if label_columns is not None:
+            label1, label2 = label_columns
+            labels = [None] * len(keys)
+            pair_labels = pl.concat(
+                [pairs_df[label1].cast(pl.String), pairs_df[label2].cast(pl.String)]
+            )
+            for i, label in zip(np.concatenate([id1, id2]), pair_labels.to_list()):
+                labels[i] = label
+
+        # Every pair is an edge in both directions, grouped by source entity
+        source = np.concatenate([id1, id2])
+        order = np.argsort(source, kind="stable")
+        offsets = np.concatenate(
+            [[0], np.cumsum(np.bincount(source, minlength=len(keys)))]
+        )
+
+        return cls(
+            keys,
+            np.concatenate([id2, id1])[order],
+            np.concatenate([values, values])[order],
+            offsets,
+            features,
+            labels,
+        )
+
+    @classmethod
+    def from_store(cls, store, kind, features):
+        """
+        Build the index over the adjacency published to a shared store, without
+        copying the edges.
+
+        Args:
+            store (SharedStore): Attached store holding the pairs table
+            kind (str): "cbsa" or "zipcode"
+            features (list): Feature columns aggregated
+
+        Returns:
+            PairIndex: The index
+        """
+        entities = store.entities(kind)
+        neighbours, values, offsets = store.adjacency(kind)
+        columns = np.asarray(
+            [entities["feature_columns"].index(feature) for feature in features]
+        )
+
+        return cls(
+            entities["keys"],
+            neighbours,
+            values,
+            offsets,
+            features,
+            entities["labels"],
+            columns,
+        )
+
+    def to_ids(self, keys):
+        """
+        Convert entity keys to IDs, dropping keys without any pairs.
+
+        Args:
+            keys (list): Entity keys
+
+        Returns:
+            np.ndarray: int32 entity IDs
+        """
+        return np.asarray([self.ids[key] for key in keys if key in self.ids], np.int32)
+
+    def to_keys(self, ids):
+        """
+        Convert entity IDs back to keys.
+
+        Args:
+            ids (np.ndarray): int32 entity IDs
+
+        Returns:
+            list: Entity keys
+        """
+        return [self.keys[i] for i in ids]
+
+    def mask(self, ids):
+        """
+        Encode a set of entity IDs as a boolean mask.
+
+        Args:
+            ids (np.ndarray): int32 entity IDs
+
+        Returns:
+            np.ndarray: Boolean mask with one flag per entity
+        """
+        mask = np.zeros(len(self.keys), dtype=bool)
+        mask[ids] = True
+
+        return mask
+
+    def selection_mask(self, keys):
+        """
+        Encode a selection of entity keys as a boolean mask.
+
+        Args:
+            keys (list): Entity keys, keys without any pairs are ignored
+
+        Returns:
+            np.ndarray: Boolean mask with one flag per entity
+        """
+        return self.mask(self.to_ids(keys))
+
+    def label_mask(self, label):
+        """
+        Mask of the entities with a given label.
+
+        Args:
+            label (str): Label, e.g. a city name
+
+        Returns:
+            np.ndarray: Boolean mask with one flag per entity
+        """
+        if label not in self.labels:
+            return np.zeros(len(self.keys), dtype=bool)
+
+        return self.label_ids == self.labels.index(label)
+
+    def aggregate(self, selected):
+        """
+        Sum the pair features between every entity and a selection.
+
+        Args:
+            selected (np.ndarray): Boolean mask of the selected entities
+
+        Returns:
+            tuple: (sums, counts, pairs) where sums and counts are
+            (n_entities, n_features) totals over the non-NaN values, and pairs is
+            the number of pair rows each entity has with the selection
+        """
+        n = len(self.keys)
+        n_features = len(self.features)
+        selected_ids = np.flatnonzero(selected)
+        if len(selected_ids) == 0:
+            return np.zeros((n, n_features)), np.zeros((n, n_features)), np.zeros(n)
+
+        edges = np.concatenate(
+            [np.arange(self.offsets[s], self.offsets[s + 1]) for s in selected_ids]
+        )
+        neighbours = self.neighbours[edges]
+        values = self.values[edges][:, self.columns]
+        valid = ~np.isnan(values)
+        values = np.where(valid, values, 0.0)
+
+        sums = np.column_stack(
+            [
+                np.bincount(neighbours, weights=values[:, f], minlength=n)
+                for f in range(n_features)
+            ]
+        )
+        counts = np.column_stack(
+            [
+                np.bincount(neighbours, weights=valid[:, f], minlength=n)
+                for f in range(n_features)
+            ]
+        )
+        pairs = np.bincount(neighbours, minlength=n)
+
+        return sums, counts, pairs
+
+    def features_matrix(self, candidate_ids, top, bottom):
+        """
+        Build the model input for many candidates of one selection.
+
+        Args:
+            candidate_ids (np.ndarray): IDs of the candidates to score
+            top (np.ndarray): Boolean mask of the entities the user wants more of
+            bottom (np.ndarray): Boolean mask of the entities the user wants less of
+
+        Returns:
+            tuple: (X, scored) where X is the (n_candidates, 2 * n_features)
+            matrix of mean_top_* then mean_bottom_* values and scored flags the
+            candidates that have at least one pair with the selection
+        """
+        top_sums, top_counts, top_pairs = self.aggregate(top)
+        bottom_sums, bottom_counts, bottom_pairs = self.aggregate(bottom)
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            top_means = top_sums / top_counts
+            bottom_means = bottom_sums / bottom_counts
+
+        X = np.hstack([top_means[candidate_ids], bottom_means[candidate_ids]])
+        scored = (top_pairs[candidate_ids] + bottom_pairs[candidate_ids]) > 0
+
+        return X, scored
@@ -0,0 +1,230 @@
+import cProfile
+import functools
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import deque
+
+# Directory the profiles are written to
+PROFILE_DIR = os.environ.get("CTS_PROFILE_DIR", "data/profiles")
+
+# Profile every request, not only those asking for it
+PROFILE_REQUESTS = os.environ.get("CTS_PROFILE_REQUESTS", "0") == "1"
+
+# Seconds between two profiles, so leaving profiling on costs at most one
+# profiled request per interval
+PROFILE_INTERVAL = float(os.environ.get("CTS_PROFILE_INTERVAL", 60))
+
+# Request header that asks for a profile of that request
+PROFILE_HEADER = "X-CTS-Profile"
+
+# Allocation sites kept in the allocation report, and frames kept per site
+ALLOCATION_TOP = 50
+ALLOCATION_FRAMES = 10
+
+# Seconds between two samples of the request's stack
+SAMPLE_INTERVAL = 0.005
+
+_last_profile = {"started": None, "active": False}
+_recent_profiles = deque(maxlen=20)
+_profile_lock = threading.Lock()
+
+
+def profile_requested(headers=None, debug_mode=False):
+    """
+    Whether the request asks to be profiled, through the environment, its
+    headers or the Debug Mode checkbox.
+
+    Args:
+        headers (Mapping, optional): Request headers, e.g. st.context.headers
+        debug_mode (bool): Whether the session is in Debug Mode
+
+    Returns:
+        bool: Whether the request should be profiled, rate limit permitting
+    """
+    header = (headers or {}).get(PROFILE_HEADER, "")
+
+    return PROFILE_REQUESTS or debug_mode or header.lower() in ("1", "true", "yes")
+
+
+def _claim_profile_slot():
+    # One profile at a time, at most one per PROFILE_INTERVAL
+    now = time.monotonic()
+    with _profile_lock:
+        started = _last_profile["started"]
+        if _last_profile["active"] or (
+            started is not None and now - started < PROFILE_INTERVAL
+        ):
+            return False
+        _last_profile.update(started=now, active=True)
+
+    return True
+
+
+def _release_profile_slot():
+    with _profile_lock:
+        _last_profile["active"] = False
+
+
+class StackSampler:
+    """
+    Samples the stack of one thread in the background and counts the stacks
+    seen, for flame graphs of a request.
+
+    cProfile only records caller and callee pairs, sampling keeps whole stacks.
+    """
+
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = {}
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="stack-sampler")
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                if code in _SAMPLER_CODE:
+                    # The thread is starting or joining this sampler, not working
+                    stack = []
+                    break
+                # Lines are left out so the samples of a function add up
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                key = ";".join(reversed(stack))
+                self.counts[key] = self.counts.get(key, 0) + 1
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def collapsed(self):
+        """
+        The samples as collapsed stacks, the input of flame graph tools.
+
+        Returns:
+            list: "outer;inner;innermost samples" lines
+        """
+        return [f"{stack} {count}" for stack, count in sorted(self.counts.items())]
+
+
+# Code of the sampler methods the sampled thread runs itself
+_SAMPLER_CODE = {StackSampler.start.__code__, StackSampler.stop.__code__}
+
+
+def allocation_top(snapshot, limit=ALLOCATION_TOP):
+    """
+    Report the allocation sites holding the most memory.
+
+    Args:
+        snapshot (tracemalloc.Snapshot): Snapshot taken at the end of the request
+        limit (int): Sites listed
+
+    Returns:
+        list: Report lines, largest site first, each followed by its traceback
+    """
+    # Leave out the tracer's own bookkeeping
+    snapshot = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+    stats = snapshot.statistics("traceback")
+    total = sum(stat.size for stat in stats)
+    lines = [f"{total / 1024:.1f} KB in {len(stats)} allocation sites"]
+    for stat in stats[:limit]:
+        lines.append(f"{stat.size / 1024:10.1f} KB  {stat.count:8d} blocks")
+        lines.extend(f"    {line}" for line in stat.traceback.format())
+
+    return lines
+
+
+def _write_profile(name, profile, sampler, snapshot, seconds):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    prefix = os.path.join(PROFILE_DIR, f"{stamp}-{name}")
+
+    stats = pstats.Stats(profile)
+    paths = {
+        "pstats": f"{prefix}.pstats",
+        "collapsed": f"{prefix}.collapsed",
+        "allocations": f"{prefix}.allocations.txt",
+    }
+    stats.dump_stats(paths["pstats"])
+    with open(paths["collapsed"], "w") as f:
+        f.write("\n".join(sampler.collapsed()) + "\n")
+    with open(paths["allocations"], "w") as f:
+        f.write("\n".join(allocation_top(snapshot)) + "\n")
+
+    record = {"name": name, "seconds": round(seconds, 4), "files": paths}
+    with _profile_lock:
+        _recent_profiles.appendleft(record)
+
+    return record
+
+
+def with_profiling(fn, requested):
+    """
+    Wrap a recommender so the call is profiled, when it was requested and the
+    rate limit has a slot free.
+
+    cProfile and the stack sampler cover the request's own thread, while
+    tracemalloc sees every allocation of the process during the request.
+
+    Args:
+        fn (callable): generate_recommendation or process_area_selections
+        requested (bool): Whether the request asked for a profile, see profile_requested
+
+    Returns:
+        callable: fn itself, or a wrapper that profiles the first call it gets a slot for
+    """
+    if not requested:
+        return fn
+
+    @functools.wraps(fn)
+    def profiled(*args, **kwargs):
+        if not _claim_profile_slot():
+            return fn(*args, **kwargs)
+
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start(ALLOCATION_FRAMES)
+        profile = cProfile.Profile()
+        sampler = StackSampler(threading.get_ident())
+        sampler.start()
+        start = time.perf_counter()
+        try:
+            return profile.runcall(fn, *args, **kwargs)
+        finally:
+            seconds = time.perf_counter() - start
+            sampler.stop()
+            snapshot = tracemalloc.take_snapshot()
+            if started_tracing:
+                tracemalloc.stop()
+            try:
+                record = _write_profile(
+                    fn.__name__, profile, sampler, snapshot, seconds
+                )
+                print(f"Profiled {fn.__name__} into {record['files']['collapsed']}")
+            except OSError as e:
+                print(f"Writing the profile of {fn.__name__} failed: {e}")
+            _release_profile_slot()
+
+    return profiled
+
+
+def recent_profiles():
+    """
+    Profiles written by this process, newest first.
+
+    Returns:
+        list: Name, duration and files of every recent profile
+    """
+    with _profile_lock:
+        return list(_recent_profiles)
@@ -0,0 +1,353 @@
+import re
+import threading
+import urllib.parse
+from collections import OrderedDict
+
+# Friendly names of the distance features, used by the prompts of each recommender
+FEATURE_TRANSLATIONS = {
+    "city": {
+        "scenesDistance": "cultural vibe",
+        "frequencyCosine": "venue mix and attractions",
+        "geographicDistance": "geographical location",
+        "populationDistance": "city size and atmosphere",
+        "bachelorDistance": "educational environment",
+        "raceDistance": "cultural diversity",
+        "incomeDistance": "economic character",
+        "employmentDistance": "job market and infrastructure",
+        "votingDistance": "local community values",
+    },
+    "area": {
+        "scenesDistance": "urban atmosphere",
+        "frequencyCosine": "venue mix and attractions",
+        "geographicDistance": "neighborhood layout",
+        "populationDistance": "population density and feel",
+        "bachelorDistance": "educational character",
+        "raceDistance": "cultural diversity",
+        "incomeDistance": "economic profile",
+        "employmentDistance": "professional opportunities",
+        "votingDistance": "community values",
+    },
+}
+
+# Compact prompts keep the most important features, rounded to a few digits,
+# and drop features until the ChatGPT link fits in COMPACT_MAX_URL_CHARS
+COMPACT_FEATURES = 4
+COMPACT_DIGITS = 3
+COMPACT_MAX_URL_CHARS = 2000
+
+# Significant digits of the values in full prompts and in the memo keys
+PROMPT_DIGITS = 6
+
+CHATGPT_URL = "https://chat.openai.com/?prompt="
+
+# Rendered (prompt, url) pairs, least recently used first
+PROMPT_CACHE_SIZE = 512
+_rendered = OrderedDict()
+_rendered_lock = threading.Lock()
+
+# Message used instead of a prompt when there is nothing to explain
+FALLBACK_PROMPTS = {
+    "city": "Based on your preferences, {recommended} seems like a great match for your next travel destination!",
+    "area": "Based on your preferences, Miami zipcode {recommended} seems like a great match for your preferences!",
+}
+
+TRAVEL_PROMPT = """
+Task: Write a 3-4 sentence travel recommendation for {recommended} based on the user’s preferences, using the provided data to justify why it’s a better fit than alternatives. Focus on relatable comparisons (e.g., "like [TOP_CITY], but with [DIFFERENCE]") and avoid jargon.
+
+Input Data:
+
+    Top Cities (Favorite): {top_list} → The user enjoys these places the most.
+
+    Bottom Cities (Ok): {bottom_list} → The user visited these places but didn't enjoy them as much.
+
+    Key LIME Explanations (Influence Scores):
+    {explanations}
+
+    Raw Distance Values:
+    {distances}
+
+Instructions:
+
+    Prioritize Top LIME Factors: Highlight the 2-3 most influential metrics (e.g., scenesDistance, frequencyCosine) and explain their impact.
+
+    Example: "If mean_top_scenesDistance is high, say: ‘Its artsy vibe feels more like [TOP_CITY] than [BOTTOM_CITY].’"
+
+    Avoid Jargon: Translate metrics into traveler benefits:
+
+        scenesDistance → "cultural vibe"
+
+        frequencyCosine → "similar types of attractions"
+
+        employmentDistance → "tourist-friendly infrastructure"
+
+    Persuasive Hook: End with a call to action (e.g., "If you love [TOP_CITY]'s [trait], you'll feel right at home here!").
+    
+    Simplify Metrics: Always translate raw data into traveler-friendly terms (e.g., "employmentDistance" → "easy-to-navigate infrastructure").
+    
+    Stronger Hook: Start with a confident, personalized opener (e.g., "[CITY] is a perfect blend of what you love about [TOP_CITY] and [TOP_CITY]!").
+    
+    Explicit Comparisons: Directly contrast top/bottom cities (e.g., "Unlike [BOTTOM_CITY], [CITY] has [TRAIT]...").
+    
+    Raw Value Comparisons: Use these only to support claims (e.g., "Its venue mix is closer to Boston’s (0.93) than Portland’s (0.96)" → rewritten as "You’ll find familiar restaurants and nightlife, like in Boston.").
+    
+    Use this feature meanings: {feature_meanings}
+
+Output Template:
+"{recommended} is the ideal next stop for you. Like {top_first}, it's [trait1] and [trait2], so you'll feel right at home. Unlike {bottom_first}, it avoids [disliked_trait]—instead offering [alternative]. If you loved {top_first_short}'s [aspect], you'll adore {recommended}'s twist on it!"
+"""
+
+AREA_PROMPT = """
+Task: Write a 3-4 sentence neighborhood recommendation for Miami zipcode {recommended} based on the user's preferences from New York and Los Angeles. Explain why this Miami area matches their preferences and what they'll love about it.
+
+Input Data:
+
+    More Of Zipcodes (Preferred): {top_list} → The user enjoys these neighborhood characteristics.
+
+    Less Of Zipcodes (Less Preferred): {bottom_list} → The user wants to avoid these neighborhood characteristics.
+
+    Explanation Scores (Higher values = better match):
+    {explanations}
+
+    Raw Distance Values (Lower = more similar):
+    {distances}
+
+Instructions:
+
+    Focus on Neighborhood Character: Highlight how this Miami area captures the essence of neighborhoods the user likes (using more_of_zipcodes) while avoiding aspects they don't (from less_of_zipcodes).
+    
+    Translate Technical Terms: Use these friendly translations for metrics:
+        scenesDistance → "urban atmosphere & street vibe"
+        frequencyCosine → "local businesses & amenities"
+        populationDistance → "neighborhood density & energy"
+        raceDistance → "cultural character"
+        incomeDistance → "local economy"
+        
+    Compare Directly: Use phrases like "Similar to New York's 10001, you'll find..." or "Unlike LA's 90210, this area offers..."
+    
+    Be Specific: Mention actual characteristics of the recommended area (local cafes, walkability, nightlife, etc.)
+    
+    End with Enthusiasm: Finish with a compelling reason why they'll love living/visiting there
+
+Output Template:
+"Miami's {recommended} neighborhood captures everything you love about {top_first} with its [specific characteristic]. You'll appreciate the [feature] that resembles [specific NY/LA area], while avoiding the [less desirable trait] found in {bottom_first}. This vibrant area offers [unique Miami benefit] that makes it perfect for [activity/lifestyle]."
+"""
+
+COMPACT_TRAVEL_PROMPT = """
+Task: Write a 3-4 sentence travel recommendation for {recommended} based on the user's preferences, explaining why it fits better than the alternatives with relatable comparisons and no jargon.
+
+Favorite cities: {top_list}
+Cities enjoyed less: {bottom_list}
+
+Most influential factors (mean_top = compared with favorites, mean_bottom = compared with the others):
+{explanations}
+
+Distances (lower = more similar):
+{distances}
+
+Feature meanings: {feature_meanings}
+
+Open with a confident hook, contrast with {bottom_first}, and end with a call to action for fans of {top_first}.
+"""
+
+COMPACT_AREA_PROMPT = """
+Task: Write a 3-4 sentence neighborhood recommendation for Miami zipcode {recommended} based on the user's preferences from New York and Los Angeles.
+
+More of: {top_list}
+Less of: {bottom_list}
+
+Most influential factors (mean_top = compared with more of, mean_bottom = compared with less of):
+{explanations}
+
+Distances (lower = more similar):
+{distances}
+
+Feature meanings: {feature_meanings}
+
+Compare directly with {top_first} and {bottom_first}, mention concrete local character, and end with enthusiasm.
+"""
+
+
+class PromptTemplate:
+    """
+    Prompt template compiled once into its literal text and {field} slots, so
+    rendering is a single join.
+    """
+
+    def __init__(self, text):
+        # re.split with a group alternates literal text and field names
+        pieces = re.split(r"\{(\w+)\}", text)
+        self.literals = pieces[0::2]
+        self.fields = pieces[1::2]
+
+    def render(self, values):
+        """
+        Fill in the template.
+
+        Args:
+            values (dict): Text of every field
+
+        Returns:
+            str: The rendered prompt
+        """
+        parts = [self.literals[0]]
+        for field, literal in zip(self.fields, self.literals[1:]):
+            parts.append(values[field])
+            parts.append(literal)
+
+        return "".join(parts)
+
+
+TEMPLATES = {
+    ("city", False): PromptTemplate(TRAVEL_PROMPT),
+    ("area", False): PromptTemplate(AREA_PROMPT),
+    ("city", True): PromptTemplate(COMPACT_TRAVEL_PROMPT),
+    ("area", True): PromptTemplate(COMPACT_AREA_PROMPT),
+}
+
+# First selection, or the wording used when there is none
+_FIRST_DEFAULTS = {
+    "city": {
+        "top_first": "your favorite destinations",
+        "bottom_first": "your less preferred cities",
+        "top_first_short": "your top city",
+    },
+    "area": {
+        "top_first": "your preferred areas",
+        "bottom_first": "areas you liked less",
+    },
+}
+
+
+def _feature_of(label):
+    # Base distance feature of an explanation label, e.g. "mean_top_scenesDistance <= 0.1"
+    match = re.search(r"mean_(?:top|bottom)_(\w+)", label)
+    return match.group(1) if match else None
+
+
+def _format_value(value, digits=PROMPT_DIGITS):
+    if isinstance(value, float):
+        return f"{value:.{digits}g}"
+    return str(value)
+
+
+def _compact_value(value):
+    return _format_value(value, COMPACT_DIGITS)
+
+
+def _fits(prompt):
+    return len(CHATGPT_URL) + len(urllib.parse.quote(prompt)) <= COMPACT_MAX_URL_CHARS
+
+
+def _compact_sections(kind, explanation, distances, n_features):
+    # Keep the n_features most important explanation entries
+    ranked = sorted(explanation.items(), key=lambda x: abs(x[1]), reverse=True)
+    kept = ranked[:n_features]
+    features = [f for f in dict.fromkeys(_feature_of(label) for label, _ in kept) if f]
+
+    explanation_lines = [f"  {label}: {_compact_value(v)}" for label, v in kept]
+    distance_lines = [
+        f"  {feat}: top {_compact_value(distances.get(f'top_{feat}'))},"
+        f" bottom {_compact_value(distances.get(f'bottom_{feat}'))}"
+        for feat in features
+    ]
+    # Entries that are not feature distances, e.g. a notice
+    distance_lines += [
+        f"  {key}: {value}"
+        for key, value in distances.items()
+        if not key.startswith(("top_", "bottom_"))
+    ]
+    translations = FEATURE_TRANSLATIONS[kind]
+    meanings = "; ".join(
+        f"{feat} = {translations.get(feat, feat)}" for feat in features
+    )
+
+    return {
+        "explanations": "\n".join(explanation_lines),
+        "distances": "\n".join(distance_lines),
+        "feature_meanings": meanings or "none",
+    }
+
+
+def _render(kind, recommended, top, bottom, explanation, distances, compact):
+    if not explanation or not distances:
+        return FALLBACK_PROMPTS[kind].format(recommended=recommended)
+
+    values = {
+        "recommended": recommended,
+        "top_list": ", ".join(top) if top else "None provided",
+        "bottom_list": ", ".join(bottom) if bottom else "None provided",
+    }
+    for field, default in _FIRST_DEFAULTS[kind].items():
+        selection = top if field.startswith("top") else bottom
+        values[field] = selection[0] if selection else default
+
+    template = TEMPLATES[(kind, compact)]
+    if not compact:
+        values["explanations"] = "\n".join(
+            [f"    {k}: {_format_value(v)}" for k, v in explanation.items()]
+        )
+        values["distances"] = "\n".join(
+            [f"    {k}: {_format_value(v)}" for k, v in distances.items()]
+        )
+        values["feature_meanings"] = str(FEATURE_TRANSLATIONS[kind])
+        return template.render(values)
+
+    # Drop the least important features until the link is short enough
+    for n_features in range(COMPACT_FEATURES, 0, -1):
+        values.update(_compact_sections(kind, explanation, distances, n_features))
+        prompt = template.render(values)
+        if _fits(prompt):
+            return prompt
+
+    # Long selection lists can outgrow the link with a single feature, the
+    # minimal prompt is cut to fit as a last resort
+    prompt = FALLBACK_PROMPTS[kind].format(recommended=recommended)
+    while not _fits(prompt):
+        prompt = prompt[:-1]
+
+    return prompt
+
+
+def render_prompt(
+    kind, recommended, top, bottom, explanation, distances, compact=False
+):
+    """
+    Render the LLM prompt of a recommendation, memoized on the recommendation,
+    the selections and the explanation rounded to PROMPT_DIGITS digits.
+
+    Args:
+        kind (str): "city" or "area"
+        recommended (str): Recommended city or zipcode
+        top (list): Selections the user wants more of
+        bottom (list): Selections the user wants less of
+        explanation (dict): Feature importance values
+        distances (dict): Raw distance values
+        compact (bool): Render the size-capped compact variant
+
+    Returns:
+        tuple: (prompt, chatgpt_url)
+    """
+    # The prompts show values at this precision, so the key rounds them the
+    # same way. Formatted values also keep NaN distances comparable
+    key = (
+        kind,
+        compact,
+        recommended,
+        tuple(top or ()),
+        tuple(bottom or ()),
+        tuple((k, _format_value(v)) for k, v in (explanation or {}).items()),
+        tuple((k, _format_value(v)) for k, v in (distances or {}).items()),
+    )
+    with _rendered_lock:
+        if key in _rendered:
+            _rendered.move_to_end(key)
+            return _rendered[key]
+
+    prompt = _render(kind, recommended, top, bottom, explanation, distances, compact)
+    rendered = (prompt, CHATGPT_URL + urllib.parse.quote(prompt))
+    with _rendered_lock:
+        _rendered[key] = rendered
+        if len(_rendered) > PROMPT_CACHE_SIZE:
+            _rendered.popitem(last=False)
+
+    return rendered
@@ -0,0 +1,365 @@
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from metrics import counter
+from recommendation_result import Explanation, FeatureValues, RecommendationResult
+
+# SQLite file of the persistent L2 cache, an empty path disables it
+L2_CACHE_PATH = os.environ.get(
+    "CTS_RECOMMENDATION_CACHE", "data/cache/recommendations.sqlite"
+)
+L2_CACHE_BYTES = int(os.environ.get("CTS_RECOMMENDATION_CACHE_BYTES", 256 * 1024**2))
+
+# Results kept in memory, and how many of the most used L2 keys warm it at startup
+L1_CACHE_ENTRIES = int(os.environ.get("CTS_RECOMMENDATION_L1_ENTRIES", 1024))
+L1_WARM_KEYS = int(os.environ.get("CTS_RECOMMENDATION_WARM_KEYS", 256))
+
+# Bump when a cached result changes meaning without its classes changing shape
+RESULT_FORMAT = 1
+
+# Version of the pickled result classes, part of every key so a deploy that
+# changes them never unpickles rows written by the old code
+RESULT_SCHEMA = hashlib.sha1(
+    repr(
+        (
+            RESULT_FORMAT,
+            RecommendationResult.__slots__,
+            Explanation.__slots__,
+            FeatureValues.__slots__,
+        )
+    ).encode("utf-8")
+).hexdigest()[:12]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS recommendations (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    last_used REAL NOT NULL
+)
+"""
+
+CACHE_LOOKUPS = counter(
+    "cts_recommendation_cache_lookups_total",
+    "Recommendation cache lookups, by the tier that answered or miss",
+    ["tier"],
+)
+
+_recommendation_cache = None
+_recommendation_cache_lock = threading.Lock()
+
+
+def recommendation_key(
+    kind, model_version, data_version, top, bottom, candidates=None, **options
+):
+    """
+    Cache key of a recommendation: the canonical selection plus the model, data
+    and result schema versions, so a new model, pairs table or result class
+    never serves stale results.
+
+    Args:
+        kind (str): "cbsa" or "zipcode"
+        model_version (str): Version of the model that scores the selection, as loaded
+        data_version (str): Version of the pairs table it is scored on, as loaded
+        top (list): Keys of the entities the user wants more of
+        bottom (list): Keys of the entities the user wants less of
+        candidates (list, optional): Keys that may be recommended, when the caller picks them
+        **options: Other arguments that change the result
+
+    Returns:
+        str: Hex digest of the key
+    """
+    payload = {
+        "kind": kind,
+        "schema": RESULT_SCHEMA,
+        "model": model_version,
+        "data": data_version,
+        # Selections are sets, the click order does not matter
+        "top": sorted(str(key) for key in top),
+        "bottom": sorted(str(key) for key in bottom),
+        "candidates": (
+            None
+            if candidates is None
+            else hashlib.sha1(
+                "\n".join(sorted(str(key) for key in candidates)).encode("utf-8")
+            ).hexdigest()
+        ),
+        "options": options,
+    }
+
+    return hashlib.sha1(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class RecommendationCache:
+    """
+    Two-tier cache of recommendation results: an in-memory LRU in front of a
+    size-bounded SQLite file that survives restarts and deploys.
+
+    Values are pickled and zlib-compressed in L2. SQLite errors are reported
+    and treated as misses, so the cache never fails a recommendation. Rows that
+    no longer load are deleted.
+    """
+
+    def __init__(
+        self, path=L2_CACHE_PATH, max_bytes=L2_CACHE_BYTES, l1_entries=L1_CACHE_ENTRIES
+    ):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.l1_entries = l1_entries
+        self.l1 = OrderedDict()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.counts = {"l1_hits": 0, "l2_hits": 0, "misses": 0, "evictions": 0}
+
+    def _connection(self):
+        # SQLite connections cannot be shared between threads
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=5)
+            # Several app processes may share the file
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(_SCHEMA)
+            self.local.connection = connection
+
+        return connection
+
+    def _remember_l1(self, key, result):
+        with self.lock:
+            self.l1[key] = result
+            self.l1.move_to_end(key)
+            while len(self.l1) > self.l1_entries:
+                self.l1.popitem(last=False)
+
+    def get(self, key):
+        """
+        Look up a result in memory, then on disk.
+
+        Args:
+            key (str): Key from recommendation_key
+
+        Returns:
+            RecommendationResult: The result, with the tier that answered in its
+            stages, or None on a miss
+        """
+        with self.lock:
+            result = self.l1.get(key)
+            if result is not None:
+                self.l1.move_to_end(key)
+                self.counts["l1_hits"] += 1
+                CACHE_LOOKUPS.inc(tier="l1")
+                return _from_cache(result, "l1")
+
+        if self.path:
+            try:
+                connection = self._connection()
+                row = connection.execute(
+                    "SELECT value FROM recommendations WHERE key = ?", (key,)
+                ).fetchone()
+                result = None if row is None else self._load(connection, key, row[0])
+                if result is not None:
+                    with connection:
+                        connection.execute(
+                            "UPDATE recommendations SET hits = hits + 1, last_used = ? "
+                            "WHERE key = ?",
+                            (time.time(), key),
+                        )
+                    self._remember_l1(key, result)
+                    with self.lock:
+                        self.counts["l2_hits"] += 1
+                    CACHE_LOOKUPS.inc(tier="l2")
+                    return _from_cache(result, "l2")
+            except sqlite3.Error as e:
+                print(f"Recommendation cache read failed: {e}")
+
+        with self.lock:
+            self.counts["misses"] += 1
+        CACHE_LOOKUPS.inc(tier="miss")
+
+        return None
+
+    def _load(self, connection, key, value):
+        # Any failure, e.g. a row pickled by an older RecommendationResult, is a miss
+        try:
+            return pickle.loads(zlib.decompress(value))
+        except Exception as e:
+            print(f"Dropping unreadable recommendation cache entry {key}: {e!r}")
+            with connection:
+                connection.execute("DELETE FROM recommendations WHERE key = ?", (key,))
+            return None
+
+    def put(self, key, result):
+        """
+        Store a result in memory and on disk, evicting the least recently used
+        disk entries once the file is over its byte budget.
+
+        Args:
+            key (str): Key from recommendation_key
+            result (RecommendationResult): Result to store
+        """
+        self._remember_l1(key, result)
+        if not self.path:
+            return
+
+        value = zlib.compress(pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL))
+        try:
+            connection = self._connection()
+            with connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO recommendations "
+                    "(key, value, size, hits, last_used) VALUES (?, ?, ?, 0, ?)",
+                    (key, value, len(value), time.time()),
+                )
+                self._evict(connection)
+        except sqlite3.Error as e:
+            print(f"Recommendation cache write failed: {e}")
+
+    def _evict(self, connection):
+        (total,) = connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM recommendations"
+        ).fetchone()
+        while total > self.max_bytes:
+            row = connection.execute(
+                "SELECT key, size FROM recommendations ORDER BY last_used LIMIT 1"
+            ).fetchone()
+            if row is None:
+                break
+            connection.execute("DELETE FROM recommendations WHERE key = ?", (row[0],))
+            total -= row[1]
+            with self.lock:
+                self.counts["evictions"] += 1
+
+    def warm(self, n_keys=L1_WARM_KEYS):
+        """
+        Preload the most used disk entries into memory.
+
+        Args:
+            n_keys (int): Entries to preload
+
+        Returns:
+            int: Entries loaded
+        """
+        if not self.path or not os.path.exists(self.path):
+            return 0
+
+        loaded = 0
+        try:
+            connection = self._connection()
+            rows = connection.execute(
+                "SELECT key, value FROM recommendations "
+                "ORDER BY hits DESC, last_used DESC LIMIT ?",
+                (min(n_keys, self.l1_entries),),
+            ).fetchall()
+
+            # Least used first, so the hottest keys end up most recently used
+            for key, value in reversed(rows):
+                result = self._load(connection, key, value)
+                if result is not None:
+                    self._remember_l1(key, result)
+                    loaded += 1
+        except sqlite3.Error as e:
+            print(f"Recommendation cache warmup failed: {e}")
+
+        return loaded
+
+    def stats(self):
+        """
+        Summarize both tiers.
+
+        Returns:
+            dict: L1 entries, L2 entries and bytes, hits per tier, misses and evictions
+        """
+        l2_entries, l2_bytes = 0, 0
+        if self.path and os.path.exists(self.path):
+            try:
+                l2_entries, l2_bytes = (
+                    self._connection()
+                    .execute(
+                        "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM recommendations"
+                    )
+                    .fetchone()
+                )
+            except sqlite3.Error as e:
+                print(f"Recommendation cache stats failed: {e}")
+
+        with self.lock:
+            return {
+                "l1_entries": len(self.l1),
+                "l2_entries": l2_entries,
+                "l2_bytes": l2_bytes,
+                "l2_max_bytes": self.max_bytes,
+                **self.counts,
+            }
+
+
+def _from_cache(result, tier):
+    # A copy reporting the cache tier, the cached result is shared between sessions
+    return RecommendationResult(
+        result.recommended,
+        result.confidence,
+        result.explanation,
+        result.distances,
+        degraded=result.degraded,
+        stages=dict(result.stages or {}, cache=tier),
+    )
+
+
+def get_recommendation_cache():
+    """
+    Get the recommendation cache shared by every session of this process.
+
+    Returns:
+        RecommendationCache: The process-wide cache
+    """
+    global _recommendation_cache
+    with _recommendation_cache_lock:
+        if _recommendation_cache is None:
+            _recommendation_cache = RecommendationCache()
+
+    return _recommendation_cache
+
+
+def set_recommendation_cache(cache):
+    """
+    Replace the process-wide recommendation cache, e.g. with a disabled one to
+    measure the recommenders themselves.
+
+    Args:
+        cache (RecommendationCache): Cache every session uses from now on
+    """
+    global _recommendation_cache
+    with _recommendation_cache_lock:
+        _recommendation_cache = cache
+
+
+def remember_recommendation(key, result):
+    """
+    Cache a complete result and hand it back.
+
+    Only results of the full pipeline are cached: not degraded ones, not those
+    with a stage skipped over budget, and not the random fallbacks (which have
+    no stage report), so a later request can still get the full answer.
+
+    Args:
+        key (str): Key from recommendation_key
+        result (RecommendationResult): Result of a recommender
+
+    Returns:
+        RecommendationResult: The same result
+    """
+    if (
+        result.stages is not None
+        and not result.degraded
+        and all(stage["ran"] for stage in result.stages["stages"].values())
+    ):
+        get_recommendation_cache().put(key, result)
+
+    return result
@@ -0,0 +1,196 @@
+import numpy as np
+
+# Distance features shared by the city and zipcode models, in model order
+FEATURES = [
+    "scenesDistance",
+    "frequencyCosine",
+    "geographicDistance",
+    "populationDistance",
+    "bachelorDistance",
+    "raceDistance",
+    "incomeDistance",
+    "employmentDistance",
+    "votingDistance",
+]
+
+# Model input columns: mean distance to the top selections, then to the bottom ones
+MODEL_FEATURES = [f"mean_top_{feat}" for feat in FEATURES] + [
+    f"mean_bottom_{feat}" for feat in FEATURES
+]
+
+_MODEL_FEATURE_INDEX = {name: i for i, name in enumerate(MODEL_FEATURES)}
+
+# Raw distance keys in display order, with the position of each in MODEL_FEATURES
+_DISTANCE_KEYS = [
+    (f"{side}_{feat}", _MODEL_FEATURE_INDEX[f"mean_{side}_{feat}"])
+    for feat in FEATURES
+    for side in ["top", "bottom"]
+]
+
+# Explanations of the random fallback recommendations, shared by every result
+RANDOM_EXPLANATION = {"random_recommendation": 1.0}
+INSUFFICIENT_DATA_EXPLANATION = {"random_recommendation": 1.0, "insufficient_data": 0.8}
+
+
+class FeatureValues:
+    """
+    Raw distance values of a recommendation, as one float array in
+    MODEL_FEATURES order.
+    """
+
+    __slots__ = ("values",)
+
+    def __init__(self, values):
+        self.values = np.asarray(values, dtype=np.float64)
+
+    @classmethod
+    def from_frame(cls, X):
+        """
+        Build the values from a one-row feature DataFrame.
+
+        Args:
+            X (pd.DataFrame): One-row DataFrame with the model features
+
+        Returns:
+            FeatureValues: The distance values
+        """
+        return cls(X[MODEL_FEATURES].to_numpy()[0])
+
+    def as_dict(self):
+        """
+        Dict view for the prompt builders and the debug panels.
+
+        Returns:
+            dict: top_* and bottom_* distance per feature
+        """
+        return {key: float(self.values[i]) for key, i in _DISTANCE_KEYS}
+
+
+class Explanation:
+    """
+    Feature importance of a recommendation, as one float array in
+    MODEL_FEATURES order plus the order the features were ranked in.
+
+    LIME labels its features with the condition the value falls in, e.g.
+    "mean_top_scenesDistance <= 0.05". Those labels are kept in ranking order;
+    plain feature names are not stored.
+    """
+
+    __slots__ = ("weights", "order", "conditions")
+
+    def __init__(self, weights, order, conditions=None):
+        self.weights = weights
+        self.order = order
+        self.conditions = conditions
+
+    @classmethod
+    def from_dict(cls, feature_importance):
+        """
+        Encode a feature importance dictionary.
+
+        Args:
+            feature_importance (dict): Importance per feature or LIME condition
+
+        Returns:
+            Explanation: The encoded explanation, or the dictionary itself when
+            one of its keys is not a model feature
+        """
+        weights = np.full(len(MODEL_FEATURES), np.nan)
+        order = []
+        conditions = []
+        for label, value in feature_importance.items():
+            index = _MODEL_FEATURE_INDEX.get(label)
+            if index is None:
+                # LIME conditions contain the feature name as one token
+                tokens = [t for t in label.split() if t in _MODEL_FEATURE_INDEX]
+                if len(tokens) != 1:
+                    return feature_importance
+                index = _MODEL_FEATURE_INDEX[tokens[0]]
+            weights[index] = value
+            order.append(index)
+            conditions.append(None if label == MODEL_FEATURES[index] else label)
+
+        conditions = tuple(conditions) if any(conditions) else None
+
+        return cls(weights, np.asarray(order, dtype=np.int8), conditions)
+
+    def as_dict(self):
+        """
+        Dict view for the prompt builders and the charts.
+
+        Returns:
+            dict: Importance per feature label, in ranking order
+        """
+        return {
+            (
+                self.conditions[rank]
+                if self.conditions and self.conditions[rank]
+                else MODEL_FEATURES[index]
+            ): float(self.weights[index])
+            for rank, index in enumerate(self.order)
+        }
+
+
+class RecommendationResult:
+    """
+    Result of a recommender, kept whole in the session state.
+
+    Unpacks like the (recommended, confidence, explanation, distances) tuple the
+    recommenders used to return, with dict views of the explanation and distances.
+    Degraded results were answered without the full pipeline, e.g. under load,
+    and stages reports what each stage of the pipeline did.
+    """
+
+    __slots__ = (
+        "recommended",
+        "confidence",
+        "explanation",
+        "distances",
+        "degraded",
+        "stages",
+    )
+
+    def __init__(
+        self,
+        recommended,
+        confidence,
+        explanation,
+        distances,
+        degraded=False,
+        stages=None,
+    ):
+        self.recommended = recommended
+        self.confidence = confidence
+        # Explanation or FeatureValues, or a plain dict for the fallback results
+        self.explanation = explanation
+        self.distances = distances
+        self.degraded = degraded
+        self.stages = stages
+
+    @property
+    def explanation_dict(self):
+        if self.explanation is None or isinstance(self.explanation, dict):
+            return self.explanation
+        return self.explanation.as_dict()
+
+    @property
+    def distances_dict(self):
+        if self.distances is None or isinstance(self.distances, dict):
+            return self.distances
+        return self.distances.as_dict()
+
+    def __iter__(self):
+        return iter(
+            (
+                self.recommended,
+                self.confidence,
+                self.explanation_dict,
+                self.distances_dict,
+            )
+        )
+
+    def __getitem__(self, index):
+        return tuple(self)[index]
+
+    def __repr__(self):
+        return f"RecommendationResult({self.recommended!r}, {self.confidence!r})"
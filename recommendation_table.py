@@ -0,0 +1,321 @@
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import shutil
+
+import numpy as np
+
+DEFAULT_TABLE_DIR = os.environ.get(
+    "CTS_RECOMMENDATION_TABLE_DIR", "data/recommendation_table"
+)
+
+# Fibonacci hashing multiplier for the open-addressing slot table
+_HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+# Tables loaded by this process, keyed by directory
+_tables = {}
+
+# File hashes, keyed by (path, mtime)
+_file_versions = {}
+
+
+def file_version(path):
+    """
+    Short content hash of a model or data file, used to tell versions apart.
+
+    Args:
+        path (str): Path of the file
+
+    Returns:
+        str: First 12 hex digits of the file's SHA-1
+    """
+    key = (path, os.path.getmtime(path))
+    if key not in _file_versions:
+        with open(path, "rb") as f:
+            _file_versions[key] = hashlib.sha1(f.read()).hexdigest()[:12]
+
+    return _file_versions[key]
+
+
+def selection_key(more_bits, less_bits):
+    """
+    Encode a selection as one integer: the more-of bitmask in the low 32 bits
+    and the less-of bitmask in the high 32 bits.
+
+    Args:
+        more_bits (iterable): Bit positions of the more-of entities
+        less_bits (iterable): Bit positions of the less-of entities
+
+    Returns:
+        int: The selection bitmask
+    """
+    key = 0
+    for bit in more_bits:
+        key |= 1 << bit
+    for bit in less_bits:
+        key |= 1 << (bit + 32)
+
+    return key
+
+
+def _slots_for(keys, n_slots):
+    # Top bits of key * multiplier pick the home slot
+    shift = np.uint64(64 - int(n_slots).bit_length() + 1)
+    return ((np.asarray(keys, dtype=np.uint64) * _HASH_MULTIPLIER) >> shift).astype(
+        np.int64
+    )
+
+
+def enumerate_selections(n_selectable, max_more, max_less):
+    """
+    Enumerate every non-empty selection up to the given sizes.
+
+    Args:
+        n_selectable (int): Number of entities the user can select
+        max_more (int): Largest more-of selection
+        max_less (int): Largest less-of selection
+
+    Yields:
+        tuple: (more, less) tuples of disjoint bit positions
+    """
+    for n_more in range(max_more + 1):
+        for more in itertools.combinations(range(n_selectable), n_more):
+            remaining = [i for i in range(n_selectable) if i not in more]
+            for n_less in range(max_less + 1):
+                if n_more == 0 and n_less == 0:
+                    continue
+                for less in itertools.combinations(remaining, n_less):
+                    yield more, less
+
+
+def materialize(
+    model,
+    pair_index,
+    selectable,
+    candidates,
+    out_dir,
+    model_version,
+    data_version,
+    max_more=2,
+    max_less=1,
+    top_k=5,
+    batch_size=512,
+):
+    """
+    Score every small selection and write a lookup table of the top-K candidates.
+
+    Args:
+        model: Trained LightGBM booster
+        pair_index (PairIndex): Pair index of the table being materialized
+        selectable (list): Entity keys the user can select, at most 32
+        candidates (list): Entity keys that can be recommended
+        out_dir (str): Directory the table is written to
+        model_version (str): Version of the model, stored to detect stale tables
+        data_version (str): Version of the pairs table behind pair_index, stored
+            to detect stale tables too
+        max_more (int): Largest more-of selection
+        max_less (int): Largest less-of selection
+        top_k (int): Candidates kept per selection
+        batch_size (int): Selections scored per predict call
+
+    Returns:
+        int: Number of selections in the table
+    """
+    if len(selectable) > 32:
+        raise ValueError("Selection bitmasks support at most 32 selectable entities")
+
+    # Imported here, packed_model imports file_version from this module
+    from packed_model import top_k_rows
+
+    selectable_ids = pair_index.to_ids(selectable)
+    candidate_ids = pair_index.to_ids(candidates)
+    candidate_keys = [pair_index.keys[i] for i in candidate_ids]
+    candidate_rows = {entity_id: i for i, entity_id in enumerate(candidate_ids)}
+
+    keys = []
+    topk_ids = []
+    topk_scores = []
+
+    selections = enumerate_selections(len(selectable_ids), max_more, max_less)
+    while True:
+        batch = list(itertools.islice(selections, batch_size))
+        if not batch:
+            break
+
+        # Stack the candidate rows of every selection into one predict call
+        rows = []
+        owners = []
+        for b, (more, less) in enumerate(batch):
+            more_mask = pair_index.mask(selectable_ids[list(more)])
+            less_mask = pair_index.mask(selectable_ids[list(less)])
+            ids = candidate_ids[~(more_mask | less_mask)[candidate_ids]]
+            X, scored = pair_index.features_matrix(ids, more_mask, less_mask)
+            rows.append(X[scored])
+            owners.append(np.column_stack([np.full(scored.sum(), b), ids[scored]]))
+
+        rows = np.vstack(rows)
+        owners = np.vstack(owners)
+        # Only the top-K of each selection are needed, so most rows stop being
+        # scored once they provably cannot reach it
+        best_rows, best_scores = top_k_rows(model, rows, top_k, owners[:, 0])
+        best_owners = owners[best_rows]
+
+        for b, (more, less) in enumerate(batch):
+            mine = best_owners[:, 0] == b
+            n_best = int(mine.sum())
+            ids = np.full(top_k, -1, dtype=np.int16)
+            best = np.full(top_k, np.nan, dtype=np.float32)
+            ids[:n_best] = [candidate_rows[c] for c in best_owners[mine, 1]]
+            best[:n_best] = best_scores[mine]
+
+            keys.append(selection_key(more, less))
+            topk_ids.append(ids)
+            topk_scores.append(best)
+
+    # Open-addressing hash table from selection key to row, with linear probing
+    n_slots = 1 << max(1, (2 * len(keys) - 1).bit_length())
+    slot_keys = np.zeros(n_slots, dtype=np.uint64)
+    slot_rows = np.full(n_slots, -1, dtype=np.int32)
+    for row, (key, slot) in enumerate(zip(keys, _slots_for(keys, n_slots))):
+        while slot_rows[slot] != -1:
+            slot = (slot + 1) % n_slots
+        slot_keys[slot] = key
+        slot_rows[slot] = row
+
+    tmp_dir = f"{out_dir}.tmp-{os.getpid()}"
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+
+    np.save(os.path.join(tmp_dir, "slot_keys.npy"), slot_keys)
+    np.save(os.path.join(tmp_dir, "slot_rows.npy"), slot_rows)
+    np.save(os.path.join(tmp_dir, "topk_ids.npy"), np.vstack(topk_ids))
+    np.save(os.path.join(tmp_dir, "topk_scores.npy"), np.vstack(topk_scores))
+    with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+        json.dump(
+            {
+                "model_version": model_version,
+                "data_version": data_version,
+                "selectable": [pair_index.keys[i] for i in selectable_ids],
+                "candidates": candidate_keys,
+                "max_more": max_more,
+                "max_less": max_less,
+                "top_k": top_k,
+            },
+            f,
+        )
+
+    if os.path.exists(out_dir):
+        shutil.rmtree(out_dir)
+    os.rename(tmp_dir, out_dir)
+
+    return len(keys)
+
+
+class RecommendationTable:
+    """
+    Memory-mapped lookup table from selection bitmask to top-K candidates.
+    """
+
+    def __init__(self, table_dir):
+        with open(os.path.join(table_dir, "meta.json"), "r") as f:
+            self.meta = json.load(f)
+        self.bits = {key: i for i, key in enumerate(self.meta["selectable"])}
+        self.candidates = self.meta["candidates"]
+
+        self.slot_keys = np.load(
+            os.path.join(table_dir, "slot_keys.npy"), mmap_mode="r"
+        )
+        self.slot_rows = np.load(
+            os.path.join(table_dir, "slot_rows.npy"), mmap_mode="r"
+        )
+        self.topk_ids = np.load(os.path.join(table_dir, "topk_ids.npy"), mmap_mode="r")
+        self.topk_scores = np.load(
+            os.path.join(table_dir, "topk_scores.npy"), mmap_mode="r"
+        )
+
+    def lookup(self, more, less):
+        """
+        Look up the best candidates for a selection.
+
+        Args:
+            more (list): Entity keys the user wants more of
+            less (list): Entity keys the user wants less of
+
+        Returns:
+            list: (candidate_key, score) pairs, best first, or None when the
+            selection is not in the table
+        """
+        if len(more) > self.meta["max_more"] or len(less) > self.meta["max_less"]:
+            return None
+        if any(key not in self.bits for key in list(more) + list(less)):
+            return None
+
+        key = selection_key([self.bits[k] for k in more], [self.bits[k] for k in less])
+        n_slots = len(self.slot_keys)
+        slot = _slots_for([key], n_slots)[0]
+        while self.slot_rows[slot] != -1:
+            if self.slot_keys[slot] == key:
+                row = self.slot_rows[slot]
+                return [
+                    (self.candidates[i], float(score))
+                    for i, score in zip(self.topk_ids[row], self.topk_scores[row])
+                    if i >= 0
+                ]
+            slot = (slot + 1) % n_slots
+
+        return None
+
+
+def load_recommendation_table(
+    kind, model_version, data_version, table_dir=DEFAULT_TABLE_DIR
+):
+    """
+    Load a materialized table once per process.
+
+    Args:
+        kind (str): "cbsa" or "zipcode"
+        model_version (str): Version of the model currently serving
+        data_version (str): Version of the pairs table currently serving
+        table_dir (str): Directory holding one table per kind
+
+    Returns:
+        RecommendationTable: The table, or None when it is missing or was
+        built with another model or pairs table
+    """
+    path = os.path.join(table_dir, kind)
+    if path not in _tables:
+        if not os.path.exists(os.path.join(path, "meta.json")):
+            return None
+        _tables[path] = RecommendationTable(path)
+
+    table = _tables[path]
+    # Tables written before they recorded a data version are stale as well
+    if (
+        table.meta["model_version"] != model_version
+        or table.meta.get("data_version") != data_version
+    ):
+        return None
+
+    return table
+
+
+if __name__ == "__main__":
+    import helper
+
+    parser = argparse.ArgumentParser(
+        description="Precompute recommendations for every small selection"
+    )
+    parser.add_argument("--kind", choices=["cbsa", "zipcode"], default="cbsa")
+    parser.add_argument("--max-more", type=int, default=2)
+    parser.add_argument("--max-less", type=int, default=1)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--out", default=DEFAULT_TABLE_DIR, help="Table directory")
+    args = parser.parse_args()
+
+    n_selections = helper.materialize_recommendation_table(
+        args.kind, args.out, args.max_more, args.max_less, args.top_k
+    )
+    print(f"Wrote {n_selections} selections to {os.path.join(args.out, args.kind)}")
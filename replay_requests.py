@@ -0,0 +1,230 @@
+import argparse
+import contextlib
+import io
+import json
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from request_log import read_requests, result_id
+
+# Upper bounds of the latency histogram buckets, in seconds
+HISTOGRAM_BUCKETS = [0.001 * 2**i for i in range(17)]
+
+# Names of every city, the city page recommends among those not selected
+_city_names = []
+
+
+def _recommend(record, target):
+    # Rebuild the call the page made for the captured selection
+    from admission_control import admit_request
+    from helper import (
+        generate_recommendation,
+        get_city_coordinates_data,
+        process_area_selections,
+    )
+    from latency_budget import LATENCY_BUDGET, LatencyBudget
+
+    top, bottom = record["top"], record["bottom"]
+    if record["page"] == "city":
+        if not _city_names:
+            _city_names.extend(get_city_coordinates_data())
+        selected = set(top) | set(bottom)
+        non_selected = [city for city in _city_names if city not in selected]
+        fn, args = generate_recommendation, (non_selected, top, bottom)
+    else:
+        fn, args = process_area_selections, (top, bottom)
+
+    # The service path is the one the pages take outside debug mode
+    if target == "service":
+        return admit_request(fn, *args, budget=LatencyBudget(LATENCY_BUDGET))
+    return fn(*args)
+
+
+def replay(records, target="helper", concurrency=1, rate=None, speedup=None):
+    """
+    Replay captured requests and time every one of them.
+
+    Requests are sent at a fixed rate, at their captured arrival times divided
+    by speedup, or back to back when neither is set, with at most concurrency
+    in flight. Latency runs from when a request was due, so the time it waited
+    for a free slot counts as it would for a user.
+
+    Args:
+        records (iterable): Captured requests, e.g. from read_requests
+        target (str): "helper" calls the recommenders directly, "service" goes
+            through admission control and the latency budget like the pages
+        concurrency (int): Requests in flight at once
+        rate (float, optional): Requests sent per second
+        speedup (float, optional): Factor the captured arrival times are compressed by
+
+    Returns:
+        dict: Latencies in seconds per page, errors, and how many results
+        differ from the captured ones
+    """
+    slots = threading.BoundedSemaphore(concurrency)
+    lock = threading.Lock()
+    outcome = {"latencies": {"city": [], "area": []}, "errors": 0, "mismatches": 0}
+
+    def run(record, due):
+        try:
+            result = _recommend(record, target)
+            latency = time.perf_counter() - due
+            with lock:
+                outcome["latencies"][record["page"]].append(latency)
+                captured = record.get("result_id")
+                if captured and result_id(result) != captured:
+                    outcome["mismatches"] += 1
+        except Exception as e:
+            print(f"Replaying {record['page']} request failed: {e}")
+            with lock:
+                outcome["errors"] += 1
+        finally:
+            slots.release()
+
+    start = time.perf_counter()
+    first_time = None
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for i, record in enumerate(records):
+            if rate:
+                due = start + i / rate
+            elif speedup:
+                first_time = record["time"] if first_time is None else first_time
+                due = start + (record["time"] - first_time) / speedup
+            else:
+                due = time.perf_counter()
+            time.sleep(max(0.0, due - time.perf_counter()))
+            slots.acquire()
+            executor.submit(run, record, due)
+
+    outcome["seconds"] = time.perf_counter() - start
+
+    return outcome
+
+
+def latency_summary(latencies):
+    """
+    Summarize latencies with percentiles and a histogram.
+
+    Args:
+        latencies (list): Latencies in seconds
+
+    Returns:
+        dict: Count, mean, p50, p90, p99 and max in seconds, and the request
+        count of every histogram bucket
+    """
+    if not latencies:
+        return {"count": 0}
+
+    latencies = np.asarray(latencies)
+    p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+    bounds = HISTOGRAM_BUCKETS + [math.inf]
+    counts = np.histogram(latencies, bins=[0.0] + bounds)[0]
+
+    return {
+        "count": len(latencies),
+        "mean": float(latencies.mean()),
+        "p50": float(p50),
+        "p90": float(p90),
+        "p99": float(p99),
+        "max": float(latencies.max()),
+        "histogram": [
+            [bound, int(count)] for bound, count in zip(bounds, counts) if count
+        ],
+    }
+
+
+def replay_report(outcome):
+    """
+    Build a report of a replay.
+
+    Args:
+        outcome (dict): Result of replay
+
+    Returns:
+        str: Throughput, errors, mismatches, and the latency percentiles and
+        histogram of every page
+    """
+    total = sum(len(latencies) for latencies in outcome["latencies"].values())
+    lines = [
+        f"{total} requests in {outcome['seconds']:.2f}s "
+        f"({total / max(outcome['seconds'], 1e-9):.2f}/s), "
+        f"{outcome['errors']} errors, "
+        f"{outcome['mismatches']} results differ from capture"
+    ]
+    for page, latencies in outcome["latencies"].items():
+        summary = latency_summary(latencies)
+        if not summary["count"]:
+            continue
+        lines.append(
+            f"{page}: p50 {summary['p50']:.3f}s  p90 {summary['p90']:.3f}s  "
+            f"p99 {summary['p99']:.3f}s  max {summary['max']:.3f}s"
+        )
+        largest = max(count for _, count in summary["histogram"])
+        for bound, count in summary["histogram"]:
+            label = "inf" if bound == math.inf else f"{bound:.3f}s"
+            bar = "#" * max(1, round(40 * count / largest))
+            lines.append(f"    <= {label:>8}  {count:6d}  {bar}")
+
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Replay captured recommendation requests and report latencies"
+    )
+    parser.add_argument("log", help="Request log written with CTS_REQUEST_LOG")
+    parser.add_argument("--target", choices=["helper", "service"], default="helper")
+    parser.add_argument("--concurrency", type=int, default=1)
+    pacing = parser.add_mutually_exclusive_group()
+    pacing.add_argument("--rate", type=float, help="Requests per second")
+    pacing.add_argument(
+        "--speedup",
+        type=float,
+        help="Replay the captured arrival times this much faster",
+    )
+    parser.add_argument("--limit", type=int, help="Replay only the first requests")
+    parser.add_argument(
+        "--no-cache", action="store_true", help="Bypass the recommendation cache"
+    )
+    parser.add_argument("--json", action="store_true", help="Print the summary as JSON")
+    parser.add_argument(
+        "--verbose", action="store_true", help="Keep the recommenders' output"
+    )
+    args = parser.parse_args()
+
+    if args.no_cache:
+        from recommendation_cache import RecommendationCache, set_recommendation_cache
+
+        set_recommendation_cache(RecommendationCache(path="", l1_entries=0))
+
+    records = read_requests(args.log)
+    if args.limit:
+        records = (record for _, record in zip(range(args.limit), records))
+
+    quiet = (
+        contextlib.nullcontext()
+        if args.verbose
+        else contextlib.redirect_stdout(io.StringIO())
+    )
+    with quiet:
+        outcome = replay(
+            records, args.target, args.concurrency, args.rate, args.speedup
+        )
+
+    if args.json:
+        summary = {
+            page: latency_summary(latencies)
+            for page, latencies in outcome["latencies"].items()
+        }
+        summary.update(
+            seconds=outcome["seconds"],
+            errors=outcome["errors"],
+            mismatches=outcome["mismatches"],
+        )
+        print(json.dumps(summary, indent=2))
+    else:
+        print(replay_report(outcome))
@@ -0,0 +1,131 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import deque
+
+from metrics import counter, histogram
+
+# JSON lines file the pages append every recommendation request to, capture is
+# off unless it is set
+REQUEST_LOG_FILE = os.environ.get("CTS_REQUEST_LOG", "")
+
+REQUEST_SECONDS = histogram(
+    "cts_request_seconds", "Seconds a page waited for a recommendation", ["page"]
+)
+DEGRADED_REQUESTS = counter(
+    "cts_degraded_requests_total",
+    "Recommendations answered without the full pipeline",
+    ["page"],
+)
+
+# Requests kept in memory for the Operations page
+RECENT_REQUESTS = 500
+
+_recent_requests = deque(maxlen=RECENT_REQUESTS)
+_request_log_lock = threading.Lock()
+
+
+def result_id(result):
+    """
+    Short fingerprint of what a recommender answered, to compare a replay with
+    the captured traffic.
+
+    Args:
+        result (RecommendationResult): Result of a recommender
+
+    Returns:
+        str: Hex digest of the recommendation and its confidence, None without a result
+    """
+    if not result:
+        return None
+
+    answer = json.dumps([str(result.recommended), result.confidence, result.degraded])
+
+    return hashlib.sha1(answer.encode("utf-8")).hexdigest()[:12]
+
+
+def record_request(page, top, bottom, result, seconds, path=None):
+    """
+    Count and time a recommendation request, keep it among the recent ones, and
+    append it to the request log when capture is on.
+
+    Args:
+        page (str): "city" or "area", the page that made the request
+        top (list): Keys the user wants more of
+        bottom (list): Keys the user wants less of
+        result (RecommendationResult): What the recommender answered
+        seconds (float): Time the page waited for the answer
+        path (str, optional): Log file, REQUEST_LOG_FILE when not set
+
+    Returns:
+        bool: Whether the request was written
+    """
+    REQUEST_SECONDS.observe(seconds, page=page)
+    if result and result.degraded:
+        DEGRADED_REQUESTS.inc(page=page)
+
+    stages = (result.stages if result else None) or {}
+    record = {
+        "time": round(time.time(), 3),
+        "page": page,
+        "top": [str(key) for key in top],
+        "bottom": [str(key) for key in bottom],
+        "seconds": round(seconds, 4),
+        "result_id": result_id(result),
+        "recommended": str(result.recommended) if result else None,
+        "degraded": bool(result and result.degraded),
+        "cache": stages.get("cache"),
+    }
+    _recent_requests.append(record)
+
+    path = path or REQUEST_LOG_FILE
+    if not path:
+        return False
+
+    try:
+        with _request_log_lock:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            with open(path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+    except OSError as e:
+        print(f"Request capture failed: {e}")
+        return False
+
+    return True
+
+
+def recent_requests():
+    """
+    The last RECENT_REQUESTS requests of this process, oldest first.
+
+    Returns:
+        list: Records as written to the request log
+    """
+    return list(_recent_requests)
+
+
+def read_requests(path):
+    """
+    Stream the requests of a request log, skipping lines that are not requests.
+
+    Args:
+        path (str): JSON lines file written by record_request
+
+    Yields:
+        dict: One captured request
+    """
+    with open(path) as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                print(f"Skipping line {line_number} of {path}: not JSON")
+                continue
+            if record.get("page") not in ("city", "area"):
+                print(f"Skipping line {line_number} of {path}: not a request")
+                continue
+            yield record
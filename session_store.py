@@ -0,0 +1,301 @@
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+
+# Budget of the process-wide result cache, shared by every session
+RESULT_CACHE_BYTES = int(os.environ.get("CTS_RESULT_CACHE_BYTES", 64 * 1024 * 1024))
+RESULT_CACHE_TTL = float(os.environ.get("CTS_RESULT_CACHE_TTL", 3600))
+
+# Session state key holding the ID the cache accounts a session's results to
+SESSION_ID_KEY = "_session_store_id"
+
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+
+def estimate_size(obj, seen=None):
+    """
+    Estimate the bytes held by an object, following containers, NumPy arrays
+    and __slots__ attributes.
+
+    Args:
+        obj: Object to measure
+        seen (set, optional): IDs of the objects already counted
+
+    Returns:
+        int: Approximate size in bytes
+    """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    if isinstance(obj, np.ndarray):
+        return sys.getsizeof(obj) + (obj.nbytes if obj.base is not None else 0)
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(
+            estimate_size(key, seen) + estimate_size(value, seen)
+            for key, value in obj.items()
+        )
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(estimate_size(item, seen) for item in obj)
+    elif hasattr(obj, "__slots__"):
+        size += sum(
+            estimate_size(getattr(obj, name), seen)
+            for name in obj.__slots__
+            if hasattr(obj, name)
+        )
+    elif hasattr(obj, "__dict__"):
+        size += estimate_size(vars(obj), seen)
+
+    return size
+
+
+class ResultCache:
+    """
+    Bounded LRU cache for the heavy payloads of every session, with a TTL and
+    byte accounting per session.
+
+    Sessions only keep the handle returned by put. When the cache is over its
+    byte budget the least recently used payloads are evicted, whichever session
+    they belong to.
+    """
+
+    def __init__(self, max_bytes=RESULT_CACHE_BYTES, ttl=RESULT_CACHE_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.session_bytes = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def _drop(self, handle):
+        payload, nbytes, owner, expires_at = self.entries.pop(handle)
+        self.bytes -= nbytes
+        self.session_bytes[owner] -= nbytes
+        if self.session_bytes[owner] <= 0:
+            del self.session_bytes[owner]
+
+    def _evict(self, now):
+        # Expired entries first, then the least recently used until under budget
+        expired = [h for h, entry in self.entries.items() if entry[3] <= now]
+        for handle in expired:
+            self._drop(handle)
+            self.evictions += 1
+        while self.bytes > self.max_bytes and self.entries:
+            self._drop(next(iter(self.entries)))
+            self.evictions += 1
+
+    def put(self, payload, owner):
+        """
+        Store a payload and return its handle.
+
+        Args:
+            payload: Object to store
+            owner (str): ID of the session the payload belongs to
+
+        Returns:
+            str: Handle to keep in the session state
+        """
+        handle = uuid.uuid4().hex
+        nbytes = estimate_size(payload)
+        now = time.monotonic()
+        with self.lock:
+            self.entries[handle] = (payload, nbytes, owner, now + self.ttl)
+            self.bytes += nbytes
+            self.session_bytes[owner] = self.session_bytes.get(owner, 0) + nbytes
+            self._evict(now)
+
+        return handle
+
+    def get(self, handle):
+        """
+        Look up a payload, refreshing its LRU position and TTL.
+
+        Args:
+            handle (str): Handle returned by put
+
+        Returns:
+            The payload, or None when it expired or was evicted
+        """
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(handle)
+            if entry is None or entry[3] <= now:
+                if entry is not None:
+                    self._drop(handle)
+                    self.evictions += 1
+                self.misses += 1
+                return None
+
+            payload, nbytes, owner, _ = entry
+            self.entries[handle] = (payload, nbytes, owner, now + self.ttl)
+            self.entries.move_to_end(handle)
+            self.hits += 1
+
+            return payload
+
+    def discard(self, handle):
+        """
+        Drop a payload the session no longer needs.
+
+        Args:
+            handle (str): Handle returned by put
+        """
+        with self.lock:
+            if handle in self.entries:
+                self._drop(handle)
+
+    def stats(self):
+        """
+        Summarize the cache for the memory metrics.
+
+        Returns:
+            dict: Entries, bytes, budget, sessions, hits, misses and evictions
+        """
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "sessions": len(self.session_bytes),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+def get_result_cache():
+    """
+    Get the result cache shared by every session of this process.
+
+    Returns:
+        ResultCache: The process-wide cache
+    """
+    global _result_cache
+    with _result_cache_lock:
+        if _result_cache is None:
+            _result_cache = ResultCache()
+
+    return _result_cache
+
+
+def session_id(session_state):
+    """
+    Get the ID the cache accounts a session's results to, creating it on first use.
+
+    Args:
+        session_state: Streamlit session state
+
+    Returns:
+        str: Session ID
+    """
+    if SESSION_ID_KEY not in session_state:
+        session_state[SESSION_ID_KEY] = uuid.uuid4().hex
+
+    return session_state[SESSION_ID_KEY]
+
+
+def store_result(session_state, key, result):
+    """
+    Keep a result in the shared cache and only its handle in the session.
+
+    Args:
+        session_state: Streamlit session state
+        key (str): Session state key of the handle
+        result: Result to store, replaces the previous one under that key
+    """
+    clear_result(session_state, key)
+    session_state[key] = get_result_cache().put(result, session_id(session_state))
+
+
+def load_result(session_state, key):
+    """
+    Load the result a session holds a handle to.
+
+    Args:
+        session_state: Streamlit session state
+        key (str): Session state key of the handle
+
+    Returns:
+        The result, or None when there is none or it was evicted
+    """
+    handle = session_state.get(key)
+    if not handle:
+        return None
+
+    result = get_result_cache().get(handle)
+    if result is None:
+        # Evicted or expired, forget the stale handle
+        session_state[key] = None
+
+    return result
+
+
+def clear_result(session_state, key):
+    """
+    Drop the result a session holds a handle to.
+
+    Args:
+        session_state: Streamlit session state
+        key (str): Session state key of the handle
+    """
+    handle = session_state.get(key)
+    if handle:
+        get_result_cache().discard(handle)
+    session_state[key] = None
+
+
+def process_rss_bytes():
+    """
+    Resident memory of this process.
+
+    Returns:
+        int: Current RSS in bytes, or the peak RSS where /proc is not available
+    """
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def memory_footprint(session_state):
+    """
+    Memory metrics of one session and of the whole process.
+
+    Args:
+        session_state: Streamlit session state
+
+    Returns:
+        dict: Session state bytes, cached result bytes of the session, the
+        cache statistics and the process RSS
+    """
+    cache = get_result_cache()
+    owner = session_id(session_state)
+    with cache.lock:
+        cached_bytes = cache.session_bytes.get(owner, 0)
+
+    return {
+        "session_state_bytes": sum(
+            estimate_size(session_state[key]) for key in session_state.keys()
+        ),
+        "session_cached_bytes": cached_bytes,
+        "cache": cache.stats(),
+        "process_rss_bytes": process_rss_bytes(),
+    }
@@ -0,0 +1,555 @@
+import argparse
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+import polars as pl
+
+from recommendation_table import file_version
+
+# Directory the store is published to, shared by every worker on the host. It
+# is a symlink to the current version, kept in the sibling .versions directory
+DEFAULT_STORE_DIR = os.environ.get("CTS_SHARED_STORE_DIR", "data/shared_store")
+
+# Published versions kept on disk, the current one included. A process still
+# attached to a pruned version attaches to the current one again
+KEEP_STORE_VERSIONS = int(os.environ.get("CTS_SHARED_STORE_VERSIONS", 2))
+
+ZIPCODE_GEOMETRY_FILE = "data/zipcodes_with_geometry.geojson"
+
+# Source CSV for each pairs table. "keys" identify the two entities of a pair,
+# "labels" are the per-entity columns that travel with them
+PAIR_TABLES = {
+    "cbsa": {
+        "csv": "data/similar_cbsa_pairs.csv",
+        "keys": ("cbsa1_name", "cbsa2_name"),
+        "labels": ("cbsa1", "cbsa2"),
+    },
+    "zipcode": {
+        "csv": "data/similar_zipcode_pairs.csv",
+        "keys": ("zipcode1", "zipcode2"),
+        "labels": ("city1_name", "city2_name"),
+    },
+}
+
+# Stores attached by this process, keyed by directory
+_attached = {}
+
+
+def _publish_pairs(table, out_dir):
+    """
+    Write one pairs table as an entity index plus one .npy file per column.
+
+    Args:
+        table (dict): Entry of PAIR_TABLES describing the source CSV
+        out_dir (str): Directory the table is written to
+    """
+    os.makedirs(out_dir)
+    df = pl.read_csv(table["csv"])
+    key1, key2 = table["keys"]
+    label1, label2 = table["labels"]
+
+    # Entity index: every entity that appears on either end of a pair
+    entities = (
+        pl.concat(
+            [
+                df.select(pl.col(key1).alias("key"), pl.col(label1).alias("label")),
+                df.select(pl.col(key2).alias("key"), pl.col(label2).alias("label")),
+            ]
+        )
+        .unique(subset="key", maintain_order=True)
+        .sort("key")
+    )
+    keys = entities["key"].to_list()
+    entity_ids = {key: i for i, key in enumerate(keys)}
+
+    id1 = df[key1].replace_strict(entity_ids, return_dtype=pl.Int32).to_numpy()
+    id2 = df[key2].replace_strict(entity_ids, return_dtype=pl.Int32).to_numpy()
+    np.save(os.path.join(out_dir, "id1.npy"), id1)
+    np.save(os.path.join(out_dir, "id2.npy"), id2)
+
+    # Feature columns are stored as float64, columns with nulls also get a
+    # validity mask so they can be told apart from NaN values
+    feature_columns = [
+        c for c in df.columns if c not in table["keys"] + table["labels"]
+    ]
+    null_columns = []
+    for column in feature_columns:
+        values = df[column].cast(pl.Float64).fill_null(np.nan).to_numpy()
+        np.save(os.path.join(out_dir, f"{column}.npy"), values)
+        if df[column].null_count() > 0:
+            valid = df[column].is_not_null().to_numpy()
+            np.save(os.path.join(out_dir, f"{column}.valid.npy"), valid)
+            null_columns.append(column)
+
+    # Adjacency of the pair index: every pair is an edge in both directions,
+    # grouped by source entity, so workers map it instead of each sorting
+    # their own copy
+    source = np.concatenate([id1, id2])
+    order = np.argsort(source, kind="stable")
+    values = (
+        df.select(pl.col(feature_columns).cast(pl.Float64)).fill_null(np.nan).to_numpy()
+    )
+    np.save(
+        os.path.join(out_dir, "adjacency_neighbours.npy"),
+        np.concatenate([id2, id1])[order],
+    )
+    np.save(
+        os.path.join(out_dir, "adjacency_values.npy"),
+        np.ascontiguousarray(np.concatenate([values, values])[order]),
+    )
+    np.save(
+        os.path.join(out_dir, "adjacency_offsets.npy"),
+        np.concatenate([[0], np.cumsum(np.bincount(source, minlength=len(keys)))]),
+    )
+
+    # Written last, readers take the table as published once it exists
+    with open(os.path.join(out_dir, "entities.json"), "w") as f:
+        json.dump(
+            {
+                "columns": df.columns,
+                "feature_columns": feature_columns,
+                "null_columns": null_columns,
+                "keys": keys,
+                "labels": entities["label"].to_list(),
+                "version": file_version(table["csv"]),
+            },
+            f,
+        )
+
+
+def _publish_geometry(geojson_file, out_dir):
+    """
+    Flatten the zipcode polygons into coordinate and offset arrays.
+
+    Args:
+        geojson_file (str): Path of the zipcode GeoJSON file
+        out_dir (str): Directory the geometry is written to
+    """
+    os.makedirs(out_dir)
+    with open(geojson_file, "r") as f:
+        geojson_data = json.load(f)
+
+    coords = []
+    ring_offsets = [0]
+    polygon_offsets = [0]
+    feature_offsets = [0]
+    geometry_types = []
+    properties = []
+
+    for feature in geojson_data["features"]:
+        geometry = feature["geometry"]
+        polygons = geometry["coordinates"]
+        if geometry["type"] == "Polygon":
+            polygons = [polygons]
+
+        for polygon in polygons:
+            for ring in polygon:
+                coords.extend(ring)
+                ring_offsets.append(len(coords))
+            polygon_offsets.append(len(ring_offsets) - 1)
+        feature_offsets.append(len(polygon_offsets) - 1)
+
+        geometry_types.append(geometry["type"])
+        properties.append(feature["properties"])
+
+    np.save(os.path.join(out_dir, "coords.npy"), np.asarray(coords, dtype=np.float64))
+    np.save(os.path.join(out_dir, "ring_offsets.npy"), np.asarray(ring_offsets))
+    np.save(os.path.join(out_dir, "polygon_offsets.npy"), np.asarray(polygon_offsets))
+    np.save(os.path.join(out_dir, "feature_offsets.npy"), np.asarray(feature_offsets))
+
+    with open(os.path.join(out_dir, "features.json"), "w") as f:
+        json.dump({"types": geometry_types, "properties": properties}, f)
+
+
+def _versions_dir(store_dir):
+    return f"{store_dir}.versions"
+
+
+def _version_stamp(name):
+    # Version directories are named "<time_ns>-<pid>", in publishing order
+    return int(name.split("-")[0])
+
+
+def _new_store_dir(store_dir):
+    versions_dir = _versions_dir(store_dir)
+    os.makedirs(versions_dir, exist_ok=True)
+
+    return os.path.join(versions_dir, f"{time.time_ns()}-{os.getpid()}")
+
+
+def replace_store(tmp_dir, store_dir):
+    """
+    Publish a store version written by stage_store or publish_store.
+
+    store_dir is a symlink to the current version and is swapped with
+    os.replace, so there is always a complete store at store_dir, even if the
+    process dies halfway. Versions older than the last KEEP_STORE_VERSIONS are
+    removed.
+
+    Args:
+        tmp_dir (str): Complete store version, from _new_store_dir
+        store_dir (str): Directory the store is published to
+    """
+    link = f"{store_dir}.link-{os.getpid()}"
+    if os.path.lexists(link):
+        os.remove(link)
+    os.symlink(os.path.relpath(tmp_dir, os.path.dirname(store_dir) or "."), link)
+
+    if os.path.isdir(store_dir) and not os.path.islink(store_dir):
+        # A store published before versions existed, kept as the oldest version
+        os.rename(store_dir, os.path.join(_versions_dir(store_dir), "0-unversioned"))
+    os.replace(link, store_dir)
+
+    _prune_versions(store_dir)
+
+
+def _prune_versions(store_dir):
+    versions_dir = _versions_dir(store_dir)
+    current = _version_stamp(os.path.basename(os.path.realpath(store_dir)))
+    # Newer directories are versions another publisher is still writing
+    older = sorted(
+        (name for name in os.listdir(versions_dir) if _version_stamp(name) < current),
+        key=_version_stamp,
+    )
+    for name in older[: max(0, len(older) - (KEEP_STORE_VERSIONS - 1))]:
+        shutil.rmtree(os.path.join(versions_dir, name), ignore_errors=True)
+
+
+def stage_store(store_dir, replaced):
+    """
+    Start the next version of a store in a temporary directory, holding every
+    artifact but the one being replaced.
+
+    Artifacts of the current store are hard-linked in, published files are
+    never written again, and those it lacks are published from their sources,
+    so replacing one table never leaves the others missing.
+
+    Args:
+        store_dir (str): Directory the store is published to
+        replaced (str): Artifact the caller writes itself, a kind or "geometry"
+
+    Returns:
+        str: New version directory to write the artifact into, then pass to replace_store
+
+    Raises:
+        ValueError: If an artifact is neither in the store nor in its source files
+    """
+    current = SharedStore(store_dir)
+    tmp_dir = _new_store_dir(store_dir)
+    os.makedirs(tmp_dir)
+
+    artifacts = [
+        (kind, current.has_pairs(kind), table["csv"])
+        for kind, table in PAIR_TABLES.items()
+    ]
+    artifacts.append(("geometry", current.has_geometry(), ZIPCODE_GEOMETRY_FILE))
+    for name, published, source in artifacts:
+        if name == replaced:
+            continue
+        if published:
+            shutil.copytree(
+                os.path.join(current.version_dir, name),
+                os.path.join(tmp_dir, name),
+                copy_function=os.link,
+            )
+        elif os.path.exists(source):
+            if name == "geometry":
+                _publish_geometry(source, os.path.join(tmp_dir, name))
+            else:
+                _publish_pairs(PAIR_TABLES[name], os.path.join(tmp_dir, name))
+        else:
+            shutil.rmtree(tmp_dir)
+            raise ValueError(
+                f"{store_dir} has no {name} and {source} is missing, "
+                f"publish the {name} before replacing the {replaced}"
+            )
+
+    return tmp_dir
+
+
+def publish_store(store_dir=DEFAULT_STORE_DIR):
+    """
+    Publish the pairs tables and zipcode geometry as memory-mappable arrays.
+
+    The store is written to a new version directory first and then swapped in
+    by replace_store, so workers never attach to a half-written store.
+
+    Args:
+        store_dir (str): Directory the store is published to
+
+    Returns:
+        str: The store directory
+    """
+    tmp_dir = _new_store_dir(store_dir)
+
+    for kind, table in PAIR_TABLES.items():
+        _publish_pairs(table, os.path.join(tmp_dir, kind))
+    _publish_geometry(ZIPCODE_GEOMETRY_FILE, os.path.join(tmp_dir, "geometry"))
+
+    replace_store(tmp_dir, store_dir)
+
+    return store_dir
+
+
+class SharedStore:
+    """
+    Read-only view over a published store.
+
+    Every array is opened with np.load(mmap_mode="r"), so all the processes on
+    a host share the same page-cache copy of the data instead of each loading
+    their own.
+
+    The view is pinned to the version store_dir pointed to when it was made,
+    artifacts read later come from that version even after a newer one is
+    published, so a table's metadata and arrays never mix versions.
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self.version_dir = os.path.realpath(store_dir)
+        self._arrays = {}
+        self._metadata = {}
+
+    def _array(self, *parts):
+        path = os.path.join(self.version_dir, *parts)
+        if path not in self._arrays:
+            self._arrays[path] = np.load(path, mmap_mode="r")
+        return self._arrays[path]
+
+    def _json(self, *parts):
+        path = os.path.join(self.version_dir, *parts)
+        if path not in self._metadata:
+            with open(path, "r") as f:
+                self._metadata[path] = json.load(f)
+        return self._metadata[path]
+
+    def has_pairs(self, kind):
+        """
+        Whether a pairs table was published to the store.
+
+        Args:
+            kind (str): "cbsa" or "zipcode"
+
+        Returns:
+            bool: Whether the table and its adjacency can be read
+        """
+        return all(
+            os.path.exists(os.path.join(self.version_dir, kind, name))
+            for name in ["entities.json", "adjacency_values.npy"]
+        )
+
+    def has_geometry(self):
+        """
+        Whether the zipcode geometry was published to the store.
+
+        Returns:
+            bool: Whether the geometry can be read
+        """
+        return os.path.exists(
+            os.path.join(self.version_dir, "geometry", "features.json")
+        )
+
+    def entities(self, kind):
+        """
+        Get the entity index of a pairs table.
+
+        Args:
+            kind (str): "cbsa" or "zipcode"
+
+        Returns:
+            dict: Entity keys and labels, position in the lists is the entity ID
+        """
+        return self._json(kind, "entities.json")
+
+    def version(self, kind):
+        """
+        Get the version of a published pairs table.
+
+        Args:
+            kind (str): "cbsa" or "zipcode"
+
+        Returns:
+            str: Version of the source the table was built from
+        """
+        version = self.entities(kind).get("version")
+        if version is None:
+            # Published before tables recorded their version
+            version = file_version(
+                os.path.join(self.version_dir, kind, "entities.json")
+            )
+
+        return version
+
+    def is_current(self):
+        """
+        Whether this view still reads the version published at store_dir.
+
+        Returns:
+            bool: False once a newer version was published
+        """
+        return os.path.realpath(self.store_dir) == self.version_dir
+
+    def pair_ids(self, kind):
+        """
+        Get the entity IDs of both ends of every pair.
+
+        Args:
+            kind (str): "cbsa" or "zipcode"
+
+        Returns:
+            tuple: (id1, id2) memory-mapped int32 arrays
+        """
+        return self._array(kind, "id1.npy"), self._array(kind, "id2.npy")
+
+    def adjacency(self, kind):
+        """
+        Get the pair index adjacency of a pairs table.
+
+        Args:
+            kind (str): "cbsa" or "zipcode"
+
+        Returns:
+            tuple: (neighbours, values, offsets) memory-mapped arrays, values
+            holding every feature column in entities()["feature_columns"] order
+        """
+        return (
+            self._array(kind, "adjacency_neighbours.npy"),
+            self._array(kind, "adjacency_values.npy"),
+            self._array(kind, "adjacency_offsets.npy"),
+        )
+
+    def pair_features(self, kind, columns=None):
+        """
+        Get the feature columns of a pairs table.
+
+        Args:
+            kind (str): "cbsa" or "zipcode"
+            columns (list, optional): Feature columns to return, defaults to all of them
+
+        Returns:
+            dict: Memory-mapped float64 array per column
+        """
+        if columns is None:
+            columns = self.entities(kind)["feature_columns"]
+        return {column: self._array(kind, f"{column}.npy") for column in columns}
+
+    def pairs_frame(self, kind):
+        """
+        Rebuild the pairs table as a polars DataFrame with the CSV's columns.
+
+        Args:
+            kind (str): "cbsa" or "zipcode"
+
+        Returns:
+            pl.DataFrame: The pairs table
+        """
+        table = PAIR_TABLES[kind]
+        entities = self.entities(kind)
+        id1, id2 = self.pair_ids(kind)
+        keys = pl.Series(entities["keys"])
+        labels = pl.Series(entities["labels"])
+
+        columns = {
+            table["keys"][0]: keys.gather(id1),
+            table["keys"][1]: keys.gather(id2),
+            table["labels"][0]: labels.gather(id1),
+            table["labels"][1]: labels.gather(id2),
+        }
+        for column, values in self.pair_features(kind).items():
+            columns[column] = pl.Series(column, values)
+
+        # Restore the nulls hidden behind the validity masks
+        null_columns = [
+            pl.when(pl.lit(pl.Series(self._array(kind, f"{column}.valid.npy"))))
+            .then(pl.col(column))
+            .alias(column)
+            for column in entities["null_columns"]
+        ]
+
+        return (
+            pl.DataFrame(columns).with_columns(null_columns).select(entities["columns"])
+        )
+
+    def zipcode_features(self, city_names=None):
+        """
+        Rebuild the zipcode GeoJSON features from the geometry arrays.
+
+        Only the features asked for are turned into coordinate lists, which
+        folium needs, so a page holds the polygons it draws and nothing more.
+
+        Args:
+            city_names (list, optional): Cities whose zipcodes are returned, all by default
+
+        Returns:
+            list: GeoJSON features in the original file order
+        """
+        metadata = self._json("geometry", "features.json")
+        coords = self._array("geometry", "coords.npy")
+        ring_offsets = self._array("geometry", "ring_offsets.npy")
+        polygon_offsets = self._array("geometry", "polygon_offsets.npy")
+        feature_offsets = self._array("geometry", "feature_offsets.npy")
+
+        features = []
+        for i, geometry_type in enumerate(metadata["types"]):
+            properties = metadata["properties"][i]
+            if city_names is not None and properties["city_name"] not in city_names:
+                continue
+            polygons = []
+            for p in range(feature_offsets[i], feature_offsets[i + 1]):
+                polygons.append(
+                    [
+                        coords[ring_offsets[r] : ring_offsets[r + 1]].tolist()
+                        for r in range(polygon_offsets[p], polygon_offsets[p + 1])
+                    ]
+                )
+
+            features.append(
+                {
+                    "type": "Feature",
+                    "properties": properties,
+                    "geometry": {
+                        "type": geometry_type,
+                        "coordinates": (
+                            polygons[0] if geometry_type == "Polygon" else polygons
+                        ),
+                    },
+                }
+            )
+
+        return features
+
+
+def attach_store(store_dir=DEFAULT_STORE_DIR):
+    """
+    Attach to a published store, once per process.
+
+    A store may hold only some of the tables, check has_pairs and has_geometry
+    before reading one. The store stays pinned to the version it attached to,
+    unless that version was pruned, see KEEP_STORE_VERSIONS.
+
+    Args:
+        store_dir (str): Directory the store was published to
+
+    Returns:
+        SharedStore: The attached store, or None if nothing was published there
+    """
+    store = _attached.get(store_dir)
+    if store is None or not os.path.isdir(store.version_dir):
+        if not os.path.isdir(store_dir):
+            return None
+        store = _attached[store_dir] = SharedStore(store_dir)
+
+    return store
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Publish the pairs tables and zipcode geometry as a shared store"
+    )
+    parser.add_argument("--out", default=DEFAULT_STORE_DIR, help="Store directory")
+    args = parser.parse_args()
+
+    print(f"Published shared store to {publish_store(args.out)}")
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+import helper
+from packed_model import ACCURACY_TOLERANCE, check_accuracy, load_or_pack
+
+
+@pytest.fixture(scope="module", params=sorted(helper.MODEL_KINDS.items()))
+def models(request, tmp_path_factory):
+    model_file, kind = request.param
+    booster = helper.load_lightgbm_booster(model_file)
+    packed = load_or_pack(model_file, str(tmp_path_factory.mktemp("packed")))
+
+    return kind, booster, packed
+
+
+def model_inputs(kind, n_features):
+    X = helper.sample_model_inputs(kind, drop_missing=False)
+    rng = np.random.default_rng(0)
+    special = rng.random((64, n_features))
+    # Missing and zero values take LightGBM's missing-type paths
+    special[:16] = np.nan
+    special[16:32] = 0.0
+    special[32:48][rng.random((16, n_features)) < 0.5] = np.nan
+    special[48:64][rng.random((16, n_features)) < 0.5] = 0.0
+
+    return np.vstack([X, special])
+
+
+def test_packed_model_matches_lightgbm(models):
+    kind, booster, packed = models
+    X = model_inputs(kind, booster.num_feature())
+
+    report = check_accuracy(booster, packed, X)
+
+    assert report["passed"], report
+    assert report["max_abs_diff"] <= ACCURACY_TOLERANCE
+
+
+def test_packed_model_keeps_the_rank_order(models):
+    kind, booster, packed = models
+    X = model_inputs(kind, booster.num_feature())
+
+    expected = booster.predict(X)
+    actual = packed.predict(X)
+
+    # Rows further apart than the tolerance keep their order
+    apart = np.abs(expected[:, None] - expected[None, :]) > 2 * ACCURACY_TOLERANCE
+    assert np.array_equal(
+        np.sign(expected[:, None] - expected[None, :])[apart],
+        np.sign(actual[:, None] - actual[None, :])[apart],
+    )
+
+
+def test_packed_model_describes_the_booster(models):
+    _, booster, packed = models
+
+    assert packed.num_trees() == booster.num_trees()
+    assert packed.feature_name() == booster.feature_name()
@@ -0,0 +1,87 @@
+import pickle
+import sqlite3
+import zlib
+
+import pytest
+
+import recommendation_cache
+from latency_budget import LatencyBudget
+from recommendation_cache import (
+    RecommendationCache,
+    recommendation_key,
+    remember_recommendation,
+    set_recommendation_cache,
+)
+from recommendation_result import RecommendationResult
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = RecommendationCache(path=str(tmp_path / "cache.sqlite"))
+    previous = recommendation_cache.get_recommendation_cache()
+    set_recommendation_cache(cache)
+    yield cache
+    set_recommendation_cache(previous)
+
+
+def result(skipped=(), degraded=False):
+    budget = LatencyBudget(8)
+    for name in ["score", "unpaired", "explain", "distances"]:
+        if name in skipped:
+            budget.skip(name, "over budget")
+        else:
+            with budget.stage(name):
+                pass
+
+    return RecommendationResult(
+        "Chicago", 90, {}, {}, degraded=degraded, stages=budget.report()
+    )
+
+
+def test_full_result_is_cached(cache):
+    remember_recommendation("key", result())
+
+    assert cache.get("key").recommended == "Chicago"
+    assert RecommendationCache(path=cache.path).get("key").stages["cache"] == "l2"
+
+
+@pytest.mark.parametrize("skipped", [["unpaired"], ["distances"], ["explain"]])
+def test_result_with_a_skipped_stage_is_not_cached(cache, skipped):
+    remember_recommendation("key", result(skipped))
+
+    assert cache.get("key") is None
+    assert cache.stats()["l2_entries"] == 0
+
+
+def test_degraded_result_is_not_cached(cache):
+    remember_recommendation("key", result(degraded=True))
+
+    assert cache.get("key") is None
+
+
+def test_random_fallback_is_not_cached(cache):
+    remember_recommendation("key", RecommendationResult("33139", 75, {}, {}))
+
+    assert cache.get("key") is None
+
+
+def test_unreadable_rows_are_misses_and_dropped(cache):
+    cache.put("key", result())
+    with sqlite3.connect(cache.path) as connection:
+        connection.execute(
+            "UPDATE recommendations SET value = ?",
+            (zlib.compress(pickle.dumps(object()))[:-4],),
+        )
+    fresh = RecommendationCache(path=cache.path)
+
+    assert fresh.warm() == 0
+    assert fresh.get("key") is None
+    assert fresh.stats()["l2_entries"] == 0
+
+
+def test_key_ignores_selection_order_but_not_versions():
+    key = recommendation_key("cbsa", "m1", "d1", ["A", "B"], ["C"])
+
+    assert key == recommendation_key("cbsa", "m1", "d1", ["B", "A"], ["C"])
+    assert key != recommendation_key("cbsa", "m2", "d1", ["A", "B"], ["C"])
+    assert key != recommendation_key("cbsa", "m1", "d2", ["A", "B"], ["C"])
@@ -0,0 +1,55 @@
+import json
+
+import pytest
+
+import helper
+from recommendation_table import load_recommendation_table
+
+
+@pytest.fixture(scope="module")
+def table_dir(tmp_path_factory):
+    table_dir = str(tmp_path_factory.mktemp("tables"))
+    helper.materialize_recommendation_table("cbsa", table_dir, max_more=1, max_less=0)
+
+    return table_dir
+
+
+def versions():
+    return helper.model_version(helper.CBSA_MODEL_FILE), helper.pairs_version("cbsa")
+
+
+def test_table_matching_the_loaded_versions_is_used(table_dir):
+    model_version, data_version = versions()
+
+    table = load_recommendation_table("cbsa", model_version, data_version, table_dir)
+
+    assert table is not None
+    assert table.meta["data_version"] == data_version
+
+
+def test_table_of_another_model_is_stale(table_dir):
+    _, data_version = versions()
+
+    assert load_recommendation_table("cbsa", "other", data_version, table_dir) is None
+
+
+def test_table_of_another_pairs_table_is_stale(table_dir):
+    model_version, _ = versions()
+
+    assert load_recommendation_table("cbsa", model_version, "other", table_dir) is None
+
+
+def test_table_without_a_data_version_is_stale(tmp_path):
+    model_version, data_version = versions()
+    helper.materialize_recommendation_table(
+        "cbsa", str(tmp_path), max_more=1, max_less=0
+    )
+    meta_file = tmp_path / "cbsa" / "meta.json"
+    meta = json.loads(meta_file.read_text())
+    del meta["data_version"]
+    meta_file.write_text(json.dumps(meta))
+
+    assert (
+        load_recommendation_table("cbsa", model_version, data_version, str(tmp_path))
+        is None
+    )
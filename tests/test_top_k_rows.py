@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+import helper
+from packed_model import EARLY_EXIT_MIN_ROWS, load_or_pack, top_k_rows
+
+
+@pytest.fixture(scope="module")
+def packed(tmp_path_factory):
+    return load_or_pack(helper.CBSA_MODEL_FILE, str(tmp_path_factory.mktemp("packed")))
+
+
+def inputs(n_rows, n_features, seed=0):
+    rng = np.random.default_rng(seed)
+    X = rng.random((n_rows, n_features))
+    X[rng.random((n_rows, n_features)) < 0.1] = np.nan
+
+    return X
+
+
+def full_ranking(scores, groups, k):
+    # k best rows of every group from the full predictions, ties by row index
+    order = np.lexsort((np.arange(len(scores)), -scores, groups))
+    best = []
+    for group in np.unique(groups):
+        best.extend([row for row in order if groups[row] == group][:k])
+
+    return np.asarray(best)
+
+
+@pytest.mark.parametrize("k", [1, 3])
+def test_early_exit_matches_the_full_ranking(packed, k):
+    X = inputs(4 * EARLY_EXIT_MIN_ROWS, len(packed.feature_name()))
+    groups = np.repeat(np.arange(8), len(X) // 8)
+
+    rows, scores = top_k_rows(packed, X, k, groups)
+
+    expected = full_ranking(packed.predict(X), groups, k)
+    assert np.array_equal(rows, expected)
+    np.testing.assert_allclose(scores, packed.predict(X)[expected], rtol=0, atol=1e-12)
+
+
+@pytest.mark.parametrize("n_rows", [1, 25, EARLY_EXIT_MIN_ROWS - 1])
+def test_small_inputs_match_the_full_ranking(packed, n_rows):
+    X = inputs(n_rows, len(packed.feature_name()), seed=n_rows)
+
+    rows, scores = top_k_rows(packed, X, k=1)
+
+    assert np.array_equal(rows, full_ranking(packed.predict(X), np.zeros(n_rows), 1))
+
+
+def test_lightgbm_booster_matches_the_full_ranking():
+    booster = helper.load_lightgbm_booster(helper.CBSA_MODEL_FILE)
+    X = inputs(200, booster.num_feature())
+    groups = np.arange(200) % 4
+
+    rows, _ = top_k_rows(booster, X, 2, groups)
+
+    assert np.array_equal(rows, full_ranking(booster.predict(X), groups, 2))
+
+
+def test_no_rows():
+    rows, scores = top_k_rows(None, np.zeros((0, 18)))
+
+    assert len(rows) == 0 and len(scores) == 0
@@ -0,0 +1,122 @@
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+CPU_COUNT = os.cpu_count() or 1
+
+# Recommendation requests run at the same time, one core each by default
+REQUEST_WORKERS = int(os.environ.get("CTS_REQUEST_WORKERS", CPU_COUNT))
+
+# Threads each library may use inside one request. With every core busy serving
+# a request, more threads per library only oversubscribe the cores.
+DEFAULT_LIBRARY_THREADS = max(1, CPU_COUNT // max(1, REQUEST_WORKERS))
+LIBRARY_THREADS = {
+    "polars": int(os.environ.get("CTS_POLARS_THREADS", DEFAULT_LIBRARY_THREADS)),
+    "lightgbm": int(os.environ.get("CTS_LIGHTGBM_THREADS", DEFAULT_LIBRARY_THREADS)),
+    "blas": int(os.environ.get("CTS_BLAS_THREADS", DEFAULT_LIBRARY_THREADS)),
+}
+
+# Environment variables each library reads when it is loaded
+THREAD_ENV_VARS = {
+    "polars": ["POLARS_MAX_THREADS"],
+    # LightGBM predicts with the OpenMP default thread count
+    "lightgbm": ["OMP_NUM_THREADS"],
+    "blas": ["OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS", "VECLIB_MAXIMUM_THREADS"],
+}
+
+_configured = False
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _limit_loaded_libraries():
+    # Libraries loaded before configure_threads ignore the environment, so
+    # limit them at runtime when threadpoolctl is available
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        return
+
+    threadpool_limits(limits=LIBRARY_THREADS["blas"], user_api="blas")
+    # OpenMP limits are per thread, so every request worker applies them too
+    threadpool_limits(limits=LIBRARY_THREADS["lightgbm"], user_api="openmp")
+
+
+def configure_threads():
+    """
+    Apply the per-library thread counts, once per process.
+
+    Call it before polars, LightGBM and NumPy are imported where possible:
+    their thread pools read the environment when they are first loaded.
+
+    Returns:
+        bool: Whether this call applied the settings
+    """
+    global _configured
+    if _configured:
+        return False
+    _configured = True
+
+    for library, env_vars in THREAD_ENV_VARS.items():
+        for env_var in env_vars:
+            os.environ[env_var] = str(LIBRARY_THREADS[library])
+
+    if "polars" in sys.modules:
+        print("polars was imported before configure_threads, its pool keeps its size")
+    _limit_loaded_libraries()
+
+    return True
+
+
+def get_request_executor():
+    """
+    Get the bounded executor recommendation requests run in.
+
+    Returns:
+        ThreadPoolExecutor: Executor with REQUEST_WORKERS threads
+    """
+    global _executor
+    configure_threads()
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=REQUEST_WORKERS,
+                thread_name_prefix="request",
+                initializer=_limit_loaded_libraries,
+            )
+
+    return _executor
+
+
+def thread_settings():
+    """
+    Configured and effective thread settings of every library.
+
+    Returns:
+        dict: CPU count, request workers, configured threads per library, and
+        the thread pools actually loaded in this process
+    """
+    effective = {}
+    if "polars" in sys.modules:
+        effective["polars"] = sys.modules["polars"].thread_pool_size()
+    try:
+        from threadpoolctl import threadpool_info
+
+        for pool in threadpool_info():
+            name = f"{pool['user_api']}:{pool['internal_api']}"
+            effective[name] = pool["num_threads"]
+    except ImportError:
+        pass
+
+    return {
+        "cpu_count": CPU_COUNT,
+        "request_workers": REQUEST_WORKERS,
+        "configured": dict(LIBRARY_THREADS),
+        "effective": effective,
+        "environment": {
+            env_var: os.environ.get(env_var)
+            for env_vars in THREAD_ENV_VARS.values()
+            for env_var in env_vars
+        },
+    }
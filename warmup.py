@@ -0,0 +1,89 @@
+import threading
+import time
+
+# Seconds each warmup step took, filled in by the background thread
+_warmup_status = {"started": False, "finished": False, "steps": {}}
+_warmup_lock = threading.Lock()
+
+
+def warmup():
+    """
+    Import the heavy modules and load the models and data the recommenders need.
+
+    Returns:
+        dict: Seconds taken by each step
+    """
+    steps = {}
+
+    def step(name, load):
+        start = time.perf_counter()
+        try:
+            load()
+        except Exception as e:
+            print(f"Warmup step {name} failed: {e}")
+        steps[name] = round(time.perf_counter() - start, 3)
+        _warmup_status["steps"][name] = steps[name]
+
+    step("import_helper", lambda: __import__("helper"))
+
+    import helper
+
+    step("cbsa_model", lambda: helper.load_booster(helper.CBSA_MODEL_FILE))
+    step("zipcode_model", lambda: helper.load_booster(helper.ZIPCODE_MODEL_FILE))
+    step("cbsa_pair_index", lambda: helper.get_candidate_mask("cbsa"))
+    step("zipcode_pair_index", lambda: helper.get_candidate_mask("zipcode"))
+    step("cbsa_explainer", lambda: helper.get_lime_explainer(helper.CBSA_MODEL_FILE))
+    step(
+        "zipcode_explainer",
+        lambda: helper.get_lime_explainer(helper.ZIPCODE_MODEL_FILE),
+    )
+    step(
+        "recommendation_cache",
+        lambda: helper.get_recommendation_cache().warm(),
+    )
+    step(
+        "import_pages",
+        lambda: [
+            __import__(page)
+            for page in ["city_recommendation_page", "area_recommendation_page"]
+        ],
+    )
+
+    return steps
+
+
+def _run_warmup():
+    warmup()
+    _warmup_status["finished"] = True
+    print(f"Warmup finished: {_warmup_status['steps']}")
+
+
+def start_background_warmup():
+    """
+    Run the warmup once per process in a daemon thread, so it never delays a page.
+
+    Returns:
+        bool: Whether this call started the warmup
+    """
+    with _warmup_lock:
+        if _warmup_status["started"]:
+            return False
+        _warmup_status["started"] = True
+
+    threading.Thread(target=_run_warmup, name="warmup", daemon=True).start()
+
+    return True
+
+
+def warmup_status():
+    """
+    Progress of the background warmup.
+
+    Returns:
+        dict: Whether it started and finished, and the seconds of every step done
+    """
+    return {
+        "started": _warmup_status["started"],
+        "finished": _warmup_status["finished"],
+        "steps": dict(_warmup_status["steps"]),
+    }